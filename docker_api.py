@@ -0,0 +1,202 @@
+import asyncio
+import contextlib
+import json
+import os
+import struct
+import urllib.parse
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+# Size of the chunks response bodies are read in.
+CHUNK_SIZE = 64 * 1024
+
+
+class DockerError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__("%d: %s" % (status, message))
+        self.status = status
+
+
+def default_socket() -> str:
+    """The daemon's socket, from DOCKER_HOST if that points to a unix socket"""
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host.replace("unix://", "", 1)
+    return DEFAULT_SOCKET
+
+
+class _Response:
+    def __init__(self, reader: asyncio.StreamReader, status: int, headers: Dict):
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self.complete = False  # the whole body has been read
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # skip the trailer
+                    while (await self._reader.readline()) not in [b"\r\n", b""]:
+                        pass
+                    break
+                yield await self._reader.readexactly(size)
+                await self._reader.readexactly(2)
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining > 0:
+                chunk = await self._reader.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(chunk)
+                yield chunk
+        else:  # the body ends with the connection
+            while True:
+                chunk = await self._reader.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        self.complete = True
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    async def json(self):
+        body = await self.read()
+        return json.loads(body) if body else None
+
+    def reusable(self) -> bool:
+        return (
+            self.complete
+            and self.headers.get("connection", "").lower() != "close"
+            and (
+                "content-length" in self.headers or "transfer-encoding" in self.headers
+            )
+        )
+
+
+class DockerClient:
+    """A client for the Docker Engine API, on the daemon's unix socket.
+
+    Connections are kept open (HTTP/1.1 keep-alive) and reused, instead of
+    starting a docker CLI process that connects to the daemon for every
+    command. A client must only be used from the event loop it was first
+    used on.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None):
+        self._socket_path = socket_path or default_socket()
+        self._idle = []
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+    @contextlib.asynccontextmanager
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        query: Optional[Dict] = None,
+        body: Optional[Dict] = None,
+    ) -> AsyncIterator[_Response]:
+        if query:
+            path += "?" + urllib.parse.urlencode(query)
+        data = json.dumps(body).encode() if body is not None else b""
+        request = (
+            "%s %s HTTP/1.1\r\n"
+            "Host: docker\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: %d\r\n"
+            "\r\n" % (method, path, len(data))
+        ).encode() + data
+        # an idle connection might have been closed by the daemon in the meantime
+        while True:
+            reused = len(self._idle) > 0
+            if reused:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_unix_connection(self._socket_path)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readuntil(b"\r\n")
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not reused:
+                    raise
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readuntil(b"\r\n")).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        response = _Response(reader, status, headers)
+        try:
+            yield response
+            if not response.complete:
+                await response.read()
+        except BaseException:
+            writer.close()
+            raise
+        if response.reusable():
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _call(
+        self,
+        method: str,
+        path: str,
+        query: Optional[Dict] = None,
+        body: Optional[Dict] = None,
+    ):
+        """Make a request and return the JSON it answers with."""
+        async with self._request(method, path, query, body) as response:
+            result = await response.json()
+        if response.status >= 400:
+            message = result.get("message", "") if isinstance(result, dict) else ""
+            raise DockerError(response.status, message)
+        return result
+
+    async def inspect_image(self, image: str) -> Dict:
+        return await self._call("GET", "/images/%s/json" % image)
+
+    async def stop(self, container: str, timeout: int = 10):
+        # a container that isn't running answers with 304
+        await self._call("POST", "/containers/%s/stop" % container, {"t": timeout})
+
+    async def exec(self, container: str, cmd: List[str]) -> Tuple[int, str]:
+        """Run a command in a container, return its exit code and its output."""
+        created = await self._call(
+            "POST",
+            "/containers/%s/exec" % container,
+            body={"AttachStdout": True, "AttachStderr": True, "Cmd": cmd},
+        )
+        exec_id = created["Id"]
+        async with self._request(
+            "POST", "/exec/%s/start" % exec_id, body={"Detach": False, "Tty": False}
+        ) as response:
+            stream = await response.read()
+        if response.status >= 400:
+            raise DockerError(response.status, stream.decode(errors="replace"))
+        output = _demultiplex(stream)
+        inspected = await self._call("GET", "/exec/%s/json" % exec_id)
+        return inspected["ExitCode"], output.decode("utf-8", errors="replace")
+
+
+def _demultiplex(stream: bytes) -> bytes:
+    """Join the frames of stdout and stderr of a multiplexed exec stream."""
+    output = []
+    offset = 0
+    while offset + 8 <= len(stream):
+        _, size = struct.unpack_from(">B3xI", stream, offset)
+        start, offset = offset + 8, offset + 8 + size
+        output.append(stream[start:offset])
+    return b"".join(output)
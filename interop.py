@@ -1,25 +1,60 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import inspect
 import json
 import logging
+import math
+import multiprocessing
 import os
+import pickle
 import random
 import re
 import shutil
 import statistics
 import string
-import subprocess
 import sys
 import tempfile
-from datetime import datetime
-from typing import Callable, List, Tuple
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
 
 import optuna
 import prettytable
 import testcases
 from Crypto.Cipher import AES
+from docker_api import DockerClient, DockerError
+from journal import Journal
 from result import TestResult
+from schedule import DurationHistory, predict_makespan
 from termcolor import colored
+from testbed import MAX_TESTBEDS, Testbed
 from testcases import Perspective
 
+# Containers can print long lines, e.g. when dumping packets.
+STREAM_LIMIT = 16 * 1024 * 1024
+
+# How long compose may take to stop the containers once the test is over.
+COMPOSE_STOP_TIMEOUT = 10
+
+# How many tests of a testbed may wait for their check, while the next runs.
+PIPELINE_DEPTH = 1
+
+# How many trials an optimization study runs.
+STUDY_TRIALS = 10000
+
+# How often the progress of a transfer is reported, in seconds.
+PROGRESS_INTERVAL = 1.0
+
+# The containers of the HTTP/2 baseline, as named by docker-compose.
+HTTP2_CLIENT = "quic-interop-runner_http2_client_1"
+HTTP2_SERVER = "quic-interop-runner_http2_server_1"
+
+# The log handler of the test that the current task is running.
+_test_log_handler = contextvars.ContextVar("test_log_handler", default=None)
+
 
 def random_string(length: int):
     """Generate a random string of fixed length"""
@@ -27,6 +62,181 @@ def random_string(length: int):
     return "".join(random.choice(letters) for i in range(length))
 
 
+@functools.lru_cache(maxsize=None)
+def test_definition(test, filesize: Optional[int] = None) -> str:
+    """A digest of the code of a test case, including what it inherits
+
+    The digest covers the constants of the classes as well, since some of them
+    are read from a configuration file (e.g. the FILESIZE of the QUIC
+    optimization), and the file size that replaces FILESIZE, if any.
+    """
+    h = hashlib.sha256()
+    for cls in test.__mro__[:-1]:  # without object
+        try:
+            h.update(inspect.getsource(cls).encode())
+        except (OSError, TypeError):
+            h.update(cls.__qualname__.encode())
+        constants = sorted(
+            (name, value)
+            for name, value in vars(cls).items()
+            if name.isupper() and isinstance(value, (int, float, str))
+        )
+        h.update(repr(constants).encode())
+    if filesize is not None:
+        h.update(b"filesize=%d" % filesize)
+    return h.hexdigest()[:16]
+
+
+async def run_in_thread(func, *args, executor=None):
+    """Run blocking work (e.g. analyzing traces) without blocking other tests.
+
+    The work runs in the current context, so that it logs to the current test.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(ctx.run, func, *args))
+
+
+async def run_command(
+    cmd: List[str],
+    env: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+) -> Tuple[int, str]:
+    """Run a command, return its exit code and its output (stdout and stderr).
+
+    The variables in env are added to the environment. On timeout, the
+    command is killed and asyncio.TimeoutError is raised.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        env=dict(os.environ, **env) if env else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        limit=STREAM_LIMIT,
+    )
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, output.decode("utf-8", errors="replace")
+
+
+def robust_value(values: List[float], objective: str, k: float) -> float:
+    """Sum up repeated measurements of a trial.
+
+    objective is mean, median, or lower_bound: the mean minus k standard
+    errors, so that a trial with few or very different measurements doesn't
+    rank high by luck.
+    """
+    if objective == "median":
+        return statistics.median(values)
+    mean = statistics.mean(values)
+    if objective == "lower_bound" and len(values) > 1:
+        return mean - k * statistics.stdev(values) / math.sqrt(len(values))
+    return mean
+
+
+class LogRecordCollector(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord):
+        # the arguments and the exception might not be picklable
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def init_check_worker():
+    """Set up a worker process that checks test cases."""
+    # what the checks log is sent back, and logged to the test
+    logger = logging.getLogger()
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+
+def check_testcase(
+    testcase: testcases.TestCase,
+) -> Tuple[TestResult, testcases.TestCase, List[logging.LogRecord]]:
+    """Check a test case, in a worker process.
+
+    Return the result, the checked test case (which holds e.g. the value of a
+    measurement) and what the check logged.
+    """
+    collector = LogRecordCollector()
+    logger = logging.getLogger()
+    logger.addHandler(collector)
+    try:
+        status = testcase.check()
+    finally:
+        logger.removeHandler(collector)
+    return status, testcase, collector.records
+
+
+class PreparedTest:
+    """A test that is ready to run, or that already ran (then result is set)"""
+
+    def __init__(
+        self,
+        server: str,
+        client: str,
+        log_dir_prefix: Optional[str],
+        cell: Dict,
+        testbed: Testbed,
+        trial_params: Optional[Dict],
+    ):
+        self.server = server
+        self.client = client
+        self.log_dir_prefix = log_dir_prefix
+        self.cell = cell
+        self.testbed = testbed
+        self.trial_params = trial_params
+        self.result = None
+        self.created = False  # the containers are created already
+        self.reports = []  # (step, goodput) reported while it ran
+        self.pruned = False  # stopped by the pruner of its study
+
+
+class Job:
+    """A test (or a whole optimization study) for the next free testbed"""
+
+    def __init__(
+        self,
+        server: str,
+        client: str,
+        test: Callable[[], testcases.TestCase],
+        log_dir_prefix: Optional[str] = None,
+        study: bool = False,
+    ):
+        self.server = server
+        self.client = client
+        self.test = test
+        self.log_dir_prefix = log_dir_prefix
+        self.study = study
+        self.estimate = 0.0  # seconds on a testbed
+        # cancelled once the job isn't needed anymore
+        self.result = asyncio.get_running_loop().create_future()
+
+
+def copy_result(future: asyncio.Future, done: asyncio.Future):
+    """Pass the outcome of done on to future, unless that's cancelled."""
+    if future.cancelled():
+        return
+    if done.cancelled():
+        future.cancel()
+    elif done.exception() is not None:
+        future.set_exception(done.exception())
+    else:
+        future.set_result(done.result())
+
+
 class MeasurementResult:
     result = TestResult
     details = str
@@ -52,6 +262,23 @@ class InteropRunner:
     _output = ""
     _log_dir = ""
     _save_files = False
+    _trace_backend = "pyshark"
+    _trace_cache = False
+    _parallel = 1
+    _precreate = False
+    _compliance_cache_file = ""
+    _compliance_cache = {}
+    _image_ids = {}
+    _journal = None
+    _previous = None
+    _cached_cells = set()
+    _executed_cells = set()
+    _docker = None
+    _check_pool = None
+    _history = None
+    _studies_file = ""
+    _storage = None
+    _warm_start = 0
 
     def __init__(
         self,
@@ -64,6 +291,16 @@ class InteropRunner:
         debug: bool,
         save_files=False,
         log_dir="",
+        trace_backend="pyshark",
+        trace_cache=False,
+        parallel=1,
+        compliance_cache="compliance.json",
+        resume=False,
+        previous="",
+        precreate=False,
+        history="durations.json",
+        studies="studies.db",
+        warm_start=0,
     ):
         logger = logging.getLogger()
         logger.setLevel(logging.DEBUG)
@@ -82,11 +319,37 @@ class InteropRunner:
         self._output = output
         self._log_dir = log_dir
         self._save_files = save_files
+        self._trace_backend = trace_backend
+        self._trace_cache = trace_cache
+        if not 1 <= parallel <= MAX_TESTBEDS:
+            sys.exit("Can run 1 to %d tests in parallel." % MAX_TESTBEDS)
+        self._parallel = parallel
+        if precreate and 2 * parallel > MAX_TESTBEDS:
+            sys.exit(
+                "Can run 1 to %d tests in parallel with precreate."
+                % (MAX_TESTBEDS // 2)
+            )
+        self._precreate = precreate
+        self._compliance_cache_file = compliance_cache
+        self._compliance_cache = self._load_compliance_cache()
+        self._history = DurationHistory(history)
+        self._studies_file = studies
+        self._storage = None
+        self._warm_start = warm_start
         if len(self._log_dir) == 0:
             self._log_dir = "logs_{:%Y-%m-%dT%H:%M:%S}".format(self._start_time)
-        if os.path.exists(self._log_dir):
+        if resume and len(log_dir) == 0:
+            sys.exit("Resuming a run needs its log dir.")
+        if os.path.exists(self._log_dir) and not resume:
             sys.exit("Log dir " + self._log_dir + " already exists.")
         logging.info("Saving logs to %s.", self._log_dir)
+        self._image_ids = {}
+        self._journal = Journal(self._log_dir + "/journal.jsonl", resume)
+        if os.path.isdir(previous):
+            previous += "/journal.jsonl"
+        self._previous = Journal(previous, resume=True) if previous else None
+        self._cached_cells = set()
+        self._executed_cells = set()
         for server in servers:
             self.test_results[server] = {}
             self.measurement_results[server] = {}
@@ -103,7 +366,128 @@ class InteropRunner:
             "exit status 127" in str(line) for line in lines
         )
 
-    def _check_impl_is_compliant(self, name: str) -> bool:
+    async def _compose_up(
+        self,
+        testbed: Testbed,
+        flags: List[str],
+        services: List[str],
+        env: Dict[str, str],
+        timeout: Optional[float] = None,
+    ) -> Tuple[List[str], bool]:
+        """Run docker compose up, return its output and whether it timed out.
+
+        The output is read while the containers run. As soon as a container
+        exits, compose gets COMPOSE_STOP_TIMEOUT seconds to stop the others,
+        then they are stopped explicitly.
+        """
+        proc = await asyncio.create_subprocess_exec(
+            *testbed.compose("up", *flags, *services),
+            env=dict(os.environ, **env),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=STREAM_LIMIT,
+        )
+        lines = []
+        exited = asyncio.Event()
+
+        async def read_output():
+            async for line in proc.stdout:
+                line = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                lines.append(line)
+                if "exited with code" in line or self._is_unsupported([line]):
+                    exited.set()
+
+        reader = asyncio.ensure_future(read_output())
+        waiter = asyncio.ensure_future(exited.wait())
+        await asyncio.wait(
+            [reader, waiter], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+        expired = not reader.done() and not exited.is_set()
+        waiter.cancel()
+        if not reader.done() and not expired:
+            await asyncio.wait([reader], timeout=COMPOSE_STOP_TIMEOUT)
+        if not reader.done():
+            await self._stop_containers([testbed.container(s) for s in services])
+            await asyncio.wait([reader], timeout=COMPOSE_STOP_TIMEOUT)
+        if not reader.done():
+            proc.kill()
+            await asyncio.wait([reader], timeout=COMPOSE_STOP_TIMEOUT)
+        if reader.done():
+            reader.result()
+        else:  # a child of compose still holds on to the output
+            reader.cancel()
+        await proc.wait()
+        return lines, expired
+
+    def _load_compliance_cache(self) -> Dict[str, Dict]:
+        if not self._compliance_cache_file:
+            return {}
+        try:
+            with open(self._compliance_cache_file) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.info(
+                "Ignoring compliance cache %s: %s", self._compliance_cache_file, e
+            )
+            return {}
+
+    def _save_compliance_cache(self):
+        if not self._compliance_cache_file:
+            return
+        # write to a temporary file first, so that readers never see half a cache
+        tmp = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                "w",
+                dir=os.path.dirname(self._compliance_cache_file) or ".",
+                delete=False,
+            ) as f:
+                tmp = f.name
+                json.dump(self._compliance_cache, f, indent=2)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self._compliance_cache_file)
+        except OSError as e:
+            logging.info(
+                "Couldn't write compliance cache %s: %s", self._compliance_cache_file, e
+            )
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+    async def _stop_containers(self, containers: List[str]):
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(
+                    *[self._docker.stop(c) for c in containers],
+                    return_exceptions=True,
+                ),
+                timeout=60,
+            )
+        except asyncio.TimeoutError:
+            logging.info("Stopping the containers timed out.")
+            return
+        for container, result in zip(containers, results):
+            if isinstance(result, Exception):
+                logging.debug("Stopping %s failed: %s", container, result)
+
+    async def _exec(self, container: str, cmd: List[str]) -> Tuple[int, str]:
+        try:
+            return await self._docker.exec(container, cmd)
+        except DockerError as e:
+            logging.debug("Running %s in %s failed: %s", cmd, container, e)
+            return -1, str(e)
+
+    async def _image_id(self, image: str) -> Optional[str]:
+        """The ID of the local image, which changes whenever the image does"""
+        try:
+            return (await self._docker.inspect_image(image))["Id"]
+        except DockerError:
+            return None
+
+    async def _check_impl_is_compliant(
+        self, name: str, testbed: Testbed = Testbed()
+    ) -> bool:
         """check if an implementation return UNSUPPORTED for unknown test cases"""
         if name in self.compliant:
             logging.debug(
@@ -111,70 +495,100 @@ class InteropRunner:
             )
             return self.compliant[name]
 
+        image = self._implementations[name]["image"]
+        image_id = await self._image_id(image)
+        self._image_ids[name] = image_id
+        if image_id in self._compliance_cache:
+            compliant = self._compliance_cache[image_id]["compliant"]
+            logging.debug(
+                "%s (%s) already tested for compliance: %s", name, image_id, compliant
+            )
+            self.compliant[name] = compliant
+            return compliant
+
+        compliant = await self._check_compliance(name, testbed)
+        # remember compliance test outcome
+        self.compliant[name] = compliant
+        if image_id is None:  # compose only just pulled the image
+            image_id = await self._image_id(image)
+        self._image_ids[name] = image_id
+        if image_id is not None:
+            self._compliance_cache[image_id] = {
+                "image": image,
+                "compliant": compliant,
+                "time": datetime.now().timestamp(),
+            }
+            self._save_compliance_cache()
+        return compliant
+
+    async def _check_compliance(self, name: str, testbed: Testbed) -> bool:
+        sim_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_sim_")
+        server_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_server_")
         client_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_client_")
         www_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="compliance_www_")
         certs_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="compliance_certs_")
         downloads_dir = tempfile.TemporaryDirectory(
             dir="/tmp", prefix="compliance_downloads_"
         )
-
-        testcases.generate_cert_chain(certs_dir.name)
-
-        # check that the client is capable of returning UNSUPPORTED
-        logging.debug("Checking compliance of %s client", name)
-        cmd = (
-            "CERTS=" + certs_dir.name + " "
-            "TESTCASE_CLIENT=" + random_string(6) + " "
-            "SERVER_LOGS=/dev/null "
-            "CLIENT_LOGS=" + client_log_dir.name + " "
-            "WWW=" + www_dir.name + " "
-            "DOWNLOADS=" + downloads_dir.name + " "
-            'SCENARIO="simple-p2p --delay=15ms --bandwidth=10Mbps --queue=25" '
-            "CLIENT=" + self._implementations[name]["image"] + " "
-            "SERVER="
-            + self._implementations[name]["image"]
-            + " "  # only needed so docker compose doesn't complain
-            "docker compose --env-file empty.env up --timeout 0 --abort-on-container-exit -V sim client"
-        )
-        output = subprocess.run(
-            cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-        )
-        if not self._is_unsupported(output.stdout.splitlines()):
-            logging.error("%s client not compliant.", name)
-            logging.debug("%s", output.stdout.decode("utf-8"))
-            self.compliant[name] = False
-            return False
-        logging.debug("%s client compliant.", name)
-
-        # check that the server is capable of returning UNSUPPORTED
-        logging.debug("Checking compliance of %s server", name)
-        server_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_server_")
-        cmd = (
-            "CERTS=" + certs_dir.name + " "
-            "TESTCASE_SERVER=" + random_string(6) + " "
-            "SERVER_LOGS=" + server_log_dir.name + " "
-            "CLIENT_LOGS=/dev/null "
-            "WWW=" + www_dir.name + " "
-            "DOWNLOADS=" + downloads_dir.name + " "
-            "CLIENT="
-            + self._implementations[name]["image"]
-            + " "  # only needed so docker compose doesn't complain
-            "SERVER=" + self._implementations[name]["image"] + " "
-            "docker compose --env-file empty.env up -V server"
-        )
-        output = subprocess.run(
-            cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-        )
-        if not self._is_unsupported(output.stdout.splitlines()):
-            logging.error("%s server not compliant.", name)
-            logging.debug("%s", output.stdout.decode("utf-8"))
-            self.compliant[name] = False
-            return False
-        logging.debug("%s server compliant.", name)
-
-        # remember compliance test outcome
-        self.compliant[name] = True
-        return True
+        written = [sim_log_dir, server_log_dir, client_log_dir, downloads_dir]
+        for d in written:
+            # containers that don't run as root need to write there as well
+            os.chmod(d.name, 0o777)
+        try:
+            await run_in_thread(testcases.generate_cert_chain, certs_dir.name)
+
+            # check that the client is capable of returning UNSUPPORTED
+            logging.debug("Checking compliance of %s client", name)
+            env = dict(
+                testbed.env(),
+                CERTS=certs_dir.name,
+                TESTCASE_CLIENT=random_string(6),
+                SIM_LOGS=sim_log_dir.name,
+                SERVER_LOGS="/dev/null",
+                CLIENT_LOGS=client_log_dir.name,
+                WWW=www_dir.name,
+                DOWNLOADS=downloads_dir.name,
+                SCENARIO="simple-p2p --delay=15ms --bandwidth=10Mbps --queue=25",
+                CLIENT=self._implementations[name]["image"],
+                # only needed so docker compose doesn't complain
+                SERVER=self._implementations[name]["image"],
+            )
+            lines, _ = await self._compose_up(
+                testbed,
+                ["--timeout", "0", "--abort-on-container-exit", "-V"],
+                ["sim", "client"],
+                env,
+            )
+            if not self._is_unsupported(lines):
+                logging.error("%s client not compliant.", name)
+                logging.debug("%s", "\n".join(lines))
+                return False
+            logging.debug("%s client compliant.", name)
+
+            # check that the server is capable of returning UNSUPPORTED
+            logging.debug("Checking compliance of %s server", name)
+            env = dict(
+                testbed.env(),
+                CERTS=certs_dir.name,
+                TESTCASE_SERVER=random_string(6),
+                SIM_LOGS=sim_log_dir.name,
+                SERVER_LOGS=server_log_dir.name,
+                CLIENT_LOGS="/dev/null",
+                WWW=www_dir.name,
+                DOWNLOADS=downloads_dir.name,
+                # only needed so docker compose doesn't complain
+                CLIENT=self._implementations[name]["image"],
+                SERVER=self._implementations[name]["image"],
+            )
+            lines, _ = await self._compose_up(testbed, ["-V"], ["server"], env)
+            if not self._is_unsupported(lines):
+                logging.error("%s server not compliant.", name)
+                logging.debug("%s", "\n".join(lines))
+                return False
+            logging.debug("%s server compliant.", name)
+            return True
+        finally:
+            self._remove_dirs(written + [www_dir, certs_dir])
 
     def _print_results(self):
         """print the interop table"""
@@ -230,6 +644,11 @@ class InteropRunner:
                 t.add_row(row)
             print(t)
 
+    def _is_cached(self, server: str, client: str, test) -> bool:
+        """whether all results of a test were copied from a previous run"""
+        cell = (server, client, test.name())
+        return cell in self._cached_cells and cell not in self._executed_cells
+
     def _export_results(self):
         if not self._output:
             return
@@ -268,6 +687,7 @@ class InteropRunner:
                             "abbr": test.abbreviation(),
                             "name": test.name(),  # TODO: remove
                             "result": r,
+                            "cached": self._is_cached(server, client, test),
                         }
                     )
                 out["results"].append(results)
@@ -283,6 +703,7 @@ class InteropRunner:
                             "abbr": measurement.abbreviation(),
                             "result": res.result.value,
                             "details": res.details,
+                            "cached": self._is_cached(server, client, measurement),
                         }
                     )
                 out["measurements"].append(measurements)
@@ -291,45 +712,257 @@ class InteropRunner:
         json.dump(out, f)
         f.close()
 
-    def _copy_logs(self, container: str, dir: tempfile.TemporaryDirectory):
-        cmd = (
-            "docker cp \"$(docker ps -a --format '{{.ID}} {{.Names}}' | awk '/^.* "
-            + container
-            + "$/ {print $1}')\":/logs/. "
-            + dir.name
+    async def _check(
+        self, testcase: testcases.TestCase
+    ) -> Tuple[TestResult, testcases.TestCase]:
+        """Check a test case, return its result and the checked test case.
+
+        Test cases that can't be sent to a worker process are checked here.
+        """
+        in_worker = self._check_pool is not None
+        if in_worker:
+            try:
+                pickle.dumps(testcase)
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                logging.debug("Can't check %s in a worker process: %s", testcase, e)
+                in_worker = False
+        if not in_worker:
+            return await run_in_thread(testcase.check), testcase
+        loop = asyncio.get_running_loop()
+        status, checked, records = await loop.run_in_executor(
+            self._check_pool, check_testcase, testcase
         )
-        r = subprocess.run(
-            cmd,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
-        if r.returncode != 0:
-            logging.info(
-                "Copying logs from %s failed: %s", container, r.stdout.decode("utf-8")
-            )
-
-    def _run_testcase(
-        self, server: str, client: str, test: Callable[[], testcases.TestCase]
-    ) -> TestResult:
-        return self._run_test(server, client, None, test)[0]
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        return status, checked
 
-    def _run_test(
+    async def _run_test(
         self,
         server: str,
         client: str,
         log_dir_prefix: None,
         test: Callable[[], testcases.TestCase],
-        server_params: str,
-        client_params: str,
+        server_params: str = "",
+        client_params: str = "",
+        testbed: Testbed = Testbed(),
+        trial_params: Optional[Dict] = None,
+        progress: Optional[Callable[[int, float, bool], Awaitable[bool]]] = None,
+        filesize: Optional[int] = None,
     ) -> Tuple[TestResult, float]:
+        prepared = await self._prepare_test(
+            server,
+            client,
+            log_dir_prefix,
+            test,
+            server_params,
+            client_params,
+            testbed,
+            trial_params,
+            filesize=filesize,
+        )
+        return await (await self._start_test(prepared, progress))
+
+    async def _work(self, testbed: Testbed, jobs: Deque[Job]):
+        """Run jobs from the front of the queue on a testbed, until none are left.
+
+        Every test is checked while the next ones run. With precreate, the
+        tests alternate between the testbed and its partner: the containers
+        of the next test are created on one, while a test runs on the other.
+        """
+        testbeds = [testbed]
+        if self._precreate:
+            testbeds.append(self._partner(testbed))
+        analyses = []
+        turn = 0
+        next_test = None
+        try:
+            while True:
+                if len(analyses) > PIPELINE_DEPTH:
+                    await asyncio.wait([analyses[-PIPELINE_DEPTH - 1]])
+                if next_test is not None:
+                    job, prepared = next_test[0], await next_test[1]
+                    next_test = None
+                else:
+                    job = self._next_job(jobs)
+                    if job is None:
+                        break
+                    if job.study:
+                        await self._run_study(job, testbed)
+                        continue
+                    prepared = await self._prepare_test(
+                        job.server,
+                        job.client,
+                        job.log_dir_prefix,
+                        job.test,
+                        testbed=testbeds[turn % len(testbeds)],
+                        create=self._precreate,
+                    )
+                if job.result.cancelled():
+                    await self._discard_test(prepared)
+                    continue
+                following = (
+                    self._next_job(jobs, studies=False) if self._precreate else None
+                )
+                if following is not None:
+                    next_test = following, asyncio.ensure_future(
+                        self._prepare_test(
+                            following.server,
+                            following.client,
+                            following.log_dir_prefix,
+                            following.test,
+                            testbed=testbeds[(turn + 1) % len(testbeds)],
+                            create=True,
+                        )
+                    )
+                analysis = await self._start_test(prepared)
+                turn += 1
+                if prepared.result is None:
+                    self._history.record(
+                        job.test.name(),
+                        job.server,
+                        job.client,
+                        (datetime.now() - prepared.start_time).total_seconds(),
+                    )
+                analysis.add_done_callback(functools.partial(copy_result, job.result))
+                analyses.append(analysis)
+        finally:
+            if next_test is not None:
+                # the run is stopped while the next test is being prepared
+                await self._discard_test(await next_test[1])
+
+    @staticmethod
+    def _next_job(jobs: Deque[Job], studies: bool = True) -> Optional[Job]:
+        """Take the next job that is still needed from the queue.
+
+        Without studies, an optimization study at the front is left there.
+        """
+        while jobs:
+            if jobs[0].result.cancelled():
+                jobs.popleft()
+            elif jobs[0].study and not studies:
+                return None
+            else:
+                return jobs.popleft()
+        return None
+
+    async def _run_study(self, job: Job, testbed: Testbed):
         start_time = datetime.now()
+        job.result.set_result(
+            await self._run_quic_optimization(job.server, job.client, job.test, testbed)
+        )
+        self._history.record(
+            job.test.name(),
+            job.server,
+            job.client,
+            (datetime.now() - start_time).total_seconds(),
+        )
+
+    def _partner(self, testbed: Testbed) -> Testbed:
+        """The testbed that takes turns with testbed, with precreate"""
+        return Testbed(testbed.index + self._parallel)
+
+    def _cell(
+        self,
+        server: str,
+        client: str,
+        log_dir_prefix: Optional[str],
+        test: Callable[[], testcases.TestCase],
+        server_params: str = "",
+        client_params: str = "",
+        filesize: Optional[int] = None,
+    ) -> Dict:
+        """What identifies a test in the journal"""
+        return {
+            "server_image": self._image_ids.get(server)
+            or self._implementations[server]["image"],
+            "client_image": self._image_ids.get(client)
+            or self._implementations[client]["image"],
+            "test": test.name(),
+            "definition": test_definition(test, filesize),
+            "scenario": test.scenario(),
+            "repetition": log_dir_prefix or "",
+            "server_params": server_params,
+            "client_params": client_params,
+        }
+
+    def _ran_before(self, job: Job) -> bool:
+        """Whether a test is in the journal, so it won't run again"""
+        cell = self._cell(job.server, job.client, job.log_dir_prefix, job.test)
+        return self._journal.get(cell) is not None or (
+            self._previous is not None and self._previous.get(cell) is not None
+        )
+
+    async def _prepare_test(
+        self,
+        server: str,
+        client: str,
+        log_dir_prefix: None,
+        test: Callable[[], testcases.TestCase],
+        server_params: str = "",
+        client_params: str = "",
+        testbed: Testbed = Testbed(),
+        trial_params: Optional[Dict] = None,
+        create: bool = False,
+        filesize: Optional[int] = None,
+    ) -> PreparedTest:
+        """Generate the files, certificates and environment of a test.
+
+        With create, the containers are created as well, so that running the
+        test only needs to start them. filesize replaces the size of the file
+        that a measurement transfers.
+        """
+        cell = self._cell(
+            server, client, log_dir_prefix, test, server_params, client_params, filesize
+        )
+        prepared = PreparedTest(
+            server, client, log_dir_prefix, cell, testbed, trial_params
+        )
+        entry = self._journal.get(cell)
+        if entry is None and self._previous is not None:
+            entry = self._previous.get(cell)
+            if entry is not None:
+                # copy the result forward, so that resuming this run finds it
+                entry = dict(entry, server=server, client=client, cached=True)
+                self._journal.append(entry)
+        if entry is not None:
+            print(
+                "Server: "
+                + server
+                + ". Client: "
+                + client
+                + ". Test case "
+                + test.name()
+                + " already ran"
+                + (" in a previous run: " if entry.get("cached") else ": ")
+                + entry["result"]
+            )
+            if entry.get("cached"):
+                self._cached_cells.add((server, client, test.name()))
+            else:
+                self._executed_cells.add((server, client, test.name()))
+            prepared.result = TestResult(entry["result"]), entry["value"]
+            prepared.reports = entry.get("reports", [])
+            prepared.pruned = entry.get("pruned", False)
+            return prepared
+
+        prepared.start_time = datetime.now()
+        # mounted as /logs, so the containers write their logs (and the
+        # simulator its pcaps) straight to the host
         sim_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_sim_")
         server_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_server_")
         client_log_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="logs_client_")
+        prepared.log_dirs = [sim_log_dir, server_log_dir, client_log_dir]
+        for d in prepared.log_dirs:
+            # containers that don't run as root need to write there as well
+            os.chmod(d.name, 0o777)
         log_file = tempfile.NamedTemporaryFile(dir="/tmp", prefix="output_log_")
         log_handler = logging.FileHandler(log_file.name)
         log_handler.setLevel(logging.DEBUG)
+        # other tests log at the same time, from other tasks
+        log_handler.addFilter(lambda record: _test_log_handler.get() is log_handler)
+        log_context = _test_log_handler.set(log_handler)
+        prepared.log_file = log_file
+        prepared.log_handler = log_handler
 
         formatter = LogFileFormatter("%(asctime)s %(message)s")
         log_handler.setFormatter(formatter)
@@ -339,7 +972,133 @@ class InteropRunner:
             sim_log_dir=sim_log_dir,
             client_keylog_file=client_log_dir.name + "/keys.log",
             server_keylog_file=server_log_dir.name + "/keys.log",
+            trace_backend=self._trace_backend,
+            trace_cache=self._trace_cache,
+            endpoints=testbed.endpoints(),
         )
+        if filesize is not None:
+            testcase.FILESIZE = filesize
+        prepared.testcase = testcase
+
+        # generating the files and certificates takes a while for large files
+        paths = await run_in_thread(testcase.get_paths)
+        certs_dir = await run_in_thread(testcase.certs_dir)
+        reqs = " ".join([testcase.urlprefix() + p for p in paths])
+        logging.debug("Requests: %s", reqs)
+        env = dict(
+            testbed.env(),
+            WAITFORSERVER="server:443",
+            CERTS=certs_dir,
+            TESTCASE_SERVER=testcase.testname(Perspective.SERVER),
+            TESTCASE_CLIENT=testcase.testname(Perspective.CLIENT),
+            WWW=testcase.www_dir(),
+            DOWNLOADS=testcase.download_dir(),
+            SIM_LOGS=sim_log_dir.name,
+            SERVER_LOGS=server_log_dir.name,
+            CLIENT_LOGS=client_log_dir.name,
+            SCENARIO=testcase.scenario(),
+            CLIENT=self._implementations[client]["image"],
+            SERVER=self._implementations[server]["image"],
+            REQUESTS=reqs,
+            VERSION=testcases.QUIC_VERSION,
+        )
+        for e in testcase.additional_envs():
+            if e:
+                key, _, value = e.partition("=")
+                env[key] = value
+
+        # Config
+        env["SERVER_PARAMS"] = server_params
+        env["CLIENT_PARAMS"] = client_params
+        prepared.env = env
+
+        prepared.containers = ["sim", "client", "server"] + [
+            c for c in testcase.additional_containers() if c
+        ]
+        if create:
+            try:
+                code, output = await run_command(
+                    testbed.compose("up", "--no-start", *prepared.containers),
+                    env=env,
+                    timeout=180,
+                )
+                logging.debug("%s", output)
+                prepared.created = code == 0
+            except asyncio.TimeoutError:
+                logging.debug("Creating the containers timed out.")
+        _test_log_handler.reset(log_context)
+        return prepared
+
+    async def _discard_test(self, prepared: PreparedTest):
+        """Clean up after a test that was prepared, but won't run."""
+        if prepared.result is not None:
+            return
+        if prepared.created:
+            # the containers mount the directories that are removed next
+            try:
+                code, output = await run_command(
+                    prepared.testbed.compose(
+                        "rm", "--force", "--stop", *prepared.containers
+                    ),
+                    env=prepared.env,
+                    timeout=60,
+                )
+                if code != 0:
+                    logging.info("Couldn't remove the containers: %s", output)
+            except asyncio.TimeoutError:
+                logging.info("Removing the containers timed out.")
+        logging.getLogger().removeHandler(prepared.log_handler)
+        prepared.log_handler.close()
+        self._cleanup_test(prepared)
+
+    def _cleanup_test(self, prepared: PreparedTest):
+        """Remove the files and logs of a test.
+
+        Containers that run as root leave files in the mounted directories
+        that the runner might not be allowed to remove. Those are left behind.
+        """
+        try:
+            prepared.testcase.cleanup()
+        except OSError as e:
+            logging.info("Couldn't remove the files of %s: %s", prepared.testcase, e)
+        self._remove_dirs(prepared.log_dirs)
+
+    @staticmethod
+    def _remove_dirs(dirs: List[tempfile.TemporaryDirectory]):
+        """Remove temporary directories, as far as possible."""
+        for d in dirs:
+            try:
+                d.cleanup()
+            except OSError as e:
+                shutil.rmtree(d.name, ignore_errors=True)
+                logging.info("Couldn't remove %s: %s", d.name, e)
+
+    async def _start_test(
+        self,
+        prepared: PreparedTest,
+        progress: Optional[Callable[[int, float, bool], Awaitable[bool]]] = None,
+    ) -> "asyncio.Future[Tuple[TestResult, float]]":
+        """Run a prepared test, return a future for its result.
+
+        The test is checked in the background: once this returns, the testbed
+        is free to run the next test. With progress, see _watch_transfer.
+        """
+        if prepared.result is not None:  # the test already ran
+            if progress is not None:
+                # report again what it reported then, and whether it was pruned
+                for i, (step, goodput) in enumerate(prepared.reports):
+                    last = i == len(prepared.reports) - 1
+                    await progress(step, goodput, prepared.pruned and last)
+            result = asyncio.get_running_loop().create_future()
+            result.set_result(prepared.result)
+            return result
+        server, client = prepared.server, prepared.client
+        testcase, testbed = prepared.testcase, prepared.testbed
+        self._executed_cells.add((server, client, testcase.name()))
+        if prepared.created:
+            # the preparation ran while the testbed was busy with another test
+            prepared.start_time = datetime.now()
+        log_context = _test_log_handler.set(prepared.log_handler)
         print(
             "Server: "
             + server
@@ -347,92 +1106,98 @@ class InteropRunner:
             + client
             + ". Running test case: "
             + str(testcase)
+            + (" on " + str(testbed) if self._parallel > 1 or self._precreate else "")
         )
 
-        reqs = " ".join([testcase.urlprefix() + p for p in testcase.get_paths()])
-        logging.debug("Requests: %s", reqs)
-        params = (
-            "WAITFORSERVER=server:443 "
-            "CERTS=" + testcase.certs_dir() + " "
-            "TESTCASE_SERVER=" + testcase.testname(Perspective.SERVER) + " "
-            "TESTCASE_CLIENT=" + testcase.testname(Perspective.CLIENT) + " "
-            "WWW=" + testcase.www_dir() + " "
-            "DOWNLOADS=" + testcase.download_dir() + " "
-            "SERVER_LOGS=" + server_log_dir.name + " "
-            "CLIENT_LOGS=" + client_log_dir.name + " "
-            'SCENARIO="{}" '
-            "CLIENT=" + self._implementations[client]["image"] + " "
-            "SERVER=" + self._implementations[server]["image"] + " "
-            'REQUESTS="' + reqs + '" '
-            'VERSION="' + testcases.QUIC_VERSION + '" '
-        ).format(testcase.scenario())
-        params += " ".join(testcase.additional_envs())
-
-        # Config
-        params += (
-            'SERVER_PARAMS="'
-            + server_params
-            + '" CLIENT_PARAMS="'
-            + client_params
-            + '"'
+        flags = ["--abort-on-container-exit", "--timeout", "1"]
+        logging.debug(
+            "Command: %s %s",
+            " ".join(k + "=" + v for k, v in prepared.env.items()),
+            " ".join(testbed.compose("up", *flags, *prepared.containers)),
         )
 
-        containers = "sim client server " + " ".join(testcase.additional_containers())
-        cmd = (
-            params
-            + " docker compose --env-file empty.env up --abort-on-container-exit --timeout 1 "
-            + containers
+        watcher = None
+        prepared.up_time = datetime.now()
+        if progress is not None:
+            watcher = asyncio.ensure_future(self._watch_transfer(prepared, progress))
+        lines, expired = await self._compose_up(
+            testbed,
+            flags,
+            prepared.containers,
+            prepared.env,
+            timeout=testcase.timeout(),
         )
-        logging.debug("Command: %s", cmd)
-
-        status = TestResult.FAILED
-        output = ""
-        expired = False
-        try:
-            r = subprocess.run(
-                cmd,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                timeout=testcase.timeout(),
-            )
-            output = r.stdout
-        except subprocess.TimeoutExpired as ex:
-            output = ex.stdout
-            expired = True
-
-        logging.debug("%s", output.decode("utf-8"))
+        if watcher is not None:
+            watcher.cancel()
+        logging.debug("%s", "\n".join(lines))
 
         if expired:
             logging.debug("Test failed: took longer than %ds.", testcase.timeout())
-            r = subprocess.run(
-                "docker compose --env-file empty.env stop " + containers,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                timeout=60,
-            )
-            logging.debug("%s", r.stdout.decode("utf-8"))
 
-        # copy the pcaps from the simulator
-        self._copy_logs("sim", sim_log_dir)
-        self._copy_logs("client", client_log_dir)
-        self._copy_logs("server", server_log_dir)
+        # the task logs to this test, too
+        analysis = asyncio.ensure_future(self._finish_test(prepared, lines, expired))
+        _test_log_handler.reset(log_context)
+        return analysis
+
+    async def _watch_transfer(
+        self,
+        prepared: PreparedTest,
+        progress: Callable[[int, float, bool], Awaitable[bool]],
+    ):
+        """Report the goodput of a running test so far, every PROGRESS_INTERVAL.
+
+        progress gets the number of the report and the goodput (in kbps) of
+        what the client downloaded since the containers were started, and
+        whether the test is to be pruned anyway (only when it is replayed).
+        Once it returns True, the test is stopped (and fails as pruned).
+        """
+        step = 0
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            step += 1
+            size = 0
+            for path, _, files in os.walk(prepared.testcase.download_dir()):
+                for name in files:
+                    try:
+                        size += os.path.getsize(os.path.join(path, name))
+                    except OSError:  # e.g. a temporary file that's gone again
+                        pass
+            elapsed = (datetime.now() - prepared.up_time).total_seconds()
+            goodput = 8 * size / (elapsed * 1000)
+            prepared.reports.append((step, goodput))
+            if await progress(step, goodput, False):
+                prepared.pruned = True
+                logging.debug(
+                    "Stopping the test after %ds, at %d kbps.", elapsed, goodput
+                )
+                await self._stop_containers(
+                    [prepared.testbed.container(c) for c in prepared.containers]
+                )
+                return
+
+    async def _finish_test(
+        self, prepared: PreparedTest, lines: List[str], expired: bool
+    ) -> Tuple[TestResult, float]:
+        """Check a test that ran, save its logs and clean up after it."""
+        server, client = prepared.server, prepared.client
+        testcase, log_dir_prefix = prepared.testcase, prepared.log_dir_prefix
+        status = TestResult.FAILED
+        checked = testcase
+        await run_in_thread(testcase.inject_secrets)
 
         if not expired:
-            lines = output.splitlines()
             if self._is_unsupported(lines):
                 status = TestResult.UNSUPPORTED
             elif any("client exited with code 0" in str(line) for line in lines):
                 try:
-                    status = testcase.check()
+                    status, checked = await self._check(testcase)
                 except FileNotFoundError as e:
                     logging.error(f"testcase.check() threw FileNotFoundError: {e}")
                     status = TestResult.FAILED
 
         # save logs
-        logging.getLogger().removeHandler(log_handler)
-        log_handler.close()
+        logging.getLogger().removeHandler(prepared.log_handler)
+        prepared.log_handler.close()
         if status == TestResult.FAILED or status == TestResult.SUCCEEDED:
             log_dir = self._log_dir + "/" + server + "_" + client + "/" + str(testcase)
             if log_dir_prefix:
@@ -442,7 +1207,25 @@ class InteropRunner:
             # shutil.copytree(sim_log_dir.name, log_dir + "/sim")
             if not os.path.exists(log_dir):
                 os.makedirs(log_dir)
-            shutil.copyfile(log_file.name, log_dir + "/output.txt")
+            shutil.copyfile(prepared.log_file.name, log_dir + "/output.txt")
+            # the traces with the TLS secrets embedded are all it takes to
+            # look into the test with Wireshark
+            sim_log_dir = prepared.log_dirs[0].name
+            for name in ["trace_node_left.pcapng", "trace_node_right.pcapng"]:
+                if not os.path.isfile(sim_log_dir + "/" + name):
+                    continue
+                os.makedirs(log_dir + "/sim", exist_ok=True)
+                try:
+                    await run_in_thread(
+                        shutil.copyfile,
+                        sim_log_dir + "/" + name,
+                        log_dir + "/sim/" + name,
+                    )
+                except OSError as e:
+                    logging.info("Could not copy %s: %s", name, e)
+            if hasattr(checked, "timeseries") and checked.timeseries() is not None:
+                with open(log_dir + "/goodput.json", "w") as f:
+                    json.dump(checked.timeseries().to_dict(), f)
             if self._save_files and status == TestResult.FAILED:
                 shutil.copytree(testcase.www_dir(), log_dir + "/www")
                 try:
@@ -450,32 +1233,51 @@ class InteropRunner:
                 except Exception as exception:
                     logging.info("Could not copy downloaded files: %s", exception)
 
-        testcase.cleanup()
-        server_log_dir.cleanup()
-        client_log_dir.cleanup()
-        sim_log_dir.cleanup()
+        # measurements also have a value
+        if hasattr(checked, "result"):
+            value = checked.result()
+        else:
+            value = None
+
+        entry = dict(
+            prepared.cell,
+            server=server,
+            client=client,
+            result=status.value,
+            value=value,
+            start_time=prepared.start_time.timestamp(),
+            end_time=datetime.now().timestamp(),
+        )
+        if prepared.trial_params is not None:
+            entry["params"] = prepared.trial_params
+        if prepared.reports:
+            entry["reports"] = prepared.reports
+        if prepared.pruned:
+            # replayed as pruned, not as failed, on --resume
+            entry["pruned"] = True
+        # before cleaning up, so that the result is kept, whatever happens then
+        self._journal.append(entry)
+
+        self._cleanup_test(prepared)
         logging.debug(
             "Test: %s took %ss, status: %s",
             str(testcase),
-            (datetime.now() - start_time).total_seconds(),
+            (datetime.now() - prepared.start_time).total_seconds(),
             str(status),
         )
 
-        # measurements also have a value
-        if hasattr(testcase, "result"):
-            value = testcase.result()
-        else:
-            value = None
-
         return status, value
 
-    def _run_measurement(
-        self, server: str, client: str, test: Callable[[], testcases.Measurement]
-    ) -> MeasurementResult:
+    async def _measurement_result(self, jobs: List[Job]) -> MeasurementResult:
+        """Wait for the repetitions of a measurement, in order"""
+        test = jobs[0].test
         values = []
-        for i in range(0, test.repetitions()):
-            result, value = self._run_test(server, client, "%d" % (i + 1), test)
+        for job in jobs:
+            result, value = await job.result
             if result != TestResult.SUCCEEDED:
+                # no need to run the repetitions that didn't start yet
+                for remaining in jobs:
+                    remaining.result.cancel()
                 res = MeasurementResult()
                 res.result = result
                 res.details = ""
@@ -516,11 +1318,17 @@ class InteropRunner:
         # Best result
         with open(self._log_dir + "/best_result.txt", "w") as f:
             test_time = datetime.now() - self._start_time
-            text = (
-                f"{best_test}Run took: {test_time}\n\n"
-                f"Mean with optimized params: {best_result}\n"
-                f"Mean with default params: {default_result}"
-            )
+            if best_result is None:  # no trial completed
+                text = (
+                    f"Run took: {test_time}\n\n"
+                    f"Mean with default params: {default_result}"
+                )
+            else:
+                text = (
+                    f"{best_test}Run took: {test_time}\n\n"
+                    f"Mean with optimized params: {best_result}\n"
+                    f"Mean with default params: {default_result}"
+                )
             f.write(text)
 
     def _export_opt_test_result(self, commands, goodput, counter, start_time, log_dir):
@@ -567,62 +1375,229 @@ class InteropRunner:
 
         return commands
 
-    def _compare_with_default_conf(
+    async def _compare_with_default_conf(
         self,
         server: str,
         client: str,
         test: Callable[[], testcases.Measurement],
-        server_cmd,
-        client_cmd,
-    ):
-        best_test_values = []
+        candidates: List[Tuple[str, str]],
+        testbed: Testbed = Testbed(),
+        objective: str = "mean",
+        k: float = 2,
+    ) -> Tuple[Optional[int], Optional[str], str]:
+        """Let the best parameters (server and client commands) of a study compete
+        against each other and against the default parameters.
+
+        Returns the index of the candidate that did best (by objective, see
+        robust_value), its result and the result of the default parameters.
+        Without candidates, only the default parameters are measured.
+        """
+        candidate_values = [[] for _ in candidates]
         default_test_values = []
 
         for i in range(5):
-            _, default_val = self._run_test(
+            _, default_val = await self._run_test(
                 server,
                 client,
                 f"default_{i}",
                 test,
                 "",
                 "",
+                testbed,
             )
 
             default_test_values.append(default_val)
 
-            _, opt_val = self._run_test(
-                server,
-                client,
-                f"best_{i}",
-                test,
-                server_cmd,
-                client_cmd,
-            )
-
-            best_test_values.append(opt_val)
+            for j, (server_cmd, client_cmd) in enumerate(candidates):
+                _, opt_val = await self._run_test(
+                    server,
+                    client,
+                    f"best_{i}" if len(candidates) == 1 else f"top{j + 1}_{i}",
+                    test,
+                    server_cmd,
+                    client_cmd,
+                    testbed,
+                )
 
-        best_result = "{:.0f} (± {:.0f}) {}".format(
-            statistics.mean(best_test_values),
-            statistics.stdev(best_test_values),
-            test.unit(),
-        )
+                candidate_values[j].append(opt_val)
 
         default_result = "{:.0f} (± {:.0f}) {}".format(
             statistics.mean(default_test_values),
             statistics.stdev(default_test_values),
             test.unit(),
         )
+        logging.debug("DEFAULT RESULT\n" + default_result + "\n")
+        if len(candidates) == 0:
+            return None, None, default_result
 
+        best = max(
+            range(len(candidates)),
+            key=lambda j: robust_value(candidate_values[j], objective, k),
+        )
+        best_test_values = candidate_values[best]
+
+        best_result = "{:.0f} (± {:.0f}) {}".format(
+            statistics.mean(best_test_values),
+            statistics.stdev(best_test_values),
+            test.unit(),
+        )
         logging.debug("BEST RESULT\n" + best_result + "\n")
-        logging.debug("DEFAULT RESULT\n" + default_result + "\n")
 
-        return best_result, default_result
+        return best, best_result, default_result
+
+    def _trial_testbeds(self, testbed: Testbed, count: int) -> List[Testbed]:
+        """The testbeds to run the trials of a study on: the study's testbed, and
+        count - 1 more that no other job runs on."""
+        # after the testbeds of the jobs, every testbed gets its share
+        first = self._parallel * (2 if self._precreate else 1)
+        first += testbed.index * (count - 1)
+        last = min(first + count - 1, MAX_TESTBEDS)
+        if last - first < count - 1:
+            logging.info(
+                "Not enough testbeds to run %d trials in parallel on %s.",
+                count,
+                testbed,
+            )
+        return [testbed] + [Testbed(i) for i in range(first, last)]
 
-    def _run_quic_optimization(
-        self, server: str, client: str, test: Callable[[], testcases.Measurement]
+    def _load_study(
+        self,
+        server: str,
+        client: str,
+        test: Callable[[], testcases.Measurement],
+        config: Dict,
+    ) -> Tuple[optuna.Study, List[int]]:
+        """Create the study of a server, client and scenario, or load it to go on.
+
+        Returns the study and the trials replayed from the journal.
+        """
+        filesize = "%s%s" % (config["filesize"], config.get("filesize_unit", "MB"))
+        attrs = {
+            "server": server,
+            "client": client,
+            "scenario": test.scenario(),
+            "filesize": filesize,
+            # a new image might do better with other parameters
+            "server_image": self._image_ids.get(server)
+            or self._implementations[server]["image"],
+            "client_image": self._image_ids.get(client)
+            or self._implementations[client]["image"],
+        }
+        # with fidelities, a trial's steps are the file sizes it ran with,
+        # otherwise the seconds its transfer ran for
+        fidelities = config.get("fidelities", [])
+        if fidelities:
+            attrs["fidelities"] = ",".join(str(f) for f in fidelities)
+        pruner = config.get("pruner")
+        if pruner == "median":
+            study_pruner = optuna.pruners.MedianPruner()
+        elif pruner == "hyperband":
+            study_pruner = optuna.pruners.HyperbandPruner(
+                min_resource=fidelities[0] if fidelities else 1,
+                max_resource=int(config["filesize"]) if fidelities else "auto",
+            )
+        elif pruner == "successive_halving":
+            study_pruner = optuna.pruners.SuccessiveHalvingPruner(
+                min_resource=fidelities[0] if fidelities else "auto"
+            )
+        else:
+            if pruner:
+                logging.info("Unknown pruner %s, not pruning.", pruner)
+            study_pruner = optuna.pruners.NopPruner()
+        # With trials running at the same time, the sampler pretends that the
+        # unfinished ones turned out badly, so that it doesn't suggest the same
+        # parameters for all of them.
+        study = optuna.create_study(
+            storage=self._study_storage(),
+            study_name="/".join(attrs.values()),
+            load_if_exists=True,
+            direction="maximize",
+            sampler=optuna.samplers.TPESampler(constant_liar=True),
+            pruner=study_pruner,
+        )
+        if study.trials:
+            # the trials that ran when the runner was interrupted won't finish
+            for trial in study.get_trials(
+                deepcopy=False, states=(optuna.trial.TrialState.RUNNING,)
+            ):
+                study.tell(trial.number, state=optuna.trial.TrialState.FAIL)
+            logging.info(
+                "Going on with study %s after %d trials.",
+                study.study_name,
+                len(study.trials),
+            )
+            return study, []
+        for key, value in attrs.items():
+            study.set_user_attr(key, value)
+
+        # When resuming, propose the trials of the interrupted run again. Their
+        # results are in the journal, so the study catches up without tests.
+        replayed = []
+        for entry in self._journal.entries():
+            if (
+                entry["server"] == server
+                and entry["client"] == client
+                and entry["test"] == test.name()
+                and "params" in entry
+            ):
+                # with fidelities, a trial ran several tests
+                counter = int(entry["repetition"].split("/")[0])
+                if counter not in replayed:
+                    replayed.append(counter)
+                    study.enqueue_trial(entry["params"], {"counter": counter})
+        if not replayed and self._warm_start > 0:
+            self._warm_start_study(study)
+        return study, replayed
+
+    def _warm_start_study(self, study: optuna.Study):
+        """Start with the best trials of the latest study of the same server and
+        client (e.g. with another scenario or image)."""
+        if self._study_storage() is None:
+            logging.info("Can't warm start a study without a study storage.")
+            return
+        server, client = study.user_attrs["server"], study.user_attrs["client"]
+        previous = [
+            s
+            for s in optuna.get_all_study_summaries(
+                self._study_storage(), include_best_trial=False
+            )
+            if s.study_name != study.study_name
+            and s.user_attrs.get("server") == server
+            and s.user_attrs.get("client") == client
+            and s.datetime_start is not None
+        ]
+        if not previous:
+            logging.info("No study of %s and %s to warm start from.", server, client)
+            return
+        latest = max(previous, key=lambda s: s.datetime_start)
+        trials = optuna.load_study(
+            study_name=latest.study_name, storage=self._study_storage()
+        ).get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,))
+        trials.sort(key=lambda t: t.value, reverse=True)
+        for trial in trials[: self._warm_start]:
+            study.enqueue_trial(trial.params, {"warm_start": latest.study_name})
+        logging.info(
+            "Warm starting with the best %d trials of study %s.",
+            min(len(trials), self._warm_start),
+            latest.study_name,
+        )
+
+    def _study_storage(self) -> Optional[optuna.storages.RDBStorage]:
+        """Where the studies are kept, None to keep them in memory"""
+        if self._storage is None and self._studies_file:
+            self._storage = optuna.storages.RDBStorage(
+                "sqlite:///" + os.path.abspath(self._studies_file)
+            )
+        return self._storage
+
+    async def _run_quic_optimization(
+        self,
+        server: str,
+        client: str,
+        test: Callable[[], testcases.Measurement],
+        testbed: Testbed = Testbed(),
     ) -> MeasurementResult:
         values = []
-        counter = 0
         output_tables = []
 
         def generate_command_strings(commands, server, client):
@@ -643,42 +1618,147 @@ class InteropRunner:
 
             return server_cmd.strip(), client_cmd.strip()
 
-        def objective(trial):
-            nonlocal counter
-            start_time = datetime.now()
-            commands = self._get_opt_cmds(server, trial)
+        def ask():
+            trial = study.ask()
+            return trial, self._get_opt_cmds(server, trial)
+
+        def report(trial, step, goodput):
+            """Report the goodput so far, return whether to prune the trial"""
+            trial.report(goodput, step)
+            return trial.should_prune()
+
+        async def evaluate(trial, counter, server_cmd, client_cmd, testbed, progress):
+            """Run the tests of a trial: with fidelities, with ever larger files,
+            while the pruner lets it go on.
+
+            Returns the result, the trial's value and whether it was pruned.
+            """
+            sizes = fidelities + [int(config["filesize"])]
+            unit = config.get("filesize_unit", "MB")
+            unit_size = testcases.KB if unit == "KB" else testcases.MB
+            for i, size in enumerate(sizes):
+                last = i == len(sizes) - 1
+                prefix = f"{counter}/{size}{unit}" if fidelities else str(counter)
+                goodputs = []
+                # the full file is transferred several times, as long as the
+                # trial might be the best one and its goodput isn't known well
+                # enough yet
+                while len(goodputs) < (max(repetitions, 1) if last else 1) or (
+                    last
+                    and len(goodputs) < max_repetitions
+                    and not confident(goodputs)
+                    and await promising(goodputs)
+                ):
+                    result, value = await self._run_test(
+                        server,
+                        client,
+                        (
+                            f"{prefix}/{len(goodputs) + 1}"
+                            if last and repeated
+                            else prefix
+                        ),
+                        test,
+                        server_cmd,
+                        client_cmd,
+                        testbed,
+                        trial.params,
+                        (
+                            progress
+                            if pruning and not fidelities and not goodputs
+                            else None
+                        ),
+                        filesize=size * unit_size,
+                    )
+                    if result != TestResult.SUCCEEDED:
+                        return result, value, False
+                    goodputs.append(value)
+                if last:
+                    if len(goodputs) > 1:
+                        logging.debug("Trial %d: %s", counter, goodputs)
+                    return result, robust_value(goodputs, objective, k), False
+                if await run_in_thread(
+                    report, trial, size, statistics.mean(goodputs), executor=executor
+                ):
+                    return TestResult.FAILED, None, True
+
+        def confident(goodputs: List[float]) -> bool:
+            """Whether the confidence interval of the mean goodput is tight"""
+            if len(goodputs) < 2:
+                return False
+            stderr = statistics.stdev(goodputs) / math.sqrt(len(goodputs))
+            return k * stderr <= width * statistics.mean(goodputs)
+
+        async def promising(goodputs: List[float]) -> bool:
+            """Whether a trial might still turn out to be better than the best"""
+            try:
+                best = await run_in_thread(lambda: study.best_value, executor=executor)
+            except ValueError:  # no trial completed yet
+                return True
+            optimistic = statistics.mean(goodputs)
+            if len(goodputs) > 1:
+                optimistic += k * statistics.stdev(goodputs) / math.sqrt(len(goodputs))
+            return optimistic >= best
+
+        async def run_trials(testbed: Testbed):
+            nonlocal asked
+            while asked < STUDY_TRIALS:
+                asked += 1
+                start_time = datetime.now()
+                trial, commands = await run_in_thread(ask, executor=executor)
+                # trials replayed from the journal keep their log directory
+                counter = trial.user_attrs.get("counter", trial.number + offset)
+
+                server_cmd, client_cmd = generate_command_strings(
+                    commands, server, client
+                )
 
-            server_cmd, client_cmd = generate_command_strings(commands, server, client)
+                pruned = False
 
-            result, value = self._run_test(
-                server, client, str(counter), test, server_cmd, client_cmd
-            )
+                async def progress(step: int, goodput: float, prune: bool) -> bool:
+                    nonlocal pruned
+                    pruned = (
+                        await run_in_thread(
+                            report, trial, step, goodput, executor=executor
+                        )
+                        or prune
+                    )
+                    return pruned
 
-            if result != TestResult.SUCCEEDED:
-                res = MeasurementResult()
-                res.result = result
-                res.details = ""
-                return res
+                result, value, pruned_rung = await evaluate(
+                    trial, counter, server_cmd, client_cmd, testbed, progress
+                )
+                pruned = pruned or pruned_rung
+
+                if result != TestResult.SUCCEEDED:
+                    state = optuna.trial.TrialState.FAIL
+                    if pruned:
+                        state = optuna.trial.TrialState.PRUNED
+                    await run_in_thread(
+                        functools.partial(study.tell, trial, state=state),
+                        executor=executor,
+                    )
+                    continue
 
-            log_dir = f"{self._log_dir}/{server}_{client}/{test.name()}/{counter}"
-            self._export_opt_test_result(commands, value, counter, start_time, log_dir)
+                log_dir = f"{self._log_dir}/{server}_{client}/{test.name()}/{counter}"
+                self._export_opt_test_result(
+                    commands, value, counter, start_time, log_dir
+                )
 
-            output_tables.append(
-                {"commands": commands, "goodput": value, "counter": counter}
-            )
+                output_tables.append(
+                    {"commands": commands, "goodput": value, "counter": counter}
+                )
 
-            values.append(value)
-            counter += 1
-            return value
+                values.append(value)
+                await run_in_thread(
+                    functools.partial(study.tell, trial, value), executor=executor
+                )
 
         def params_to_cmd_strings(best_params):
             server_cmds = ""
             client_cmds = ""
 
             for key, value in best_params.items():
-                cmd, target = key.rsplit(
-                    "_", 1
-                )
+                cmd, target = key.rsplit("_", 1)
                 if target == "server":
                     if server in ["lsquic", "my-lsquic"]:
                         server_cmds += f" {cmd}={value}"
@@ -692,79 +1772,123 @@ class InteropRunner:
 
             return server_cmds.strip(), client_cmds.strip()
 
-        study = optuna.create_study(direction="maximize")
-        study.optimize(objective, n_trials=10000)
-
-        best_params = study.best_params
-        # best_value = study.best_value
-
-        # Build best params as cmd string
-        best_server_cmd, best_client_cmd = params_to_cmd_strings(best_params)
+        with open("./opt/config.json", "r") as f:
+            config = json.load(f)
+        testbeds = self._trial_testbeds(testbed, int(config.get("parallel_trials", 1)))
+        # smaller files to try the trials with first, and how often to transfer
+        # the full file
+        fidelities = [int(f) for f in config.get("fidelities", [])]
+        repetitions = int(config.get("fidelity_repetitions", 1))
+        # up to how often to transfer the full file, until the confidence
+        # interval (mean ± k standard errors) is within width of the mean
+        max_repetitions = int(config.get("max_repetitions", 1))
+        k = float(config.get("confidence_k", 2))
+        width = float(config.get("confidence_width", 0.05))
+        # what the trials are ranked by, see robust_value
+        objective = config.get("objective", "mean")
+        if objective == "lower_bound":
+            # a single goodput has no standard error, it would rank by its
+            # value alone, ahead of trials that were measured more carefully
+            repetitions = max(repetitions, 2)
+        repeated = repetitions > 1 or max_repetitions > 1
+
+        # asking for a trial takes a while once the study has many trials (and
+        # the storage is a database), so the study is run in a thread, one call
+        # at a time
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            study, replayed = await run_in_thread(
+                self._load_study, server, client, test, config, executor=executor
+            )
+            # new trials are counted on from the last one that ran
+            offset = max(replayed) + 1 - len(replayed) if replayed else 0
+            finished = [
+                t
+                for t in await run_in_thread(study.get_trials, False, executor=executor)
+                if t.state.is_finished()
+            ]
+            asked = len(finished)
+            pruning = not isinstance(study.pruner, optuna.pruners.NopPruner)
+            values += [
+                t.value for t in finished if t.state == optuna.trial.TrialState.COMPLETE
+            ]
+            await asyncio.gather(*[run_trials(t) for t in testbeds])
+            completed = await run_in_thread(
+                functools.partial(
+                    study.get_trials,
+                    deepcopy=False,
+                    states=(optuna.trial.TrialState.COMPLETE,),
+                ),
+                executor=executor,
+            )
 
+        # the best trial might just have been lucky, so the best few compete
+        candidates = []
+        for trial in sorted(completed, key=lambda t: t.value, reverse=True):
+            # Build params as cmd string
+            cmds = params_to_cmd_strings(trial.params)
+            if cmds not in candidates:
+                candidates.append(cmds)
+            if len(candidates) == int(config.get("top_k", 1)):
+                break
+
+        if len(candidates) == 0:
+            # e.g. all trials were pruned
+            logging.info(
+                "No trial of %s and %s completed, only measuring the default "
+                "parameters.",
+                server,
+                client,
+            )
         # Let optimized params compete against default params
-        best_result, default_result = self._compare_with_default_conf(
-            server, client, test, best_server_cmd, best_client_cmd
+        best, best_result, default_result = await self._compare_with_default_conf(
+            server, client, test, candidates, testbed, objective, k
         )
+        if best is not None:
+            logging.debug("Best parameters: %s %s", *candidates[best])
 
         self._export_quic_optimization(output_tables, best_result, default_result)
-        
-        self._run_http2_transfer(test)
+
+        async with self._http2_lock:
+            await self._run_http2_transfer(test)
 
         logging.debug(values)
 
         res = MeasurementResult()
+        if len(values) == 0:
+            # no parameters were found to compare with the default ones
+            res.result = TestResult.FAILED
+            res.details = ""
+            return res
         res.result = TestResult.SUCCEEDED
         res.details = "{:.0f} (± {:.0f}) {}".format(
-            statistics.mean(values), statistics.stdev(values), test.unit()
+            statistics.mean(values),
+            statistics.stdev(values) if len(values) > 1 else 0,
+            test.unit(),
         )
         return res
 
-    def _fetch_file(self, size, unit, bandwidth, delay):
-        expired = False
-
+    async def _fetch_file(self, size, unit, bandwidth, delay):
         try:
-            r = subprocess.run(
-                "docker-compose up -d http2_client",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                timeout=180,
+            _, output = await run_command(
+                ["docker-compose", "up", "-d", "http2_client"], timeout=180
             )
-            output = r.stdout
-        except subprocess.TimeoutExpired as ex:
-            output = ex.stdout
-            expired = True
-
-        logging.debug("%s", output.decode("utf-8"))
-
-        if expired:
+            logging.debug("%s", output)
+        except asyncio.TimeoutError:
             logging.debug("Test failed: took longer than %ds.", 180)
-            r = subprocess.run(
-                "docker-compose stop http2_client",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                timeout=60,
-            )
-            logging.debug("%s", r.stdout.decode("utf-8"))
+            await self._stop_containers([HTTP2_CLIENT])
 
-        subprocess.run(
-            "docker exec quic-interop-runner_http2_client_1 tc qdisc add dev eth0 handle 1: ingress",
-            shell=True,
+        await self._exec(
+            HTTP2_CLIENT, "tc qdisc add dev eth0 handle 1: ingress".split()
         )
         # subprocess.run(
         #     f"docker exec http2_client tc filter add dev eth0 parent 1: protocol ip prio 50 u32 match ip src 0.0.0.0/0 police rate {bandwidth}mbit burst 10k drop flowid :1"
         # )
-        subprocess.run(
-            f"docker exec quic-interop-runner_http2_client_1 tc qdisc add dev eth0 root tbf rate {bandwidth}mbit latency {delay}ms burst 10k",
-            shell=True,
+        await self._exec(
+            HTTP2_CLIENT,
+            f"tc qdisc add dev eth0 root tbf rate {bandwidth}mbit latency {delay}ms burst 10k".split(),
         )
 
         curl_command = [
-            "docker-compose",
-            "exec",
-            "-T",
-            "http2_client",
             "curl",
             "-o",
             "/dev/null",
@@ -774,15 +1898,15 @@ class InteropRunner:
             "--cacert",
             "/certs/cert.pem",
             "https://172.28.1.1/",
-            "-k"
+            "-k",
         ]
 
         times = []
         for _ in range(5):
             logging.debug("Curling...")
-            result = subprocess.run(curl_command, stdout=subprocess.PIPE, text=True)
-            if result.returncode == 0:
-                time_s = float(result.stdout.strip())
+            code, output = await self._exec(HTTP2_CLIENT, curl_command)
+            if code == 0:
+                time_s = float(output.strip())
                 time_ms = time_s * 1000
                 goodput_bps = size * unit * 8 / time_s
                 goodput_kbps = goodput_bps / 1024
@@ -794,89 +1918,59 @@ class InteropRunner:
                 )
                 times.append(goodput_kbps)
             else:
-                print(f"Error during curl command: {result.stderr}")
+                print(f"Error during curl command: {output}")
 
-        subprocess.run(
-            "docker-compose stop http2_client",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            timeout=60,
-        )
+        await self._stop_containers([HTTP2_CLIENT])
 
         return times
 
-    def _run_http2_transfer(self, test):
-        subprocess.run("rm -rf ./http2/certs", shell=True)
+    def _generate_http2_files(self, size: int):
+        shutil.rmtree("./http2/certs", ignore_errors=True)
         testcases.generate_cert_chain("./http2/certs")
 
-        with open("./opt/config.json", "r") as f:
-            config = json.load(f)
-
-        size = int(config["filesize"])
-        unit = testcases.KB if config.get("filesize_unit") == "KB" else testcases.MB
-        bandwidth = int(config["bandwidth"])
-        delay = int(config["delay"])
-        
         # generate random file
-        FILESIZE = size * unit
         directory = "http2/www/"
         os.makedirs(directory, exist_ok=True)
         filename = "random_file"
         enc = AES.new(os.urandom(32), AES.MODE_OFB, b"a" * 16)
         file_path = os.path.join(directory, filename)
         with open(file_path, "wb") as f:
-            f.write(enc.encrypt(b" " * FILESIZE))
+            f.write(enc.encrypt(b" " * size))
 
-        expired = False
+    async def _run_http2_transfer(self, test):
+        with open("./opt/config.json", "r") as f:
+            config = json.load(f)
 
-        try:
-            r = subprocess.run(
-                "docker-compose up -d http2_server",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                timeout=180,
-            )
-            output = r.stdout
-        except subprocess.TimeoutExpired as ex:
-            output = ex.stdout
-            expired = True
+        size = int(config["filesize"])
+        unit = testcases.KB if config.get("filesize_unit") == "KB" else testcases.MB
+        bandwidth = int(config["bandwidth"])
+        delay = int(config["delay"])
 
-        logging.debug("%s", output.decode("utf-8"))
+        await run_in_thread(self._generate_http2_files, size * unit)
 
-        if expired:
-            logging.debug("Test failed: took longer than %ds.", 180)
-            r = subprocess.run(
-                "docker-compose stop http2_server",
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                timeout=60,
+        try:
+            _, output = await run_command(
+                ["docker-compose", "up", "-d", "http2_server"], timeout=180
             )
-            logging.debug("%s", r.stdout.decode("utf-8"))
+            logging.debug("%s", output)
+        except asyncio.TimeoutError:
+            logging.debug("Test failed: took longer than %ds.", 180)
+            await self._stop_containers([HTTP2_SERVER])
 
-        subprocess.run(
-            "docker exec quic-interop-runner_http2_server_1 tc qdisc add dev eth0 handle 1: ingress",
-            shell=True,
+        await self._exec(
+            HTTP2_SERVER, "tc qdisc add dev eth0 handle 1: ingress".split()
         )
         # subprocess.run(
         #     f"docker exec http2_server tc filter add dev eth0 parent 1: protocol ip prio 50 u32 match ip src 0.0.0.0/0 police rate 50mbit burst 10k drop flowid :1"
         # )
-        subprocess.run(
-            f"docker exec quic-interop-runner_http2_server_1 tc qdisc add dev eth0 root tbf rate {bandwidth}mbit latency {delay}ms burst 10k",
-            shell=True,
+        await self._exec(
+            HTTP2_SERVER,
+            f"tc qdisc add dev eth0 root tbf rate {bandwidth}mbit latency {delay}ms burst 10k".split(),
         )
 
-        times = self._fetch_file(size, unit, bandwidth, delay)
+        times = await self._fetch_file(size, unit, bandwidth, delay)
 
-        subprocess.run(
-            "docker-compose stop http2_server",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            timeout=60,
-        )
+        await self._stop_containers([HTTP2_SERVER])
 
         logging.debug("HTTP/2 TIMES\n")
         logging.debug(times)
@@ -888,10 +1982,94 @@ class InteropRunner:
 
         logging.debug(result)
 
-    def run(self):
-        """run the interop test suite and output the table"""
+    def _jobs(self, server: str, client: str) -> List[List[Job]]:
+        """The jobs of a server and client: every test case, every repetition of
+        a measurement and every optimization study is a job of its own."""
+        jobs = [[Job(server, client, test)] for test in self._tests]
+        for measurement in self._measurements:
+            if measurement.abbreviation() == "QO":
+                jobs.append([Job(server, client, measurement, study=True)])
+            else:
+                jobs.append(
+                    [
+                        Job(server, client, measurement, "%d" % (i + 1))
+                        for i in range(0, measurement.repetitions())
+                    ]
+                )
+        return jobs
+
+    def _estimate(self, job: Job) -> float:
+        """How long a job is expected to take on a testbed, in seconds"""
+        if not job.study and self._ran_before(job):
+            return 0
+        name = job.test.name()
+        estimate = self._history.get(name, job.server, job.client)
+        if estimate is None:
+            estimate = self._history.typical(name)
+        if estimate is None:
+            estimate = job.test.timeout()
+        return estimate
+
+    async def _collect(self, jobs: List[Job]) -> int:
+        """Wait for the jobs of a test case or measurement, store the result.
+
+        Returns the number of failed test cases.
+        """
+        server, client, test = jobs[0].server, jobs[0].client, jobs[0].test
+        if test in self._measurements:
+            if jobs[0].study:
+                res = await jobs[0].result
+            else:
+                res = await self._measurement_result(jobs)
+            self.measurement_results[server][client][test] = res
+            return 0
+        status, _ = await jobs[0].result
+        self.test_results[server][client][test] = status
+        return 1 if status == TestResult.FAILED else 0
+
+    async def _run(self) -> int:
+        self._docker = DockerClient()
+        # every testbed can run an optimization study, whose trials run on
+        # testbeds of their own, and all of them can finish at the same time
+        workers = self._parallel
+        if any(m.abbreviation() == "QO" for m in self._measurements):
+            with open("./opt/config.json", "r") as f:
+                config = json.load(f)
+            workers *= int(config.get("parallel_trials", 1))
+        # checking a test takes a while (dissecting its traces), check it in
+        # another process, while the next test runs
+        self._check_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers * PIPELINE_DEPTH,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_check_worker,
+        )
+        try:
+            return await self._run_all()
+        finally:
+            await self._docker.close()
+            self._check_pool.shutdown()
+
+    async def _run_all(self) -> int:
+        # the HTTP/2 containers are shared by all testbeds
+        self._http2_lock = asyncio.Lock()
+        testbeds = asyncio.Queue()
+        for i in range(self._parallel):
+            testbeds.put_nowait(Testbed(i))
+
+        async def on_testbed(func, *args):
+            testbed = await testbeds.get()
+            try:
+                return await func(*args, testbed)
+            finally:
+                testbeds.put_nowait(testbed)
+
+        # check all implementations up front, concurrently
+        names = dict.fromkeys(self._servers + self._clients)
+        await asyncio.gather(
+            *[on_testbed(self._check_impl_is_compliant, name) for name in names]
+        )
 
-        nr_failed = 0
+        jobs = []
         for server in self._servers:
             for client in self._clients:
                 logging.debug(
@@ -901,28 +2079,45 @@ class InteropRunner:
                     client,
                     self._implementations[client]["image"],
                 )
-                if not (
-                    self._check_impl_is_compliant(server)
-                    and self._check_impl_is_compliant(client)
-                ):
+                if not (self.compliant[server] and self.compliant[client]):
                     logging.info("Not compliant, skipping")
                     continue
+                jobs += self._jobs(server, client)
+
+        for group in jobs:
+            for job in group:
+                job.estimate = self._estimate(job)
+        # longest first, so that no testbed is left with a long job at the end
+        queue = deque(
+            sorted(
+                [job for group in jobs for job in group],
+                key=lambda job: job.estimate,
+                reverse=True,
+            )
+        )
+        logging.info(
+            "Scheduled %d tests on %d testbed(s), expected run time: %s",
+            len(queue),
+            self._parallel,
+            timedelta(
+                seconds=round(
+                    predict_makespan([job.estimate for job in queue], self._parallel)
+                )
+            ),
+        )
 
-                # run the test cases
-                for testcase in self._tests:
-                    status = self._run_testcase(server, client, testcase)
-                    self.test_results[server][client][testcase] = status
-                    if status == TestResult.FAILED:
-                        nr_failed += 1
+        _, nr_failed = await asyncio.gather(
+            asyncio.gather(
+                *[self._work(Testbed(i), queue) for i in range(self._parallel)]
+            ),
+            asyncio.gather(*[self._collect(group) for group in jobs]),
+        )
+        return sum(nr_failed)
 
-                # run the measurements
-                for measurement in self._measurements:
-                    if measurement.abbreviation() == "QO":
-                        res = self._run_quic_optimization(server, client, measurement)
-                    else:
-                        res = self._run_measurement(server, client, measurement)
-                    self.measurement_results[server][client][measurement] = res
+    def run(self):
+        """run the interop test suite and output the table"""
 
+        nr_failed = asyncio.run(self._run())
         self._print_results()
         self._export_results()
         return nr_failed
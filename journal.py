@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+# What identifies a test run: the same test, with the same images, scenario
+# and parameters, would have the same outcome.
+KEY_FIELDS = [
+    "server_image",
+    "client_image",
+    "test",
+    "definition",
+    "scenario",
+    "repetition",
+    "server_params",
+    "client_params",
+]
+
+
+class Journal:
+    """Append-only record of the tests that ran, one JSON object per line.
+
+    Every entry is written as soon as its test is done, so an interrupted run
+    can be resumed from the journal, without running these tests again.
+    """
+
+    def __init__(self, filename: str, resume: bool = False):
+        """With resume set, the entries already in the file are loaded."""
+        self._filename = filename
+        self._entries = {}
+        # the last line was cut short, the next entry starts on a line of its own
+        self._partial_line = False
+        if resume:
+            self._load()
+
+    @staticmethod
+    def _key(entry: Dict) -> tuple:
+        return tuple(entry.get(f) for f in KEY_FIELDS)
+
+    def _load(self):
+        try:
+            f = open(self._filename)
+        except FileNotFoundError:
+            logging.info("No journal found at %s.", self._filename)
+            return
+        with f:
+            for line in f:
+                self._partial_line = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # the run was interrupted while writing it
+                self._entries[self._key(entry)] = entry
+        logging.info("Loaded %d tests from %s.", len(self._entries), self._filename)
+
+    def get(self, cell: Dict) -> Optional[Dict]:
+        """The entry of a test that already ran, if there is one"""
+        return self._entries.get(self._key(cell))
+
+    def entries(self) -> List[Dict]:
+        """All entries, in the order the tests ran"""
+        return list(self._entries.values())
+
+    def append(self, entry: Dict):
+        os.makedirs(os.path.dirname(self._filename) or ".", exist_ok=True)
+        with open(self._filename, "a") as f:
+            if self._partial_line:
+                f.write("\n")
+                self._partial_line = False
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._entries[self._key(entry)] = entry
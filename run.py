@@ -8,6 +8,7 @@ import testcases
 from implementations import IMPLEMENTATIONS, Role
 from interop import InteropRunner
 from testcases import MEASUREMENTS, TESTCASES
+from trace import TRACE_BACKENDS
 
 implementations = {
     name: {"image": value["image"], "url": value["url"]}
@@ -65,6 +66,70 @@ def main():
         parser.add_argument(
             "-j", "--json", help="output the matrix to file in json format"
         )
+        parser.add_argument(
+            "--trace-backend",
+            help="how to dissect the packet traces. Valid backends are: "
+            + ", ".join(TRACE_BACKENDS),
+            choices=TRACE_BACKENDS,
+            default="pyshark",
+        )
+        parser.add_argument(
+            "--trace-cache",
+            action="store_true",
+            help="cache the fields extracted from the packet traces next to the traces "
+            "(not with the pyshark backend)",
+        )
+        parser.add_argument(
+            "-p",
+            "--parallel",
+            type=int,
+            default=1,
+            help="number of tests to run in parallel, each on its own testbed",
+        )
+        parser.add_argument(
+            "--precreate",
+            action="store_true",
+            help="create the containers of the next test while a test runs. "
+            "Every testbed takes turns with another",
+        )
+        parser.add_argument(
+            "--compliance-cache",
+            default="compliance.json",
+            help="file to keep the compliance check results in, by image ID "
+            "(empty to always check)",
+        )
+        parser.add_argument(
+            "--history",
+            default="durations.json",
+            help="file to keep the durations of the tests in, to run the longest "
+            "first (empty to not keep them)",
+        )
+        parser.add_argument(
+            "--studies",
+            default="studies.db",
+            help="SQLite database to keep the optimization studies in, to go on "
+            "with them in the next run (empty to keep them in memory)",
+        )
+        parser.add_argument(
+            "--warm-start",
+            type=int,
+            default=0,
+            help="start a new optimization study with the best N trials of the latest "
+            "study of the same server and client",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="resume an interrupted run from the journal in its log directory "
+            "(-l), skipping the tests that already ran",
+        )
+        parser.add_argument(
+            "--previous",
+            default="",
+            help="journal (or log directory) of a previous run. Tests whose images, "
+            "code and scenario haven't changed since are not run again, their results "
+            "are copied and marked as cached",
+        )
         return parser.parse_args()
 
     replace_arg = get_args().replace
@@ -132,6 +197,16 @@ def main():
         debug=get_args().debug,
         log_dir=get_args().log_dir,
         save_files=get_args().save_files,
+        trace_backend=get_args().trace_backend,
+        trace_cache=get_args().trace_cache,
+        parallel=get_args().parallel,
+        precreate=get_args().precreate,
+        compliance_cache=get_args().compliance_cache,
+        history=get_args().history,
+        studies=get_args().studies,
+        warm_start=get_args().warm_start,
+        resume=get_args().resume,
+        previous=get_args().previous,
     ).run()
 
 
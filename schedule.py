@@ -0,0 +1,80 @@
+import heapq
+import json
+import logging
+import os
+import statistics
+import tempfile
+from typing import Dict, List, Optional
+
+# How much a new duration counts, against the ones recorded before.
+SMOOTHING = 0.5
+
+
+class DurationHistory:
+    """How long tests took on a testbed, by test, server and client.
+
+    Every duration is a moving average (weighted by SMOOTHING), so that it
+    follows the implementations as they change, without jumping around.
+    """
+
+    def __init__(self, filename: str):
+        """Without a filename, durations are only kept for this run."""
+        self._filename = filename
+        self._durations = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        if not self._filename:
+            return {}
+        try:
+            with open(self._filename) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.info("Ignoring duration history %s: %s", self._filename, e)
+            return {}
+
+    def _save(self):
+        if not self._filename:
+            return
+        # write to a temporary file first, so that readers never see half a file
+        tmp = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                "w", dir=os.path.dirname(self._filename) or ".", delete=False
+            ) as f:
+                tmp = f.name
+                json.dump(self._durations, f, indent=2)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self._filename)
+        except OSError as e:
+            logging.info("Couldn't write duration history %s: %s", self._filename, e)
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def get(self, test: str, server: str, client: str) -> Optional[float]:
+        return self._durations.get(test, {}).get(server, {}).get(client)
+
+    def typical(self, test: str) -> Optional[float]:
+        """The median duration of a test, over all servers and clients"""
+        durations = [
+            d
+            for clients in self._durations.get(test, {}).values()
+            for d in clients.values()
+        ]
+        return statistics.median(durations) if durations else None
+
+    def record(self, test: str, server: str, client: str, duration: float):
+        previous = self.get(test, server, client)
+        if previous is not None:
+            duration = SMOOTHING * duration + (1 - SMOOTHING) * previous
+        self._durations.setdefault(test, {}).setdefault(server, {})[client] = duration
+        self._save()
+
+
+def predict_makespan(durations: List[float], workers: int) -> float:
+    """How long running jobs longest first, each on the next free worker, takes"""
+    finish_times = [0.0] * workers
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
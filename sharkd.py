@@ -0,0 +1,277 @@
+import atexit
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Frames requested per "frames" call. sharkd answers every call with a single
+# JSON line, so this bounds the size of that line.
+FRAMES_PER_CALL = 10000
+
+# Custom columns show the resolved value of a field, while tshark -T fields
+# prints the raw value. Map the resolved values of the enumerated fields that
+# TraceAnalyzer and the test cases read back to what tshark prints.
+_ECN = {
+    "Not-ECT": "0",
+    "ECT(1)": "1",
+    "ECT(0)": "2",
+    "CE": "3",
+    "Not ECN-Capable Transport": "0",
+    "ECN-Capable Transport codepoint '01'": "1",
+    "ECN-Capable Transport codepoint '10'": "2",
+    "Congestion Experienced": "3",
+}
+_BOOLEAN = {"True": "1", "False": "0", "Set": "1", "Not set": "0"}
+_RAW_VALUES = {
+    "ip.dsfield.ecn": _ECN,
+    "ipv6.tclass.ecn": _ECN,
+    "quic.header_form": {"Long Header": "1", "Short Header": "0"},
+    "quic.version": dict(
+        {
+            "Version Negotiation": "0x00000000",
+            "1": "0x00000001",
+            "2": "0x6b3343cf",
+        },
+        **{"draft-%02d" % d: "0x%08x" % (0xFF000000 + d) for d in range(35)},
+    ),
+    "quic.long.packet_type": {
+        "Initial": "0",
+        "0-RTT": "1",
+        "Handshake": "2",
+        "Retry": "3",
+    },
+    "quic.long.packet_type_v2": {
+        "Retry": "0",
+        "Initial": "1",
+        "0-RTT": "2",
+        "Handshake": "3",
+    },
+    "quic.key_phase": _BOOLEAN,
+    "tls.handshake.type": {
+        "Hello Request": "0",
+        "Client Hello": "1",
+        "Server Hello": "2",
+        "Hello Verify Request": "3",
+        "New Session Ticket": "4",
+        "End of Early Data": "5",
+        "Hello Retry Request": "6",
+        "Encrypted Extensions": "8",
+        "Certificate": "11",
+        "Server Key Exchange": "12",
+        "Certificate Request": "13",
+        "Server Hello Done": "14",
+        "Certificate Verify": "15",
+        "Client Key Exchange": "16",
+        "Finished": "20",
+        "Certificate URL": "21",
+        "Certificate Status": "22",
+        "Supplemental Data": "23",
+        "Key Update": "24",
+        "Compressed Certificate": "25",
+        "Message Hash": "254",
+    },
+    "tls.handshake.ciphersuite": {
+        "TLS_AES_128_GCM_SHA256": "0x1301",
+        "TLS_AES_256_GCM_SHA384": "0x1302",
+        "TLS_CHACHA20_POLY1305_SHA256": "0x1303",
+        "TLS_AES_128_CCM_SHA256": "0x1304",
+        "TLS_AES_128_CCM_8_SHA256": "0x1305",
+    },
+}
+
+
+def _raw_values(fields: List[str], columns: List[str]) -> Tuple[str, ...]:
+    """Map the custom column values of a frame to tshark's field output.
+
+    A column holds all occurrences of its field, separated by commas.
+    """
+    row = []
+    for field, value in zip(fields, columns):
+        raw = _RAW_VALUES.get(field)
+        if raw is not None and value:
+            value = ",".join(raw.get(v, v) for v in value.split(","))
+        row.append(value)
+    return tuple(row)
+
+
+def _collect_tree(nodes: List[Dict], values: Dict[str, List[str]]):
+    """Collect the values of all fields in a subtree of a sharkd frame tree.
+
+    Every node has the display filter that matches it, which holds the raw
+    value of the field. Fields without a value are "1", like in tshark's
+    field output.
+    """
+    for node in nodes:
+        if "f" in node:
+            field, _, value = node["f"].partition(" == ")
+            values.setdefault(field, []).append(value.strip('"') or "1")
+        _collect_tree(node.get("n", []), values)
+
+
+class SharkdError(Exception):
+    pass
+
+
+class SharkdSession:
+    """A sharkd process, spoken to via its JSON-RPC interface on stdin / stdout.
+
+    sharkd keeps its dissectors initialized between captures, so loading
+    another capture file is a lot cheaper than starting tshark again.
+    """
+
+    def __init__(self):
+        self._id = 0
+        self._keylog_file = None
+        self._loaded = None
+        self._proc = subprocess.Popen(
+            ["sharkd", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+
+    def call(self, method: str, **params) -> Dict:
+        self._id += 1
+        req = {"jsonrpc": "2.0", "id": self._id, "method": method}
+        if params:
+            req["params"] = params
+        self._proc.stdin.write(json.dumps(req) + "\n")
+        self._proc.stdin.flush()
+        for line in self._proc.stdout:
+            try:
+                resp = json.loads(line)
+            except ValueError:
+                continue  # not a response
+            if not isinstance(resp, dict) or resp.get("id") != self._id:
+                continue
+            if "error" in resp:
+                raise SharkdError(method + ": " + json.dumps(resp["error"]))
+            return resp.get("result")
+        raise SharkdError("sharkd exited with %s" % self._proc.poll())
+
+    def load(self, filename: str, keylog_file: Optional[str]):
+        st = os.stat(filename)
+        loaded = (filename, st.st_mtime_ns, st.st_size, keylog_file)
+        if loaded == self._loaded:
+            return  # still dissected
+        # preferences only apply to files loaded afterwards
+        if keylog_file != self._keylog_file:
+            self.call("setconf", name="tls.keylog_file", value=keylog_file or "")
+            self._keylog_file = keylog_file
+        self._loaded = None
+        self.call("load", file=filename)
+        self._loaded = loaded
+
+    def frames(self, fields: List[str], display_filter: str) -> Iterator[Tuple]:
+        """Get the values of the fields of all frames that match the filter."""
+        params = {"column%d" % i: field + ":0" for i, field in enumerate(fields)}
+        skip = 0
+        while True:
+            frames = self.call(
+                "frames",
+                filter=display_filter,
+                skip=skip,
+                limit=FRAMES_PER_CALL,
+                **params,
+            )
+            for frame in frames:
+                yield _raw_values(fields, frame["c"])
+            if len(frames) < FRAMES_PER_CALL:
+                return
+            skip += len(frames)
+
+    def quic_layers(self, frame: int) -> List[Dict[str, List[str]]]:
+        """Get the fields of every QUIC packet in a frame, like
+        trace.read_quic_layers."""
+        tree = self.call("frame", frame=frame, proto=True).get("tree", [])
+        packets = []
+        for node in tree:
+            if node.get("f") not in ["quic", "tls"]:
+                continue
+            if node["f"] == "quic":
+                packets.append({})
+            if packets:
+                # TLS messages belong to the QUIC packet before them
+                _collect_tree(node.get("n", []), packets[-1])
+        return packets
+
+    def close(self):
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+
+class SharkdPool:
+    """Idle sharkd sessions, reused by all traces analyzed in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = []
+        self._version = None
+
+    @contextlib.contextmanager
+    def session(self) -> Iterator[SharkdSession]:
+        with self._lock:
+            s = self._idle.pop() if self._idle else None
+        if s is None:
+            logging.debug("Starting a new sharkd session.")
+            s = SharkdSession()
+        try:
+            yield s
+        except BaseException:
+            # the session might be in the middle of a response
+            s.close()
+            raise
+        with self._lock:
+            self._idle.append(s)
+
+    def version(self) -> str:
+        if self._version is None:
+            with self.session() as s:
+                self._version = "sharkd " + s.call("info").get("version", "")
+        return self._version
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for s in idle:
+            s.close()
+
+
+POOL = SharkdPool()
+atexit.register(POOL.close)
+
+
+def read_sharkd(
+    filename: str,
+    fields: List[str],
+    display_filter: str,
+    keylog_file: Optional[str] = None,
+) -> Iterator[Tuple[str, ...]]:
+    """Like trace.read_fields, but uses a pooled sharkd session."""
+    with POOL.session() as s:
+        s.load(filename, keylog_file)
+        yield from s.frames(fields, display_filter)
+
+
+def read_sharkd_layers(
+    filename: str, frames: List[int], keylog_file: Optional[str] = None
+) -> Dict[int, List[Dict[str, List[str]]]]:
+    """Like trace.read_quic_layers, but uses a pooled sharkd session.
+
+    The rows of the trace are read while this runs, so this usually takes a
+    session of its own. It keeps the trace loaded for the next frames.
+    """
+    with POOL.session() as s:
+        s.load(filename, keylog_file)
+        return {frame: s.quic_layers(frame) for frame in frames}
@@ -0,0 +1,64 @@
+from trace import Endpoints
+from typing import Dict, List
+
+# The third octet of the right subnet is 100 + index, so indices above this
+# would run out of octets (and the left subnets into the right ones).
+MAX_TESTBEDS = 100
+
+
+class Testbed:
+    """A set of containers (simulator, client, server, ...) to run a test on.
+
+    Testbed 0 is what docker-compose.yml describes without any environment
+    variables set. Every other testbed runs in its own compose project, with
+    its own container names and its own subnets, so that testbeds can run
+    tests at the same time: testbed k uses 193.167.k.0/24 (and
+    fd00:cafe:cafe:k::/64) for the client side and 193.167.(100 + k).0/24
+    (and fd00:cafe:cafe:(100 + k)::/64) for the server side. The addresses
+    within the subnets are the same on all testbeds.
+    """
+
+    def __init__(self, index: int = 0):
+        if not 0 <= index < MAX_TESTBEDS:
+            raise ValueError("testbed index out of range: %d" % index)
+        self.index = index
+        self.project = "interop%d" % index if index > 0 else ""
+        self._leftnet4 = "193.167.%d" % index
+        self._rightnet4 = "193.167.%d" % (100 + index)
+        # the decimal index, read as a hex group, doesn't overlap either
+        self._leftnet6 = "fd00:cafe:cafe:%d" % index
+        self._rightnet6 = "fd00:cafe:cafe:%d" % (100 + index)
+
+    def __str__(self):
+        return "testbed %d" % self.index
+
+    def container(self, service: str) -> str:
+        """The name of the container of a service in docker-compose.yml"""
+        if not self.project:
+            return service
+        return self.project + "_" + service
+
+    def endpoints(self) -> Endpoints:
+        return Endpoints(
+            client_ip4=self._leftnet4 + ".100",
+            client_ip6=self._leftnet6 + "::100",
+            server_ip4=self._rightnet4 + ".100",
+            server_ip6=self._rightnet6 + "::100",
+        )
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that select this testbed in docker-compose.yml"""
+        return {
+            "CONTAINER_PREFIX": self.container(""),
+            "LEFTNET_IPV4": self._leftnet4,
+            "RIGHTNET_IPV4": self._rightnet4,
+            "LEFTNET_IPV6": self._leftnet6,
+            "RIGHTNET_IPV6": self._rightnet6,
+        }
+
+    def compose(self, *args: str) -> List[str]:
+        """A docker compose command, run in this testbed's project"""
+        cmd = ["docker", "compose", "--env-file", "empty.env"]
+        if self.project:
+            cmd += ["-p", self.project]
+        return cmd + list(args)
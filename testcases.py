@@ -9,20 +9,23 @@ import string
 import subprocess
 import sys
 import tempfile
-from datetime import timedelta
 from enum import Enum, IntEnum
 from trace import (
+    DEFAULT_ENDPOINTS,
     QUIC_V2,
     Direction,
+    Endpoints,
+    Frame,
+    Packet,
     PacketType,
     TraceAnalyzer,
-    get_direction,
-    get_packet_type,
+    prefetch,
 )
-from typing import List
+from typing import List, Optional
 
 from Crypto.Cipher import AES
 from result import TestResult
+from timeseries import GoodputSeries
 
 KB = 1 << 10
 MB = 1 << 20
@@ -64,6 +67,16 @@ def generate_cert_chain(directory: str, length: int = 1):
         sys.exit(1)
 
 
+class BorrowedDirectory:
+    """A directory that belongs to someone else, who also cleans it up"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def cleanup(self):
+        pass
+
+
 class TestCase(abc.ABC):
     _files = []
     _www_dir = None
@@ -74,17 +87,39 @@ class TestCase(abc.ABC):
     _cert_dir = None
     _cached_server_trace = None
     _cached_client_trace = None
+    _cached_keylog_file = None
+    _secrets_injected = False
 
     def __init__(
         self,
         sim_log_dir: tempfile.TemporaryDirectory,
         client_keylog_file: str,
         server_keylog_file: str,
+        trace_backend: str = "pyshark",
+        trace_cache: bool = False,
+        endpoints: Endpoints = DEFAULT_ENDPOINTS,
     ):
         self._server_keylog_file = server_keylog_file
         self._client_keylog_file = client_keylog_file
         self._files = []
         self._sim_log_dir = sim_log_dir
+        self._trace_backend = trace_backend
+        self._trace_cache = trace_cache
+        self._endpoints = endpoints
+
+    def __getstate__(self):
+        """Test cases are pickled to be checked in another process.
+
+        The copy only borrows the directories, the original still cleans them
+        up. Traces aren't copied, the copy dissects them again if needed.
+        """
+        state = self.__dict__.copy()
+        for key, value in state.items():
+            if isinstance(value, tempfile.TemporaryDirectory):
+                state[key] = BorrowedDirectory(value.name)
+        state.pop("_cached_client_trace", None)
+        state.pop("_cached_server_trace", None)
+        return state
 
     @abc.abstractmethod
     def name(self):
@@ -124,6 +159,16 @@ class TestCase(abc.ABC):
     def additional_containers() -> List[str]:
         return [""]
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        """tshark fields read by check(), in addition to trace.TSHARK_FIELDS"""
+        return []
+
+    @staticmethod
+    def uses_both_traces() -> bool:
+        """check() reads the client's and the server's trace"""
+        return False
+
     def www_dir(self):
         if not self._www_dir:
             self._www_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="www_")
@@ -154,26 +199,86 @@ class TestCase(abc.ABC):
         return True
 
     def _keylog_file(self) -> str:
-        if self._is_valid_keylog(self._client_keylog_file):
-            logging.debug("Using the client's key log file.")
-            return self._client_keylog_file
-        elif self._is_valid_keylog(self._server_keylog_file):
-            logging.debug("Using the server's key log file.")
-            return self._server_keylog_file
-        logging.debug("No key log file found.")
+        # the key log files don't change once the logs have been copied
+        if self._cached_keylog_file is None:
+            if self._is_valid_keylog(self._client_keylog_file):
+                logging.debug("Using the client's key log file.")
+                self._cached_keylog_file = self._client_keylog_file
+            elif self._is_valid_keylog(self._server_keylog_file):
+                logging.debug("Using the server's key log file.")
+                self._cached_keylog_file = self._server_keylog_file
+            else:
+                logging.debug("No key log file found.")
+                self._cached_keylog_file = ""
+        return self._cached_keylog_file or None
+
+    def inject_secrets(self):
+        """Save the traces as pcapng files with the TLS secrets embedded.
+
+        The traces are analyzed from these files, without the key log file.
+        The original pcaps are kept.
+        """
+        keylog_file = self._keylog_file()
+        if keylog_file is None:
+            return
+        for name in ["trace_node_left", "trace_node_right"]:
+            pcap = self._sim_log_dir.name + "/" + name
+            if not os.path.isfile(pcap + ".pcap"):
+                return
+            cmd = ["editcap", "--inject-secrets", "tls," + keylog_file]
+            cmd += [pcap + ".pcap", pcap + ".pcapng"]
+            try:
+                r = subprocess.run(
+                    cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+                )
+            except OSError as e:
+                logging.info("Injecting the TLS secrets failed: %s", e)
+                return
+            if r.returncode != 0:
+                logging.info(
+                    "Injecting the TLS secrets failed: %s", r.stdout.decode("utf-8")
+                )
+                return
+        logging.debug("Injected the TLS secrets into the traces.")
+        self._secrets_injected = True
+
+    def _trace(self, name: str) -> TraceAnalyzer:
+        if self._secrets_injected:
+            filename, keylog_file = name + ".pcapng", None
+        else:
+            filename, keylog_file = name + ".pcap", self._keylog_file()
+        return TraceAnalyzer(
+            self._sim_log_dir.name + "/" + filename,
+            keylog_file,
+            backend=self._trace_backend,
+            fields=self.trace_fields(),
+            cache=self._trace_cache,
+            embedded_secrets=self._secrets_injected,
+            endpoints=self._endpoints,
+        )
+
+    def _prefetch_traces(self):
+        """Dissect both traces in parallel, if check() reads both of them."""
+        if not self.uses_both_traces() or self._trace_backend == "pyshark":
+            return
+        if self._cached_client_trace is None:
+            self._cached_client_trace = self._trace("trace_node_left")
+        if self._cached_server_trace is None:
+            self._cached_server_trace = self._trace("trace_node_right")
+        prefetch([self._cached_client_trace, self._cached_server_trace])
 
     def _client_trace(self):
         if self._cached_client_trace is None:
-            self._cached_client_trace = TraceAnalyzer(
-                self._sim_log_dir.name + "/trace_node_left.pcap", self._keylog_file()
-            )
+            self._prefetch_traces()
+        if self._cached_client_trace is None:
+            self._cached_client_trace = self._trace("trace_node_left")
         return self._cached_client_trace
 
     def _server_trace(self):
         if self._cached_server_trace is None:
-            self._cached_server_trace = TraceAnalyzer(
-                self._sim_log_dir.name + "/trace_node_right.pcap", self._keylog_file()
-            )
+            self._prefetch_traces()
+        if self._cached_server_trace is None:
+            self._cached_server_trace = self._trace("trace_node_right")
         return self._cached_server_trace
 
     # see https://www.stefanocappellini.it/generate-pseudorandom-bytes-with-python/ for benchmarks
@@ -190,7 +295,7 @@ class TestCase(abc.ABC):
         return len(self._client_trace().get_retry()) > 0
 
     def _check_version_and_files(self) -> bool:
-        versions = [hex(int(v, 0)) for v in self._get_versions()]
+        versions = [hex(v) for v in self._get_versions()]
         if len(versions) != 1:
             logging.info("Expected exactly one version. Got %s", versions)
             return False
@@ -250,26 +355,16 @@ class TestCase(abc.ABC):
         tr = self._server_trace()
         # Determine the number of handshakes by looking at Initial packets.
         # This is easier, since the SCID of Initial packets doesn't changes.
-        return len(set([p.scid for p in tr.get_initial(Direction.FROM_SERVER)]))
+        return len(tr.get_scids(PacketType.INITIAL, Direction.FROM_SERVER))
 
     def _get_versions(self) -> set:
         """Get the QUIC versions"""
         tr = self._server_trace()
         return set([p.version for p in tr.get_initial(Direction.FROM_SERVER)])
 
-    def _payload_size(self, packets: List) -> int:
+    def _payload_size(self, packets: List[Packet]) -> int:
         """Get the sum of the payload sizes of all packets"""
-        size = 0
-        for p in packets:
-            if hasattr(p, "long_packet_type") or hasattr(p, "long_packet_type_v2"):
-                if hasattr(p, "payload"):  # when keys are available
-                    size += len(p.payload.split(":"))
-                else:
-                    size += len(p.remaining_payload.split(":"))
-            else:
-                if hasattr(p, "protected_payload"):
-                    size += len(p.protected_payload.split(":"))
-        return size
+        return sum(p.payload_length or 0 for p in packets)
 
     def cleanup(self):
         if self._www_dir:
@@ -385,6 +480,14 @@ class TestCaseLongRTT(TestCaseHandshake):
     def desc():
         return "Handshake completes when RTT is long."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return TestCaseHandshake.trace_fields() + [
+            "tls.handshake.type",
+            "quic.retransmission",
+            "quic.overlap",
+        ]
+
     @staticmethod
     def scenario() -> str:
         """Scenario for the ns3 simulator"""
@@ -399,14 +502,14 @@ class TestCaseLongRTT(TestCaseHandshake):
             return TestResult.FAILED
         num_ch = 0
         for p in self._client_trace().get_initial(Direction.FROM_CLIENT):
-            if hasattr(p, "tls_handshake_type"):
-                if p.tls_handshake_type == "1":
+            if p.get("tls.handshake.type"):
+                if p.get("tls.handshake.type") == "1":
                     num_ch += 1
             # Retransmitted ClientHello does not have
-            # tls_handshake_type attribute.  See
+            # tls.handshake.type field.  See
             # https://gitlab.com/wireshark/wireshark/-/issues/18696
             # for details.
-            elif hasattr(p, "retransmission") or hasattr(p, "overlap"):
+            elif p.get("quic.retransmission") or p.get("quic.overlap"):
                 num_ch += 1
         if num_ch < 2:
             logging.info("Expected at least 2 ClientHellos. Got: %d", num_ch)
@@ -462,6 +565,10 @@ class TestCaseChaCha20(TestCase):
     def desc():
         return "Handshake completes using ChaCha20."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return ["tls.handshake.ciphersuite"]
+
     def get_paths(self):
         self._files = [self._generate_random_file(3 * MB)]
         return self._files
@@ -473,8 +580,8 @@ class TestCaseChaCha20(TestCase):
             return TestResult.FAILED
         ciphersuites = []
         for p in self._client_trace().get_initial(Direction.FROM_CLIENT):
-            if hasattr(p, "tls_handshake_ciphersuite"):
-                ciphersuites.append(p.tls_handshake_ciphersuite)
+            if p.get("tls.handshake.ciphersuite"):
+                ciphersuites.append(p.get("tls.handshake.ciphersuite"))
         if len(set(ciphersuites)) != 1 or (
             ciphersuites[0] != "4867" and ciphersuites[0] != "0x1303"
         ):
@@ -505,6 +612,10 @@ class TestCaseMultiplexing(TestCase):
     def desc():
         return "Thousands of files are transferred over a single connection, and server increased stream limits to accomodate client requests."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return ["tls.quic.parameter.initial_max_streams_bidi"]
+
     def get_paths(self):
         for _ in range(1, 2000):
             self._files.append(self._generate_random_file(32))
@@ -523,11 +634,9 @@ class TestCaseMultiplexing(TestCase):
         # Check that the server set a bidirectional stream limit <= 1000
         checked_stream_limit = False
         for p in self._client_trace().get_handshake(Direction.FROM_SERVER):
-            if hasattr(p, "tls.quic.parameter.initial_max_streams_bidi"):
+            if p.get("tls.quic.parameter.initial_max_streams_bidi"):
                 checked_stream_limit = True
-                stream_limit = int(
-                    getattr(p, "tls.quic.parameter.initial_max_streams_bidi")
-                )
+                stream_limit = int(p.get("tls.quic.parameter.initial_max_streams_bidi"))
                 logging.debug("Server set bidirectional stream limit: %d", stream_limit)
                 if stream_limit > 1000:
                     logging.info("Server set a stream limit > 1000.")
@@ -551,6 +660,15 @@ class TestCaseRetry(TestCase):
     def desc():
         return "Server sends a Retry, and a subsequent connection using the Retry token completes successfully."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return [
+            "quic.retry_token",
+            "quic.packet_number",
+            "quic.token_length",
+            "quic.token",
+        ]
+
     def get_paths(self):
         self._files = [
             self._generate_random_file(10 * KB),
@@ -563,11 +681,11 @@ class TestCaseRetry(TestCase):
         tokens = []
         retries = tr.get_retry(Direction.FROM_SERVER)
         for p in retries:
-            if not hasattr(p, "retry_token"):
+            if not p.get("quic.retry_token"):
                 logging.info("Retry packet doesn't have a retry_token")
                 logging.info(p)
                 return False
-            tokens += [p.retry_token.replace(":", "")]
+            tokens += [p.get("quic.retry_token").replace(":", "")]
         if len(tokens) == 0:
             logging.info("Didn't find any Retry packets.")
             return False
@@ -575,8 +693,11 @@ class TestCaseRetry(TestCase):
         # check that an Initial packet uses a token sent in the Retry packet(s)
         highest_pn_before_retry = -1
         for p in tr.get_initial(Direction.FROM_CLIENT):
-            pn = int(p.packet_number)
-            if p.token_length == "0":
+            pn = p.packet_number
+            if pn is None:
+                logging.info("Initial packet without a packet number: %s", p)
+                return False
+            if p.get("quic.token_length") == "0":
                 highest_pn_before_retry = max(highest_pn_before_retry, pn)
                 continue
             if pn <= highest_pn_before_retry:
@@ -584,7 +705,7 @@ class TestCaseRetry(TestCase):
                     "Client reset the packet number. Check failed for PN %d", pn
                 )
                 return False
-            token = p.token.replace(":", "")
+            token = p.get("quic.token").replace(":", "")
             if token in tokens:
                 logging.debug("Check of Retry succeeded. Token used: %s", token)
                 return True
@@ -616,6 +737,10 @@ class TestCaseResumption(TestCase):
     def desc():
         return "Connection is established using TLS Session Resumption."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return ["tls.handshake.certificates_length"]
+
     def get_paths(self):
         self._files = [
             self._generate_random_file(5 * KB),
@@ -632,24 +757,25 @@ class TestCaseResumption(TestCase):
             logging.info("Expected exactly 2 handshake. Got: %d", num_handshakes)
             return TestResult.FAILED
 
-        handshake_packets = self._client_trace().get_handshake(Direction.FROM_SERVER)
-        cids = [p.scid for p in handshake_packets]
+        tr = self._client_trace()
+        cids = tr.get_scids(PacketType.HANDSHAKE, Direction.FROM_SERVER)
+        if len(cids) > 2:
+            logging.info(
+                "Found handshake packet that neither belongs to the first nor the second handshake."
+            )
+            return TestResult.FAILED
         first_handshake_has_cert = False
-        for p in handshake_packets:
-            if p.scid == cids[0]:
-                if hasattr(p, "tls_handshake_certificates_length"):
+        for i, cid in enumerate(cids):
+            for p in tr.get_by_scid(cid, PacketType.HANDSHAKE, Direction.FROM_SERVER):
+                if not p.get("tls.handshake.certificates_length"):
+                    continue
+                if i == 0:
                     first_handshake_has_cert = True
-            elif p.scid == cids[len(cids) - 1]:  # second handshake
-                if hasattr(p, "tls_handshake_certificates_length"):
+                else:  # second handshake
                     logging.info(
                         "Server sent a Certificate message in the second handshake."
                     )
                     return TestResult.FAILED
-            else:
-                logging.info(
-                    "Found handshake packet that neither belongs to the first nor the second handshake."
-                )
-                return TestResult.FAILED
         if not first_handshake_has_cert:
             logging.info(
                 "Didn't find a Certificate message in the first handshake. That's weird."
@@ -677,6 +803,10 @@ class TestCaseZeroRTT(TestCase):
     def desc():
         return "0-RTT data is being sent and acted on."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return ["quic.payload", "quic.remaining_payload", "quic.protected_payload"]
+
     def get_paths(self):
         for _ in range(self.NUM_FILES):
             self._files.append(
@@ -753,6 +883,10 @@ class TestCaseAmplificationLimit(TestCase):
     def desc():
         return "The server obeys the 3x amplification limit."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return ["quic.crypto.offset", "quic.crypto.length"]
+
     def certs_dir(self):
         if not self._cert_dir:
             self._cert_dir = tempfile.TemporaryDirectory(dir="/tmp", prefix="certs_")
@@ -783,9 +917,10 @@ class TestCaseAmplificationLimit(TestCase):
         # This way we can make sure that it actually used the provided cert chain.
         max_handshake_offset = 0
         for p in self._server_trace().get_handshake(Direction.FROM_SERVER):
-            if hasattr(p, "crypto_offset"):
+            if Frame.CRYPTO in p.frames:
                 max_handshake_offset = max(
-                    max_handshake_offset, int(p.crypto_offset) + int(p.crypto_length)
+                    max_handshake_offset,
+                    int(p.get("quic.crypto.offset")) + int(p.get("quic.crypto.length")),
                 )
         if max_handshake_offset < 7500:
             logging.info(
@@ -804,12 +939,12 @@ class TestCaseAmplificationLimit(TestCase):
         res = TestResult.FAILED
         log_output = []
         for p in self._server_trace().get_raw_packets():
-            direction = get_direction(p)
-            packet_type = get_packet_type(p)
+            direction = p.direction
+            packet_type = p.packet_type
             if packet_type == PacketType.VERSIONNEGOTIATION:
                 logging.info("Didn't expect a Version Negotiation packet.")
                 return TestResult.FAILED
-            packet_size = int(p.udp.length) - 8  # subtract the UDP header length
+            packet_size = p.udp_length - 8  # subtract the UDP header length
             if packet_type == PacketType.INVALID:
                 logging.debug("Couldn't determine packet type.")
                 return TestResult.FAILED
@@ -905,10 +1040,18 @@ class TestCaseKeyUpdate(TestCaseHandshake):
     def abbreviation():
         return "U"
 
+    @staticmethod
+    def uses_both_traces() -> bool:
+        return True
+
     @staticmethod
     def desc():
         return "One of the two endpoints updates keys and the peer responds correctly."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return TestCaseHandshake.trace_fields() + ["quic.key_phase"]
+
     def get_paths(self):
         self._files = [self._generate_random_file(3 * MB)]
         return self._files
@@ -928,22 +1071,11 @@ class TestCaseKeyUpdate(TestCaseHandshake):
         client = {0: 0, 1: 0}
         server = {0: 0, 1: 0}
         try:
-
-            def _get_key_phase(pkt) -> int:
-                kp: str = pkt.key_phase.raw_value
-                # when key_phase bit is set in a QUIC packet, certain versions
-                # of wireshark (4.0.11, for example) have been seen to return the string value
-                # "1" and certain other versions of wireshark return the string value "True".
-                # here we deal with such values and return the integer value 1 for either of those.
-                return 1 if kp in ["1", "True"] else 0
-
             for p in self._client_trace().get_1rtt(Direction.FROM_CLIENT):
-                key_phase = _get_key_phase(p)
-                client[key_phase] += 1
+                client[p.key_phase] += 1
             for p in self._server_trace().get_1rtt(Direction.FROM_SERVER):
-                key_phase = _get_key_phase(p)
-                server[key_phase] += 1
-        except Exception:
+                server[p.key_phase] += 1
+        except KeyError:  # no key phase, the packet couldn't be decrypted
             logging.info(
                 "Failed to read key phase bits. Potentially incorrect SSLKEYLOG?"
             )
@@ -1104,11 +1236,18 @@ class TestCaseECN(TestCaseHandshake):
     def abbreviation():
         return "E"
 
+    @staticmethod
+    def uses_both_traces() -> bool:
+        return True
+
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return TestCaseHandshake.trace_fields() + ["quic.ack.ect0_count"]
+
     def _count_ecn(self, tr):
         ecn = [0] * (max(ECN) + 1)
         for p in tr:
-            e = int(getattr(p["ip"], "dsfield.ecn"))
-            ecn[e] += 1
+            ecn[p.ecn] += 1
         for e in ECN:
             logging.debug("%s %d", e, ecn[e])
         return ecn
@@ -1126,7 +1265,7 @@ class TestCaseECN(TestCaseHandshake):
     def _check_ack_ecn(self, tr) -> bool:
         # NOTE: We only check whether the trace contains any ACK-ECN information, not whether it is valid
         for p in tr:
-            if hasattr(p["quic"], "ack.ect0_count"):
+            if Frame.ACK_ECN in p.frames:
                 return True
         return False
 
@@ -1139,17 +1278,13 @@ class TestCaseECN(TestCaseHandshake):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_client = self._client_trace()._get_packets(
-            self._client_trace()._get_direction_filter(Direction.FROM_CLIENT) + " quic"
-        )
+        tr_client = self._client_trace().get_raw_packets(Direction.FROM_CLIENT)
         ecn = self._count_ecn(tr_client)
         ecn_client_any_marked = self._check_ecn_any(ecn)
         ecn_client_all_ok = self._check_ecn_marks(ecn)
         ack_ecn_client_ok = self._check_ack_ecn(tr_client)
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER) + " quic"
-        )
+        tr_server = self._server_trace().get_raw_packets(Direction.FROM_SERVER)
         ecn = self._count_ecn(tr_server)
         ecn_server_any_marked = self._check_ecn_any(ecn)
         ecn_server_all_ok = self._check_ecn_marks(ecn)
@@ -1194,6 +1329,10 @@ class TestCasePortRebinding(TestCaseTransfer):
     def abbreviation():
         return "BP"
 
+    @staticmethod
+    def uses_both_traces() -> bool:
+        return True
+
     @staticmethod
     def testname(p: Perspective):
         return "transfer"
@@ -1202,6 +1341,13 @@ class TestCasePortRebinding(TestCaseTransfer):
     def desc():
         return "Transfer completes under frequent port rebindings on the client side."
 
+    @staticmethod
+    def trace_fields() -> List[str]:
+        return TestCaseTransfer.trace_fields() + [
+            "quic.path_challenge.data",
+            "quic.path_response.data",
+        ]
+
     def get_paths(self):
         self._files = [
             self._generate_random_file(10 * MB),
@@ -1222,11 +1368,9 @@ class TestCasePortRebinding(TestCaseTransfer):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER) + " quic"
-        )
+        tr_server = self._server_trace().get_raw_packets(Direction.FROM_SERVER)
 
-        ports = list(set(getattr(p["udp"], "dstport") for p in tr_server))
+        ports = list(set(p.dst_port for p in tr_server))
 
         logging.info("Server saw these client ports: %s", ports)
         if len(ports) <= 1:
@@ -1236,12 +1380,7 @@ class TestCasePortRebinding(TestCaseTransfer):
         last = None
         num_migrations = 0
         for p in tr_server:
-            cur = (
-                getattr(p["ipv6"], "dst")
-                if "IPV6" in str(p.layers)
-                else getattr(p["ip"], "dst"),
-                int(getattr(p["udp"], "dstport")),
-            )
+            cur = (p.dst, p.dst_port)
             if last is None:
                 last = cur
                 continue
@@ -1250,23 +1389,21 @@ class TestCasePortRebinding(TestCaseTransfer):
                 last = cur
                 num_migrations += 1
                 # packet to different IP/port, should have a PATH_CHALLENGE frame
-                if hasattr(p["quic"], "path_challenge.data") is False:
+                if Frame.PATH_CHALLENGE not in p.frames:
                     logging.info(
                         "First server packet to new client destination %s did not contain a PATH_CHALLENGE frame",
                         cur,
                     )
-                    logging.info(p["quic"])
+                    logging.info(p)
                     return TestResult.FAILED
 
-        tr_client = self._client_trace()._get_packets(
-            self._client_trace()._get_direction_filter(Direction.FROM_CLIENT) + " quic"
-        )
+        tr_client = self._client_trace().get_raw_packets(Direction.FROM_CLIENT)
 
         challenges = list(
             set(
-                getattr(p["quic"], "path_challenge.data")
+                p.get("quic.path_challenge.data")
                 for p in tr_server
-                if hasattr(p["quic"], "path_challenge.data")
+                if Frame.PATH_CHALLENGE in p.frames
             )
         )
         if len(challenges) < num_migrations:
@@ -1279,9 +1416,9 @@ class TestCasePortRebinding(TestCaseTransfer):
 
         responses = list(
             set(
-                getattr(p["quic"], "path_response.data")
+                p.get("quic.path_response.data")
                 for p in tr_client
-                if hasattr(p["quic"], "path_response.data")
+                if Frame.PATH_RESPONSE in p.frames
             )
         )
 
@@ -1319,16 +1456,11 @@ class TestCaseAddressRebinding(TestCasePortRebinding):
             logging.info("Can't check test result. SSLKEYLOG required.")
             return TestResult.UNSUPPORTED
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER) + " quic"
-        )
+        tr_server = self._server_trace().get_raw_packets(Direction.FROM_SERVER)
 
         ips = set()
         for p in tr_server:
-            ip_vers = "ip"
-            if "IPV6" in str(p.layers):
-                ip_vers = "ipv6"
-            ips.add(getattr(p[ip_vers], "dst"))
+            ips.add(p.dst)
 
         logging.info("Server saw these client addresses: %s", ips)
         if len(ips) <= 1:
@@ -1377,10 +1509,11 @@ class TestCaseIPv6(TestCaseTransfer):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_server = self._server_trace()._get_packets(
-            self._server_trace()._get_direction_filter(Direction.FROM_SERVER)
-            + " quic && ip"
-        )
+        tr_server = [
+            p
+            for p in self._server_trace().get_raw_packets(Direction.FROM_SERVER)
+            if not p.ipv6
+        ]
 
         if tr_server:
             logging.info("Packet trace contains %s IPv4 packets.", len(tr_server))
@@ -1424,36 +1557,29 @@ class TestCaseConnectionMigration(TestCaseAddressRebinding):
         if result != TestResult.SUCCEEDED:
             return result
 
-        tr_client = self._client_trace()._get_packets(
-            self._client_trace()._get_direction_filter(Direction.FROM_CLIENT) + " quic"
-        )
+        tr_client = self._client_trace().get_raw_packets(Direction.FROM_CLIENT)
 
         last = None
         dcid = None
         for p in tr_client:
-            cur = (
-                getattr(p["ipv6"], "src")
-                if "IPV6" in str(p.layers)
-                else getattr(p["ip"], "src"),
-                int(getattr(p["udp"], "srcport")),
-            )
+            cur = (p.src, p.src_port)
             if last is None:
                 last = cur
-                dcid = getattr(p["quic"], "dcid")
+                dcid = p.dcid
                 continue
 
             if last != cur:
                 last = cur
                 # packet to different IP/port, should have a new DCID
-                if dcid == getattr(p["quic"], "dcid"):
+                if dcid == p.dcid:
                     logging.info(
                         "First client packet during active migration to %s used previous DCID %s",
                         cur,
                         dcid,
                     )
-                    logging.info(p["quic"])
+                    logging.info(p)
                     return TestResult.FAILED
-                dcid = getattr(p["quic"], "dcid")
+                dcid = p.dcid
                 logging.info(
                     "DCID changed to %s during active migration to %s", dcid, cur
                 )
@@ -1470,6 +1596,10 @@ class TestCaseV2(TestCase):
     def abbreviation():
         return "V2"
 
+    @staticmethod
+    def uses_both_traces() -> bool:
+        return True
+
     @staticmethod
     def desc():
         return "Server should select QUIC v2 in compatible version negotiation."
@@ -1544,14 +1674,15 @@ class TestCaseV2(TestCase):
 
         return TestResult.SUCCEEDED
 
-    def _get_packet_versions(self, packets: List) -> set:
+    def _get_packet_versions(self, packets: List[Packet]) -> set:
         """Get a set of QUIC versions from packets."""
-        return set([hex(int(p.version, 0)) for p in packets])
+        return set([hex(p.version) for p in packets])
 
 
 class MeasurementGoodput(Measurement):
     FILESIZE = 10 * MB
     _result = 0.0
+    _timeseries = None
 
     @staticmethod
     def name():
@@ -1582,6 +1713,11 @@ class MeasurementGoodput(Measurement):
     def repetitions() -> int:
         return 5
 
+    @staticmethod
+    def goodput_bin_size() -> float:
+        """bin size of the goodput time series, in s"""
+        return 0.1
+
     def get_paths(self):
         self._files = [self._generate_random_file(self.FILESIZE)]
         return self._files
@@ -1594,13 +1730,12 @@ class MeasurementGoodput(Measurement):
         if not self._check_version_and_files():
             return TestResult.FAILED
 
-        packets, first, last = self._client_trace().get_1rtt_sniff_times(
-            Direction.FROM_SERVER
-        )
+        # the client's trace isn't needed for anything else, no need to index it
+        times, sizes = self._client_trace().get_1rtt_datagrams(Direction.FROM_SERVER)
 
-        if last - first == 0:
+        if len(times) == 0 or times[-1] - times[0] == 0:
             return TestResult.FAILED
-        time = (last - first) / timedelta(milliseconds=1)
+        time = float(times[-1] - times[0]) * 1000
         goodput = (8 * self.FILESIZE) / time
         logging.debug(
             "Transfering %d MB took %d ms. Goodput: %d kbps",
@@ -1608,12 +1743,25 @@ class MeasurementGoodput(Measurement):
             time,
             goodput,
         )
+        self._timeseries = GoodputSeries(
+            times, sizes, self.goodput_bin_size(), total_bytes=self.FILESIZE
+        )
+        logging.debug(
+            "Startup time: %d ms. Steady state goodput: %d kbps. Stalls: %s",
+            self._timeseries.startup_time() * 1000,
+            self._timeseries.steady_state(),
+            self._timeseries.stalls(),
+        )
         self._result = goodput
         return TestResult.SUCCEEDED
 
     def result(self) -> float:
         return self._result
 
+    def timeseries(self) -> Optional[GoodputSeries]:
+        """goodput over time, binned into goodput_bin_size() windows"""
+        return self._timeseries
+
 
 class MeasurementCrossTraffic(MeasurementGoodput):
     FILESIZE = 25 * MB
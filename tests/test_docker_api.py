@@ -0,0 +1,135 @@
+import asyncio
+import json
+import os
+import struct
+import tempfile
+import unittest
+
+from docker_api import DockerClient, DockerError
+
+
+class FakeDaemon:
+    """Answers a few Engine API requests on a unix socket."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connections = 0
+        self.requests = []
+        self._server = None
+        self._handlers = set()
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        # the handlers are done once the client has closed its connections
+        if self._handlers:
+            await asyncio.wait(self._handlers, timeout=5)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                length = 0
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                body = await reader.readexactly(length)
+                self.requests.append((method, path, json.loads(body) if body else None))
+                if not await self._respond(writer, method, path):
+                    break
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, method: str, path: str) -> bool:
+        """Write the response, return whether the connection stays open."""
+        if (method, path) == ("GET", "/images/quic/json"):
+            # chunked, like the daemon answers most requests
+            body = json.dumps({"Id": "sha256:1234"}).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                + b"%x\r\n%s\r\n" % (len(body[:5]), body[:5])
+                + b"%x\r\n%s\r\n" % (len(body[5:]), body[5:])
+                + b"0\r\n\r\n"
+            )
+        elif (method, path) == ("POST", "/containers/server/exec"):
+            self._write_json(writer, 201, {"Id": "exec1"})
+        elif (method, path) == ("POST", "/exec/exec1/start"):
+            # the multiplexed stream ends with the connection
+            stream = b""
+            for kind, data in [(1, b"out\n"), (2, b"err\n"), (1, b"done\n")]:
+                stream += struct.pack(">B3xI", kind, len(data)) + data
+            writer.write(b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n" + stream)
+            await writer.drain()
+            return False
+        elif (method, path) == ("GET", "/exec/exec1/json"):
+            self._write_json(writer, 200, {"ExitCode": 3, "Running": False})
+        else:
+            self._write_json(writer, 404, {"message": "No such image: " + path})
+        await writer.drain()
+        return True
+
+    @staticmethod
+    def _write_json(writer, status: int, result: dict):
+        body = json.dumps(result).encode()
+        writer.write(
+            b"HTTP/1.1 %d X\r\nContent-Type: application/json\r\n" % status
+            + b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+        )
+
+
+class TestDockerClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.daemon = FakeDaemon(os.path.join(self._dir.name, "docker.sock"))
+        await self.daemon.start()
+        self.client = DockerClient(self.daemon.path)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.daemon.stop()
+        self._dir.cleanup()
+
+    async def test_keep_alive(self):
+        for _ in range(3):
+            image = await self.client.inspect_image("quic")
+            self.assertEqual(image["Id"], "sha256:1234")
+        self.assertEqual(self.daemon.connections, 1)
+
+    async def test_not_found(self):
+        with self.assertRaises(DockerError) as cm:
+            await self.client.inspect_image("missing")
+        self.assertEqual(cm.exception.status, 404)
+        # the error response was read completely, the connection is reused
+        await self.client.inspect_image("quic")
+        self.assertEqual(self.daemon.connections, 1)
+
+    async def test_exec(self):
+        code, output = await self.client.exec("server", ["ls", "/logs"])
+        self.assertEqual(code, 3)
+        self.assertEqual(output, "out\nerr\ndone\n")
+        self.assertEqual(
+            self.daemon.requests[0],
+            (
+                "POST",
+                "/containers/server/exec",
+                {"AttachStdout": True, "AttachStderr": True, "Cmd": ["ls", "/logs"]},
+            ),
+        )
+        # the exec stream closed its connection
+        self.assertEqual(self.daemon.connections, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
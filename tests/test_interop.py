@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import tempfile
+import unittest
+
+import testcases
+from interop import InteropRunner, Job
+from result import TestResult
+
+IMPLEMENTATIONS = {
+    "server": {"image": "example/server", "role": "server"},
+    "client": {"image": "example/client", "role": "client"},
+}
+
+
+class TestInteropRunner(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.log_dir = os.path.join(self._dir.name, "logs")
+        # the runner sets up logging to the console
+        logger = logging.getLogger()
+        self._logging = logger.level, logger.handlers[:]
+
+    def tearDown(self):
+        logger = logging.getLogger()
+        logger.setLevel(self._logging[0])
+        logger.handlers[:] = self._logging[1]
+        self._dir.cleanup()
+
+    def _runner(self, **kwargs) -> InteropRunner:
+        with contextlib.redirect_stderr(io.StringIO()):
+            runner = InteropRunner(
+                IMPLEMENTATIONS,
+                ["server"],
+                ["client"],
+                [testcases.TestCaseHandshake],
+                [],
+                output="",
+                debug=False,
+                compliance_cache=os.path.join(self._dir.name, "compliance.json"),
+                history=os.path.join(self._dir.name, "durations.json"),
+                **kwargs,
+            )
+        runner._image_ids = {"server": "sha256:server", "client": "sha256:client"}
+        return runner
+
+    def _run(self, runner: InteropRunner, test, **kwargs):
+        """Record a test in the journal, like _finish_test does."""
+        cell = runner._cell("server", "client", None, test, **kwargs)
+        runner._journal.append(
+            dict(cell, server="server", client="client", result="succeeded", value=1)
+        )
+
+    def _prepare(self, runner: InteropRunner, test, **kwargs):
+        return asyncio.run(
+            runner._prepare_test("server", "client", None, test, **kwargs)
+        )
+
+    def test_resume(self):
+        self._run(self._runner(log_dir=self.log_dir), testcases.TestCaseHandshake)
+        runner = self._runner(log_dir=self.log_dir, resume=True)
+        prepared = self._prepare(runner, testcases.TestCaseHandshake)
+        self.assertEqual(prepared.result, (TestResult.SUCCEEDED, 1))
+        # nothing was set up to run it again
+        self.assertFalse(hasattr(prepared, "log_dirs"))
+        self.assertIn(("server", "client", "handshake"), runner._executed_cells)
+
+    def test_resume_misses(self):
+        self._run(self._runner(log_dir=self.log_dir), testcases.TestCaseHandshake)
+        runner = self._runner(log_dir=self.log_dir, resume=True)
+        journal = runner._journal
+        test = testcases.TestCaseHandshake
+        self.assertIsNotNone(journal.get(runner._cell("server", "client", None, test)))
+        for name, cell in [
+            ("params", runner._cell("server", "client", None, test, "-o cc=1")),
+            ("repetition", runner._cell("server", "client", "2", test)),
+            ("file size", runner._cell("server", "client", None, test, filesize=1)),
+        ]:
+            with self.subTest(name):
+                self.assertIsNone(journal.get(cell))
+
+    def test_previous(self):
+        previous = os.path.join(self._dir.name, "previous")
+        self._run(self._runner(log_dir=previous), testcases.TestCaseHandshake)
+        runner = self._runner(log_dir=self.log_dir, previous=previous)
+        prepared = self._prepare(runner, testcases.TestCaseHandshake)
+        self.assertEqual(prepared.result, (TestResult.SUCCEEDED, 1))
+        self.assertIn(("server", "client", "handshake"), runner._cached_cells)
+        # copied forward, so that resuming this run finds it
+        cell = runner._cell("server", "client", None, testcases.TestCaseHandshake)
+        self.assertTrue(runner._journal.get(cell)["cached"])
+
+    def test_previous_is_stale(self):
+        previous = os.path.join(self._dir.name, "previous")
+        self._run(self._runner(log_dir=previous), testcases.TestCaseHandshake)
+
+        class OtherScenario(testcases.TestCaseHandshake):
+            @staticmethod
+            def scenario() -> str:
+                return "simple-p2p --delay=50ms --bandwidth=10Mbps --queue=25"
+
+        class OtherDefinition(testcases.TestCaseHandshake):
+            def check(self) -> TestResult:
+                return TestResult.FAILED
+
+        runner = self._runner(log_dir=self.log_dir, previous=previous)
+        self.assertIsNotNone(
+            runner._previous.get(
+                runner._cell("server", "client", None, testcases.TestCaseHandshake)
+            )
+        )
+        for name, test in [
+            ("scenario", OtherScenario),
+            ("definition", OtherDefinition),
+        ]:
+            with self.subTest(name):
+                self.assertIsNone(
+                    runner._previous.get(runner._cell("server", "client", None, test))
+                )
+        # a new image of the server
+        runner._image_ids["server"] = "sha256:new"
+        self.assertIsNone(
+            runner._previous.get(
+                runner._cell("server", "client", None, testcases.TestCaseHandshake)
+            )
+        )
+
+    def test_estimate(self):
+        runner = self._runner(log_dir=self.log_dir)
+
+        async def transfer() -> Job:
+            return Job("server", "client", testcases.TestCaseTransfer)
+
+        job = asyncio.run(transfer())
+        # nothing known about the test, its timeout is the estimate
+        self.assertEqual(runner._estimate(job), testcases.TestCaseTransfer.timeout())
+        # how long the test took with other servers and clients
+        runner._history.record("transfer", "other", "client", 10)
+        runner._history.record("transfer", "other", "other", 30)
+        self.assertEqual(runner._estimate(job), 20)
+        runner._history.record("transfer", "server", "client", 5)
+        self.assertEqual(runner._estimate(job), 5)
+        # a test that is in the journal takes no time
+        self._run(runner, testcases.TestCaseTransfer)
+        self.assertEqual(runner._estimate(job), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
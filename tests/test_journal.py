@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+
+from journal import Journal
+
+CELL = {
+    "server_image": "sha256:server",
+    "client_image": "sha256:client",
+    "test": "handshake",
+    "definition": "0123456789abcdef",
+    "scenario": "simple-p2p --delay=15ms --bandwidth=10Mbps --queue=25",
+    "repetition": "",
+    "server_params": "",
+    "client_params": "",
+}
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self._dir.name, "logs", "journal.jsonl")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _entry(self, **fields) -> dict:
+        return dict(dict(CELL, result="succeeded", value=None), **fields)
+
+    def test_round_trip(self):
+        entry = self._entry(params={"cc_server": "bbr"})
+        Journal(self.filename).append(entry)
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(journal.get(CELL), entry)
+        self.assertEqual(journal.entries(), [entry])
+        # without resume, the entries in the file are ignored
+        self.assertIsNone(Journal(self.filename).get(CELL))
+
+    def test_later_entries_win(self):
+        journal = Journal(self.filename)
+        journal.append(self._entry(result="failed"))
+        journal.append(self._entry())
+        self.assertEqual(journal.get(CELL)["result"], "succeeded")
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(journal.get(CELL)["result"], "succeeded")
+        self.assertEqual(len(journal.entries()), 1)
+
+    def test_truncated_line(self):
+        Journal(self.filename).append(self._entry())
+        other = dict(CELL, test="transfer")
+        with open(self.filename, "a") as f:
+            # the run was interrupted while writing this one
+            f.write(json.dumps(self._entry(test="transfer"))[:40])
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(len(journal.entries()), 1)
+        self.assertIsNone(journal.get(other))
+        # the resumed run writes its entries after the cut short one
+        journal.append(self._entry(test="transfer"))
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(journal.get(other)["test"], "transfer")
+        self.assertEqual(len(journal.entries()), 2)
+
+    def test_key_fields(self):
+        journal = Journal(self.filename)
+        journal.append(self._entry())
+        for field, value in [
+            ("scenario", "simple-p2p --delay=30ms --bandwidth=10Mbps --queue=25"),
+            ("server_params", "-o cc_algo=1"),
+            ("client_image", "sha256:other"),
+            ("definition", "fedcba9876543210"),
+            ("repetition", "2"),
+        ]:
+            with self.subTest(field=field):
+                self.assertIsNone(journal.get(dict(CELL, **{field: value})))
+        # what's not part of the key doesn't matter
+        self.assertIsNotNone(journal.get(dict(CELL, server="quic-go")))
+
+
+if __name__ == "__main__":
+    unittest.main()
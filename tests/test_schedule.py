@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+
+import schedule
+from schedule import DurationHistory, predict_makespan
+
+
+class TestDurationHistory(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self._dir.name, "durations.json")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_smoothing(self):
+        history = DurationHistory(self.filename)
+        self.assertIsNone(history.get("transfer", "quic-go", "ngtcp2"))
+        history.record("transfer", "quic-go", "ngtcp2", 40)
+        self.assertEqual(history.get("transfer", "quic-go", "ngtcp2"), 40)
+        history.record("transfer", "quic-go", "ngtcp2", 20)
+        expected = schedule.SMOOTHING * 20 + (1 - schedule.SMOOTHING) * 40
+        self.assertAlmostEqual(history.get("transfer", "quic-go", "ngtcp2"), expected)
+        # saved right away
+        history = DurationHistory(self.filename)
+        self.assertAlmostEqual(history.get("transfer", "quic-go", "ngtcp2"), expected)
+
+    def test_typical(self):
+        history = DurationHistory("")
+        self.assertIsNone(history.typical("transfer"))
+        history.record("transfer", "quic-go", "ngtcp2", 10)
+        history.record("transfer", "quic-go", "quiche", 30)
+        history.record("transfer", "lsquic", "ngtcp2", 20)
+        history.record("handshake", "lsquic", "ngtcp2", 100)
+        self.assertEqual(history.typical("transfer"), 20)
+        # without a filename, nothing is written
+        self.assertEqual(os.listdir(self._dir.name), [])
+
+    def test_broken_file(self):
+        with open(self.filename, "w") as f:
+            f.write('{"transfer": ')
+        history = DurationHistory(self.filename)
+        self.assertIsNone(history.get("transfer", "quic-go", "ngtcp2"))
+        history.record("transfer", "quic-go", "ngtcp2", 5)
+        with open(self.filename) as f:
+            self.assertEqual(json.load(f), {"transfer": {"quic-go": {"ngtcp2": 5}}})
+
+
+class TestMakespan(unittest.TestCase):
+    def test_longest_first(self):
+        # 7 + 4 + 3 | 6 + 5
+        self.assertEqual(predict_makespan([3, 5, 7, 4, 6], 2), 14)
+
+    def test_not_optimal(self):
+        # longest first: 5+3+3 | 5+3 | 4+4, the best schedule takes 9
+        self.assertEqual(predict_makespan([3, 3, 3, 4, 4, 5, 5], 3), 11)
+
+    def test_more_workers_than_jobs(self):
+        self.assertEqual(predict_makespan([2, 8], 4), 8)
+        self.assertEqual(predict_makespan([], 2), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
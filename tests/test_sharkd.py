@@ -0,0 +1,96 @@
+import io
+import json
+import unittest
+
+import trace
+from sharkd import SharkdSession
+from trace import Direction, PacketType
+
+# the custom columns of a "frames" call, in this order
+COLUMNS = [
+    "frame.time_epoch",
+    "frame.number",
+    "ip.src",
+    "ip.dst",
+    "ipv6.src",
+    "ipv6.dst",
+    "udp.srcport",
+    "udp.dstport",
+    "udp.length",
+    "ip.dsfield.ecn",
+    "ipv6.tclass.ecn",
+    "quic.header_form",
+    "quic.version",
+    "quic.long.packet_type",
+    "quic.long.packet_type_v2",
+    "quic.scid",
+    "quic.dcid",
+    "quic.decryption_failed",
+]
+
+# sharkd's answer to a "frames" call on a QUIC v1 handshake with ECN marks
+ECN_FRAMES = """
+{"c": ["1.000000000", "1", "193.167.0.100", "193.167.100.100", "", "", "4433", "443", "1208", "ECT(0)", "", "Long Header", "1", "Initial", "", "c1c1c1c1", "8394c8f03e515708", ""], "num": 1}
+{"c": ["1.030000000", "2", "193.167.100.100", "193.167.0.100", "", "", "443", "4433", "1208", "CE", "", "Long Header,Long Header", "1,1", "Initial,Handshake", "", "5e5e5e5e,5e5e5e5e", "c1c1c1c1,c1c1c1c1", ""], "num": 2}
+{"c": ["1.060000000", "3", "193.167.0.100", "193.167.100.100", "", "", "4433", "443", "60", "Not-ECT", "", "Short Header", "", "", "", "", "5e5e5e5e", ""], "num": 3}
+"""
+
+# ... and on a v1 Initial, answered by Version Negotiation and a v2 handshake
+V2_FRAMES = """
+{"c": ["1.000000000", "1", "", "", "fd00:cafe:cafe::100", "fd00:cafe:cafe:100::100", "4433", "443", "1208", "", "Not-ECT", "Long Header", "1", "Initial", "", "c1c1c1c1", "8394c8f03e515708", ""], "num": 1}
+{"c": ["1.030000000", "2", "", "", "fd00:cafe:cafe:100::100", "fd00:cafe:cafe::100", "443", "4433", "40", "", "Not-ECT", "Long Header", "Version Negotiation", "", "", "5e5e5e5e", "c1c1c1c1", ""], "num": 2}
+{"c": ["1.060000000", "3", "", "", "fd00:cafe:cafe:100::100", "fd00:cafe:cafe::100", "443", "4433", "1208", "", "ECT(1)", "Long Header,Long Header", "2,2", "", "Initial,Handshake", "5e5e5e5e,5e5e5e5e", "c1c1c1c1,c1c1c1c1", ""], "num": 3}
+"""
+
+
+class FakeProcess:
+    """Answers the first call of a SharkdSession."""
+
+    def __init__(self, result: list):
+        self.stdin = io.StringIO()
+        response = {"jsonrpc": "2.0", "id": 1, "result": result}
+        self.stdout = io.StringIO(json.dumps(response) + "\n")
+
+
+def read_packets(frames: str) -> list:
+    session = SharkdSession.__new__(SharkdSession)
+    session._id = 0
+    session._proc = FakeProcess([json.loads(f) for f in frames.split("\n") if f])
+    columns = {field: i for i, field in enumerate(COLUMNS)}
+    packets = []
+    for datagram, row in enumerate(session.frames(COLUMNS, "quic")):
+        p = trace._FieldPacket(columns, row)
+        packets += trace._to_packets(p, datagram, COLUMNS)
+    return packets
+
+
+class TestResolvedColumns(unittest.TestCase):
+    def test_ecn(self):
+        packets = read_packets(ECN_FRAMES)
+        self.assertEqual(
+            [(p.packet_type, p.version, p.ecn) for p in packets],
+            [
+                (PacketType.INITIAL, 1, 2),
+                (PacketType.INITIAL, 1, 3),
+                (PacketType.HANDSHAKE, 1, 3),
+                (PacketType.ONERTT, None, 0),
+            ],
+        )
+        self.assertEqual(packets[-1].direction, Direction.FROM_CLIENT)
+
+    def test_v2(self):
+        packets = read_packets(V2_FRAMES)
+        self.assertEqual(
+            [(p.packet_type, p.version, p.ecn) for p in packets],
+            [
+                (PacketType.INITIAL, 1, 0),
+                (PacketType.VERSIONNEGOTIATION, 0, 0),
+                (PacketType.INITIAL, 0x6B3343CF, 1),
+                (PacketType.HANDSHAKE, 0x6B3343CF, 1),
+            ],
+        )
+        self.assertEqual(packets[-1].direction, Direction.FROM_SERVER)
+
+
+if __name__ == "__main__":
+    unittest.main()
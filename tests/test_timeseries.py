@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+from timeseries import GoodputSeries
+
+# exact in binary, so that every datagram falls into the bin it's meant for
+BIN_SIZE = 0.25
+
+
+def series(sizes: list, **kwargs) -> GoodputSeries:
+    """One datagram at the start of every bin, none where the size is 0."""
+    times = np.array([100 + i * BIN_SIZE for i, s in enumerate(sizes) if s])
+    return GoodputSeries(times, np.array([s for s in sizes if s]), BIN_SIZE, **kwargs)
+
+
+class TestGoodputSeries(unittest.TestCase):
+    def test_ramp_then_plateau(self):
+        s = series([250, 500, 750] + [1000] * 9)
+        # 1000 bytes per 250 ms
+        self.assertEqual(s.goodput.tolist(), [8, 16, 24] + [32] * 9)
+        self.assertEqual(s.steady_state(), 32)
+        self.assertEqual(s.startup_time(), 0.75)
+        self.assertEqual(s.startup_time(0.5), 0.25)
+        self.assertEqual(s.stalls(), [])
+
+    def test_stall(self):
+        s = series([1000] * 10 + [0] * 5 + [1000] * 10 + [0] + [1000] * 4)
+        self.assertEqual(len(s.goodput), 30)
+        self.assertEqual(s.stalls(), [(2.5, 3.75), (6.25, 6.5)])
+        self.assertEqual(s.stalls(min_duration=0.5), [(2.5, 3.75)])
+        self.assertEqual(s.steady_state(), 32)
+        self.assertEqual(s.startup_time(), 0)
+
+    def test_total_bytes(self):
+        s = series([1000] * 4, total_bytes=8000)
+        self.assertEqual(s.bytes.tolist(), [2000] * 4)
+        self.assertEqual(s.steady_state(), 64)
+
+    def test_single_sample(self):
+        s = series([500])
+        self.assertEqual(s.goodput.tolist(), [16])
+        self.assertEqual(s.steady_state(), 16)
+        self.assertEqual(s.startup_time(), 0)
+        self.assertEqual(s.stalls(), [])
+        d = s.to_dict()
+        self.assertEqual((d["start"], d["goodput"]), (100, [16]))
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            GoodputSeries(np.array([]), np.array([]))
+
+
+if __name__ == "__main__":
+    unittest.main()
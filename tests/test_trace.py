@@ -0,0 +1,532 @@
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import trace
+from trace import Direction, Frame, PacketType
+
+FIELDS = ["quic.packet_number", "quic.crypto.offset", "quic.crypto.length"]
+
+# RFC 9001, section 5.2
+INITIAL_SALT = bytes.fromhex("38762cf7f55934b34d179ae6a4c80cadccbb7f0a")
+
+ODCID = bytes.fromhex("8394c8f03e515708")
+CLIENT_CID = bytes.fromhex("c1c1c1c1")
+SERVER_CID = bytes.fromhex("5e5e5e5e")
+
+
+def _expand_label(secret: bytes, label: bytes, length: int) -> bytes:
+    info = struct.pack("!HB", length, 6 + len(label)) + b"tls13 " + label + b"\x00"
+    return hmac.new(secret, info + b"\x01", hashlib.sha256).digest()[:length]
+
+
+def _long_header(packet_type: int, dcid: bytes, scid: bytes, length: int) -> bytes:
+    header = bytes([0xC1 | packet_type << 4]) + struct.pack("!I", 1)
+    header += bytes([len(dcid)]) + dcid + bytes([len(scid)]) + scid
+    if packet_type == 0:
+        header += b"\x00"  # no token
+    return header + struct.pack("!H", 0x4000 | length)
+
+
+def _initial(label: bytes, dcid: bytes, scid: bytes, pn: int, frames: bytes) -> bytes:
+    """Build an Initial packet with a 2 byte packet number."""
+    from Crypto.Cipher import AES
+
+    initial_secret = hmac.new(INITIAL_SALT, ODCID, hashlib.sha256).digest()
+    secret = _expand_label(initial_secret, label, 32)
+    key = _expand_label(secret, b"quic key", 16)
+    iv = _expand_label(secret, b"quic iv", 12)
+    hp = _expand_label(secret, b"quic hp", 16)
+    pn_bytes = struct.pack("!H", pn)
+    header = _long_header(0, dcid, scid, 2 + len(frames) + 16) + pn_bytes
+    nonce = bytes(a ^ b for a, b in zip(iv, pn.to_bytes(12, "big")))
+    aead = AES.new(key, AES.MODE_GCM, nonce=nonce, mac_len=16)
+    aead.update(header)
+    ciphertext, tag = aead.encrypt_and_digest(frames)
+    ciphertext += tag
+    mask = AES.new(hp, AES.MODE_ECB).encrypt(ciphertext[2:18])
+    first = bytes([header[0] ^ (mask[0] & 0x0F)])
+    protected_pn = bytes(b ^ m for b, m in zip(pn_bytes, mask[1:3]))
+    return first + header[1:-2] + protected_pn + ciphertext
+
+
+def _crypto(handshake_type: int, length: int) -> bytes:
+    message = bytes([handshake_type]) + length.to_bytes(3, "big") + bytes(length)
+    return b"\x06\x00" + struct.pack("!H", 0x4000 | len(message)) + message
+
+
+def _datagram(src: str, dst: str, sport: int, dport: int, payload: bytes) -> bytes:
+    udp = struct.pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload
+    return (
+        struct.pack("!BBHHHBBH", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0)
+        + socket.inet_aton(src)
+        + socket.inet_aton(dst)
+        + udp
+    )
+
+
+def write_handshake_pcap(filename: str):
+    """Write a client Initial, and a server Initial coalesced with a Handshake
+    packet. Only the Initial packets can be decrypted."""
+    client_initial = _initial(
+        b"client in", ODCID, CLIENT_CID, 0, _crypto(1, 200) + bytes(1000)
+    )
+    server_initial = _initial(b"server in", CLIENT_CID, SERVER_CID, 0, _crypto(2, 90))
+    handshake = os.urandom(60)
+    handshake = _long_header(2, CLIENT_CID, SERVER_CID, len(handshake)) + handshake
+    frames = [
+        _datagram(trace.IP4_CLIENT, trace.IP4_SERVER, 4433, 443, client_initial),
+        _datagram(
+            trace.IP4_SERVER, trace.IP4_CLIENT, 443, 4433, server_initial + handshake
+        ),
+    ]
+    with open(filename, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 101))
+        for i, frame in enumerate(frames):
+            f.write(struct.pack("<IIII", 1, i * 1000, len(frame), len(frame)))
+            f.write(frame)
+
+
+def _row(**values) -> tuple:
+    return tuple(
+        values.get(f.replace(".", "_"), "") for f in trace.TSHARK_FIELDS + FIELDS
+    )
+
+
+# a server Initial coalesced with a Handshake packet that can't be decrypted,
+# and a Handshake packet that can't be decrypted coalesced with a 1-RTT packet
+ROWS = [
+    _row(
+        frame_time_epoch="1.0",
+        frame_number="2",
+        ip_src=trace.IP4_SERVER,
+        ip_dst=trace.IP4_CLIENT,
+        udp_srcport="443",
+        udp_dstport="4433",
+        udp_length="1200",
+        quic_header_form="1,1",
+        quic_version="0x00000001,0x00000001",
+        quic_long_packet_type="0,2",
+        quic_scid="5e5e5e5e,5e5e5e5e",
+        quic_dcid="c1c1c1c1,c1c1c1c1",
+        quic_decryption_failed="1",
+        quic_packet_number="0",
+        quic_crypto_offset="0",
+        quic_crypto_length="94",
+    ),
+    _row(
+        frame_time_epoch="2.0",
+        frame_number="5",
+        ip_src=trace.IP4_SERVER,
+        ip_dst=trace.IP4_CLIENT,
+        udp_srcport="443",
+        udp_dstport="4433",
+        udp_length="1200",
+        quic_header_form="1,0",
+        quic_version="0x00000001",
+        quic_long_packet_type="2",
+        quic_scid="5e5e5e5e",
+        quic_dcid="c1c1c1c1,c1c1c1c1",
+        quic_decryption_failed="1",
+        quic_packet_number="7",
+    ),
+]
+
+# the same datagrams, dissected packet by packet
+LAYERS = {
+    2: [
+        {
+            "quic.header_form": ["1"],
+            "quic.version": ["0x00000001"],
+            "quic.long.packet_type": ["0"],
+            "quic.scid": ["5e5e5e5e"],
+            "quic.dcid": ["c1c1c1c1"],
+            "quic.packet_number": ["0"],
+            "quic.crypto.offset": ["0"],
+            "quic.crypto.length": ["94"],
+        },
+        {
+            "quic.header_form": ["1"],
+            "quic.version": ["0x00000001"],
+            "quic.long.packet_type": ["2"],
+            "quic.scid": ["5e5e5e5e"],
+            "quic.dcid": ["c1c1c1c1"],
+            "quic.decryption_failed": ["1"],
+        },
+    ],
+    5: [
+        {
+            "quic.header_form": ["1"],
+            "quic.version": ["0x00000001"],
+            "quic.long.packet_type": ["2"],
+            "quic.scid": ["5e5e5e5e"],
+            "quic.dcid": ["c1c1c1c1"],
+            "quic.decryption_failed": ["1"],
+        },
+        {
+            "quic.header_form": ["0"],
+            "quic.dcid": ["c1c1c1c1"],
+            "quic.packet_number": ["7"],
+        },
+    ],
+}
+
+
+class TestCoalescedPackets(unittest.TestCase):
+    def _packets(self, layers: dict) -> list:
+        fields = trace.TSHARK_FIELDS + FIELDS
+        columns = {f: i for i, f in enumerate(fields)}
+        rows = trace._split_coalesced(fields, ROWS, lambda frames: layers)
+        packets = []
+        for datagram, row in enumerate(rows):
+            p = trace._FieldPacket(columns, row)
+            packets += trace._to_packets(p, datagram, fields)
+        return packets
+
+    def test_unattributed_fields_are_missing(self):
+        initial, handshake, handshake2, onertt = self._packets({})
+        self.assertEqual(
+            [p.packet_type for p in [initial, handshake, handshake2, onertt]],
+            [
+                PacketType.INITIAL,
+                PacketType.HANDSHAKE,
+                PacketType.HANDSHAKE,
+                PacketType.ONERTT,
+            ],
+        )
+        self.assertEqual(handshake.scid, "5e5e5e5e")
+        for p in [initial, handshake]:
+            self.assertEqual(p.frames, Frame.NONE)
+            self.assertEqual(p.get("quic.crypto.offset"), "")
+        for p in [initial, handshake, handshake2, onertt]:
+            self.assertIsNone(p.packet_number)
+
+    def test_fields_per_packet(self):
+        initial, handshake, handshake2, onertt = self._packets(LAYERS)
+        self.assertEqual(initial.packet_number, 0)
+        self.assertEqual(initial.frames, Frame.CRYPTO)
+        self.assertEqual(initial.get("quic.crypto.length"), "94")
+        self.assertIsNone(handshake.packet_number)
+        self.assertEqual(handshake.frames, Frame.NONE)
+        self.assertEqual(handshake.get("quic.crypto.offset"), "")
+        self.assertIsNone(handshake2.packet_number)
+        self.assertEqual(onertt.packet_number, 7)
+
+    def test_streaming(self):
+        fields = trace.TSHARK_FIELDS + FIELDS
+        plain = _row(frame_number="1", quic_header_form="1")
+        reads = []
+
+        def read_layers(frames):
+            reads.append(frames)
+            return LAYERS
+
+        rows = trace._split_coalesced(fields, [plain] + ROWS, read_layers)
+        # rows before the first coalesced datagram aren't held back
+        self.assertEqual(next(rows), plain)
+        self.assertEqual(reads, [])
+        self.assertEqual(len(list(rows)), 2)
+        self.assertEqual(reads, [[2, 5]])
+
+    def test_batches(self):
+        fields = trace.TSHARK_FIELDS + FIELDS
+        reads = []
+
+        def read_layers(frames):
+            reads.append(frames)
+            return LAYERS
+
+        with mock.patch.object(trace, "_COALESCED_BATCH", 1):
+            rows = list(trace._split_coalesced(fields, ROWS, read_layers))
+        self.assertEqual(reads, [[2], [5]])
+        self.assertEqual(rows, list(trace._split_coalesced(fields, ROWS, read_layers)))
+
+    def test_json_layers(self):
+        # shaped like tshark -T json, which repeats the "quic" key
+        output = """[{"_source": {"layers": {
+            "frame": {"frame.number": "2"},
+            "udp": {"udp.srcport": "443"},
+            "quic": {
+                "quic.header_form": "1",
+                "quic.packet_number": "0",
+                "quic.frame": {"quic.crypto.offset": "0", "tls": {
+                    "tls.handshake": {"tls.handshake.type": "2"}}}},
+            "quic": {"quic.header_form": "1", "quic.decryption_failed": "1"}
+        }}}]"""
+        packets = json.loads(output, object_pairs_hook=trace._JsonObject)
+        layers = dict(dict(packets[0])["_source"])["layers"]
+        self.assertEqual(
+            trace._json_quic_layers(layers),
+            [
+                {
+                    "quic.header_form": ["1"],
+                    "quic.packet_number": ["0"],
+                    "quic.crypto.offset": ["0"],
+                    "tls.handshake.type": ["2"],
+                },
+                {"quic.header_form": ["1"], "quic.decryption_failed": ["1"]},
+            ],
+        )
+
+
+def _pcap(frames: list, magic: int = 0xA1B2C3D4, endian: str = "<") -> bytes:
+    """A pcap file with raw IP frames, frames are (seconds, fraction, data)."""
+    data = struct.pack(endian + "IHHiIII", magic, 2, 4, 0, 0, 65535, 101)
+    for sec, frac, frame in frames:
+        data += struct.pack(endian + "IIII", sec, frac, len(frame), len(frame))
+        data += frame
+    return data
+
+
+def _pcapng_block(block_type: int, body: bytes) -> bytes:
+    body += bytes(-len(body) % 4)
+    length = struct.pack("<I", 12 + len(body))
+    return struct.pack("<I", block_type) + length + body + length
+
+
+def _pcapng(frames: list) -> bytes:
+    """A pcapng file with raw IP frames, with nanosecond timestamps."""
+    data = _pcapng_block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1))
+    # if_tsresol 9, then the end of the options
+    options = struct.pack("<HHB3x", 9, 1, 9) + struct.pack("<HH", 0, 0)
+    data += _pcapng_block(1, struct.pack("<HHI", 101, 0, 65535) + options)
+    for ns, frame in frames:
+        header = struct.pack(
+            "<IIIII", 0, ns >> 32, ns & 0xFFFFFFFF, len(frame), len(frame)
+        )
+        data += _pcapng_block(6, header + frame)
+    return data
+
+
+def _handshake(dcid: bytes, scid: bytes, payload: bytes = bytes(30)) -> bytes:
+    return _long_header(2, dcid, scid, len(payload)) + payload
+
+
+def _short(dcid: bytes) -> bytes:
+    return bytes([0x41]) + dcid + bytes(20)
+
+
+def _to_server(payload: bytes) -> bytes:
+    return _datagram(trace.IP4_CLIENT, trace.IP4_SERVER, 4433, 443, payload)
+
+
+def _to_client(payload: bytes) -> bytes:
+    return _datagram(trace.IP4_SERVER, trace.IP4_CLIENT, 443, 4433, payload)
+
+
+class TestReadPcap(unittest.TestCase):
+    def _read(self, data: bytes) -> list:
+        with tempfile.NamedTemporaryFile(suffix=".pcap") as f:
+            f.write(data)
+            f.flush()
+            rows = list(trace.read_pcap(f.name, trace.PCAP_FIELDS))
+        return [dict(zip(trace.PCAP_FIELDS, row)) for row in rows]
+
+    def test_pcap_formats(self):
+        frame = _to_server(_handshake(SERVER_CID, CLIENT_CID))
+        for magic, frac in [(0xA1B2C3D4, 250000), (0xA1B23C4D, 250000000)]:
+            for endian in "<>":
+                with self.subTest(magic=hex(magic), endian=endian):
+                    (row,) = self._read(_pcap([(7, frac, frame)], magic, endian))
+                    self.assertEqual(row["frame.time_epoch"], "7.250000000")
+                    self.assertEqual(row["frame.number"], "1")
+                    self.assertEqual(row["ip.src"], trace.IP4_CLIENT)
+                    self.assertEqual(row["udp.dstport"], "443")
+                    self.assertEqual(row["quic.long.packet_type"], "2")
+
+    def test_pcapng(self):
+        frames = [
+            (1_500_000_001, _to_server(_handshake(SERVER_CID, CLIENT_CID))),
+            (2_000_000_000, _to_client(_handshake(CLIENT_CID, SERVER_CID))),
+        ]
+        rows = self._read(_pcapng(frames))
+        self.assertEqual(
+            [(r["frame.time_epoch"], r["frame.number"], r["ip.src"]) for r in rows],
+            [
+                ("1.500000001", "1", trace.IP4_CLIENT),
+                ("2.000000000", "2", trace.IP4_SERVER),
+            ],
+        )
+
+    def test_truncated(self):
+        frame = _to_server(_handshake(SERVER_CID, CLIENT_CID))
+        data = _pcap([(1, 0, frame), (2, 0, frame)])
+        # the last record is cut short in the middle of its data
+        self.assertEqual(len(self._read(data[:-10])), 1)
+        # ... or in the middle of its record header
+        self.assertEqual(len(self._read(data[: -len(frame) - 8])), 1)
+        data = _pcapng([(1, frame), (2, frame)])
+        self.assertEqual(len(self._read(data[:-10])), 1)
+
+    def test_coalesced(self):
+        payload = _handshake(CLIENT_CID, SERVER_CID) + _short(CLIENT_CID)
+        (row,) = self._read(_pcap([(1, 0, _to_client(payload))]))
+        self.assertEqual(row["quic.header_form"], "1,0")
+        self.assertEqual(row["quic.long.packet_type"], "2")
+        self.assertEqual(row["quic.length"], "30")
+        self.assertEqual(row["quic.scid"], "5e5e5e5e")
+        self.assertEqual(row["quic.dcid"], "c1c1c1c1,c1c1c1c1")
+
+    def test_short_header_dcid(self):
+        other = bytes.fromhex("0102030405060708")
+        rows = self._read(
+            _pcap(
+                [
+                    (1, 0, _to_server(_handshake(SERVER_CID, CLIENT_CID))),
+                    (2, 0, _to_server(_short(SERVER_CID))),
+                    (3, 0, _to_server(_short(other))),
+                ]
+            )
+        )
+        self.assertEqual([r["quic.header_form"] for r in rows], ["1", "0", "0"])
+        # the DCID of a short header packet is one of the known connection IDs
+        self.assertEqual(rows[1]["quic.dcid"], "5e5e5e5e")
+        self.assertEqual(rows[2]["quic.dcid"], "")
+
+    def test_retry_and_version_negotiation(self):
+        token = bytes.fromhex("aabbccdd")
+        retry = bytes([0xF0]) + struct.pack("!I", 1)
+        retry += bytes([4]) + CLIENT_CID + bytes([4]) + SERVER_CID
+        retry += token + bytes(16)  # the integrity tag
+        vn = bytes([0x80]) + struct.pack("!I", 0)
+        vn += bytes([4]) + CLIENT_CID + bytes([8]) + ODCID
+        vn += struct.pack("!II", 1, 0x6B3343CF)
+        data = _pcap([(1, 0, _to_client(retry)), (2, 0, _to_client(vn))])
+        retry_row, vn_row = self._read(data)
+        self.assertEqual(retry_row["quic.long.packet_type"], "3")
+        self.assertEqual(retry_row["quic.retry_token"], "aabbccdd")
+        self.assertEqual(retry_row["quic.scid"], "5e5e5e5e")
+        self.assertEqual(vn_row["quic.version"], "0x00000000")
+        self.assertEqual(vn_row["quic.long.packet_type"], "")
+        self.assertEqual(vn_row["quic.scid"], ODCID.hex())
+        with tempfile.NamedTemporaryFile(suffix=".pcap") as f:
+            f.write(data)
+            f.flush()
+            analyzer = trace.TraceAnalyzer(f.name, backend="fields")
+            self.assertEqual(len(analyzer.get_retry(Direction.FROM_SERVER)), 1)
+            self.assertEqual(len(analyzer.get_vnp(Direction.FROM_SERVER)), 1)
+
+
+def _no_reads(filename: str, fields: list):
+    raise AssertionError("the trace was read again")
+    yield
+
+
+class TestTraceCache(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.pcap = os.path.join(self._dir.name, "trace.pcap")
+        self.frames = [
+            (1, 0, _to_server(_handshake(SERVER_CID, CLIENT_CID))),
+            (2, 0, _to_client(_handshake(CLIENT_CID, SERVER_CID) + _short(CLIENT_CID))),
+        ]
+        with open(self.pcap, "wb") as f:
+            f.write(_pcap(self.frames))
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _rows(self, cache: bool = True, keylog_file: str = None) -> list:
+        # the fields backend reads traces with only PCAP_FIELDS without tshark
+        analyzer = trace.TraceAnalyzer(
+            self.pcap, keylog_file, backend="fields", cache=cache
+        )
+        return analyzer._get_rows()
+
+    def test_hit(self):
+        cold = self._rows(cache=False)
+        self.assertEqual(self._rows(), cold)
+        self.assertTrue(os.path.isfile(self.pcap + ".npz"))
+        with mock.patch.object(trace, "read_pcap", _no_reads):
+            self.assertEqual(self._rows(), cold)
+            packets = trace.TraceAnalyzer(self.pcap, backend="fields", cache=True)
+            self.assertEqual(len(packets.get_handshake()), 2)
+            self.assertEqual(len(packets.get_1rtt()), 1)
+
+    def test_pcap_changed(self):
+        self._rows()
+        with open(self.pcap, "wb") as f:
+            f.write(_pcap(self.frames + self.frames))
+        self.assertFalse(self._is_hit())
+        rows = self._rows()
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows, self._rows(cache=False))
+
+    def _is_hit(self, keylog_file: str = None) -> bool:
+        with mock.patch.object(trace, "read_pcap", _no_reads):
+            try:
+                self._rows(keylog_file=keylog_file)
+            except AssertionError:
+                return False
+        return True
+
+    def test_keylog_changed(self):
+        keylog_file = os.path.join(self._dir.name, "keys.log")
+        self._rows()
+        self.assertTrue(self._is_hit())
+        with open(keylog_file, "w") as f:
+            f.write("CLIENT_HANDSHAKE_TRAFFIC_SECRET 00 11\n")
+        self.assertFalse(self._is_hit(keylog_file))
+        self._rows(keylog_file=keylog_file)
+        self.assertTrue(self._is_hit(keylog_file))
+        with open(keylog_file, "a") as f:
+            f.write("SERVER_HANDSHAKE_TRAFFIC_SECRET 00 22\n")
+        self.assertFalse(self._is_hit(keylog_file))
+
+    def test_reader_changed(self):
+        self._rows()
+        cache = trace._TraceCache(self.pcap, None)
+        self.assertIsNotNone(cache.get_rows(trace.TSHARK_FIELDS, "read_pcap"))
+        self.assertIsNone(cache.get_rows(trace.TSHARK_FIELDS, "TShark 4.4.0"))
+
+    def test_incomplete_read(self):
+        analyzer = trace.TraceAnalyzer(self.pcap, backend="fields", cache=True)
+        packets = analyzer.iter_raw_packets()
+        next(packets)
+        packets.close()
+        # only the rows of the whole trace are cached
+        self.assertFalse(os.path.exists(self.pcap + ".npz"))
+        self.assertEqual(len(list(analyzer.iter_raw_packets())), 2)
+        self.assertTrue(os.path.isfile(self.pcap + ".npz"))
+
+
+@unittest.skipIf(shutil.which("tshark") is None, "needs tshark")
+class TestBackends(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._pcap = os.path.join(self._dir.name, "trace.pcap")
+        write_handshake_pcap(self._pcap)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _packets(self, backend: str) -> list:
+        analyzer = trace.TraceAnalyzer(self._pcap, backend=backend, fields=FIELDS)
+        return [
+            (p.packet_type, p.direction, p.packet_number, p.frames, p.fields)
+            for p in analyzer.get_initial() + analyzer.get_handshake()
+        ]
+
+    def test_coalesced_packets(self):
+        expected = self._packets("pyshark")
+        server_handshake = [p for p in expected if p[0] == PacketType.HANDSHAKE]
+        self.assertEqual(len(server_handshake), 1)
+        self.assertEqual(server_handshake[0][1], Direction.FROM_SERVER)
+        self.assertEqual(server_handshake[0][3], Frame.NONE)
+        backends = ["fields"]
+        if shutil.which("sharkd") is not None:
+            backends.append("sharkd")
+        for backend in backends:
+            with self.subTest(backend=backend):
+                self.assertEqual(self._packets(backend), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
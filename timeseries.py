@@ -0,0 +1,66 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class GoodputSeries:
+    """Goodput of a transfer over time, binned into fixed-size windows.
+
+    times are the sniff times (in s) of the datagrams carrying the transfer,
+    sizes their payload sizes (in bytes). If total_bytes is given, the bins
+    are scaled so that they sum up to it, e.g. to the size of the transferred
+    file, which spreads the protocol overhead evenly across the transfer.
+    """
+
+    def __init__(
+        self,
+        times: np.ndarray,
+        sizes: np.ndarray,
+        bin_size: float = 0.1,
+        total_bytes: int = 0,
+    ):
+        if len(times) == 0:
+            raise ValueError("no packets")
+        self.start = float(times[0])
+        self.bin_size = bin_size
+        bins = ((times - self.start) / bin_size).astype(np.int64)
+        self.bytes = np.bincount(bins, weights=sizes).astype(np.float64)
+        if total_bytes and self.bytes.sum() > 0:
+            self.bytes *= total_bytes / self.bytes.sum()
+        # kbps, like MeasurementGoodput.result()
+        self.goodput = self.bytes * 8 / bin_size / 1000
+
+    def steady_state(self) -> float:
+        """Median goodput after the first quarter of the transfer.
+
+        The last bin is left out, since the transfer ends somewhere within it.
+        """
+        start = len(self.goodput) // 4
+        end = max(len(self.goodput) - 1, start + 1)
+        return float(np.median(self.goodput[start:end]))
+
+    def startup_time(self, fraction: float = 0.9) -> float:
+        """Time (in s) until the goodput first reaches a fraction of the steady state."""
+        reached = np.flatnonzero(self.goodput >= fraction * self.steady_state())
+        return float(reached[0] * self.bin_size)
+
+    def stalls(self, min_duration: float = 0.2) -> List[Tuple[float, float]]:
+        """Intervals (in s, from the start) without any data delivered."""
+        idle = np.concatenate(([False], self.bytes == 0, [False]))
+        edges = np.flatnonzero(np.diff(idle.astype(np.int8)))
+        starts, ends = edges[0::2], edges[1::2]
+        long_enough = (ends - starts) * self.bin_size >= min_duration
+        return [
+            (float(s * self.bin_size), float(e * self.bin_size))
+            for s, e in zip(starts[long_enough], ends[long_enough])
+        ]
+
+    def to_dict(self) -> Dict:
+        return {
+            "start": self.start,
+            "bin_size": self.bin_size,
+            "goodput": [round(g, 3) for g in self.goodput.tolist()],
+            "steady_state": self.steady_state(),
+            "startup_time": self.startup_time(),
+            "stalls": self.stalls(),
+        }
@@ -1,9 +1,25 @@
+import concurrent.futures
+import contextlib
 import datetime
+import functools
+import hashlib
+import ipaddress
+import json
 import logging
-from enum import Enum
-from typing import List, Optional, Tuple
+import mmap
+import os
+import socket
+import struct
+import subprocess
+import tempfile
+import zipfile
+from enum import Enum, Flag
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import pyshark
+from sharkd import POOL as SHARKD_POOL
+from sharkd import read_sharkd, read_sharkd_layers
 
 IP4_CLIENT = "193.167.0.100"
 IP4_SERVER = "193.167.100.100"
@@ -13,6 +29,31 @@ IP6_SERVER = "fd00:cafe:cafe:100::100"
 
 QUIC_V2 = hex(0x6B3343CF)
 
+TRACE_BACKENDS = ["pyshark", "fields", "sharkd"]
+
+# tshark fields every "fields" backend dissection extracts. They are needed to
+# index the packets. Test cases declare whatever else their check reads.
+TSHARK_FIELDS = [
+    "frame.time_epoch",
+    "frame.number",
+    "ip.src",
+    "ip.dst",
+    "ipv6.src",
+    "ipv6.dst",
+    "udp.srcport",
+    "udp.dstport",
+    "udp.length",
+    "ip.dsfield.ecn",
+    "ipv6.tclass.ecn",
+    "quic.header_form",
+    "quic.version",
+    "quic.long.packet_type",
+    "quic.long.packet_type_v2",
+    "quic.scid",
+    "quic.dcid",
+    "quic.decryption_failed",
+]
+
 
 class Direction(Enum):
     ALL = 0
@@ -47,14 +88,34 @@ WIRESHARK_PACKET_TYPES_V2 = {
 }
 
 
-def get_direction(p) -> Direction:
-    if (hasattr(p, "ip") and p.ip.src == IP4_CLIENT) or (
-        hasattr(p, "ipv6") and p.ipv6.src == IP6_CLIENT
+class Endpoints:
+    """The addresses of the client and the server in a trace."""
+
+    def __init__(
+        self,
+        client_ip4: str = IP4_CLIENT,
+        client_ip6: str = IP6_CLIENT,
+        server_ip4: str = IP4_SERVER,
+        server_ip6: str = IP6_SERVER,
+    ):
+        self.client_ip4 = client_ip4
+        self.client_ip6 = ipaddress.ip_address(client_ip6)
+        self.server_ip4 = server_ip4
+        self.server_ip6 = ipaddress.ip_address(server_ip6)
+
+
+DEFAULT_ENDPOINTS = Endpoints()
+
+
+def get_direction(p, endpoints: Endpoints = DEFAULT_ENDPOINTS) -> Direction:
+    # compare addresses, not strings: tshark prints IPv6 addresses compressed
+    if (hasattr(p, "ip") and p.ip.src == endpoints.client_ip4) or (
+        hasattr(p, "ipv6") and ipaddress.ip_address(p.ipv6.src) == endpoints.client_ip6
     ):
         return Direction.FROM_CLIENT
 
-    if (hasattr(p, "ip") and p.ip.src == IP4_SERVER) or (
-        hasattr(p, "ipv6") and p.ipv6.src == IP6_SERVER
+    if (hasattr(p, "ip") and p.ip.src == endpoints.server_ip4) or (
+        hasattr(p, "ipv6") and ipaddress.ip_address(p.ipv6.src) == endpoints.server_ip6
     ):
         return Direction.FROM_SERVER
 
@@ -62,42 +123,1151 @@ def get_direction(p) -> Direction:
 
 
 def get_packet_type(p) -> PacketType:
-    if p.quic.header_form == "0":
+    return get_layer_type(p.quic)
+
+
+def get_layer_type(layer) -> PacketType:
+    if layer.header_form == "0":
         return PacketType.ONERTT
-    if p.quic.version == "0x00000000":
+    if layer.version == "0x00000000":
         return PacketType.VERSIONNEGOTIATION
-    if p.quic.version == QUIC_V2:
+    if layer.version == QUIC_V2:
         for t, num in WIRESHARK_PACKET_TYPES_V2.items():
-            if p.quic.long_packet_type_v2 == num:
+            if layer.long_packet_type_v2 == num:
                 return t
         return PacketType.INVALID
     for t, num in WIRESHARK_PACKET_TYPES.items():
-        if p.quic.long_packet_type == num:
+        if layer.long_packet_type == num:
             return t
     return PacketType.INVALID
 
 
+# Fields read_pcap extracts itself, without tshark. None of them need the
+# packets to be decrypted. read_pcap never decrypts, so nothing fails to.
+PCAP_FIELDS = [
+    "frame.time_epoch",
+    "frame.number",
+    "ip.src",
+    "ip.dst",
+    "ip.dsfield.ecn",
+    "ipv6.src",
+    "ipv6.dst",
+    "ipv6.tclass.ecn",
+    "udp.srcport",
+    "udp.dstport",
+    "udp.length",
+    "quic.header_form",
+    "quic.version",
+    "quic.long.packet_type",
+    "quic.long.packet_type_v2",
+    "quic.dcid",
+    "quic.scid",
+    "quic.token_length",
+    "quic.token",
+    "quic.retry_token",
+    "quic.length",
+    "quic.decryption_failed",
+]
+
+# pyshark attribute names that don't follow the "<layer>.<name>" scheme
+PYSHARK_FIELD_NAMES = {
+    "long_packet_type": "quic.long.packet_type",
+    "long_packet_type_v2": "quic.long.packet_type_v2",
+    "crypto_offset": "quic.crypto.offset",
+    "crypto_length": "quic.crypto.length",
+    "key_phase": "quic.key_phase",
+    "packet_number": "quic.packet_number",
+    "token_length": "quic.token_length",
+    "retry_token": "quic.retry_token",
+    "remaining_payload": "quic.remaining_payload",
+    "protected_payload": "quic.protected_payload",
+    "decryption_failed": "quic.decryption_failed",
+    "tls_handshake_type": "tls.handshake.type",
+    "tls_handshake_ciphersuite": "tls.handshake.ciphersuite",
+    "tls_handshake_certificates_length": "tls.handshake.certificates_length",
+}
+
+# tshark reports all occurrences of a field in a datagram in one column.
+# Fields that occur once per QUIC packet are handed out to the coalesced
+# packets in order, skipping the packet types that don't carry them, if every
+# packet they belong to has them. Other QUIC and TLS fields of coalesced
+# packets are only known if the datagram was dissected packet by packet (see
+# _split_coalesced). Fields of all other layers are shared by every QUIC
+# packet of the datagram.
+_LAYER_PROTOCOLS = ["quic", "tls"]
+# separates the values of the coalesced QUIC packets in a column
+_LAYER_SEPARATOR = "\x1e"
+# how many rows _split_coalesced holds back at most. Coalesced packets come
+# in bursts (mostly during the handshake), so one batch usually has them all.
+_COALESCED_BATCH = 1024
+_LONG_HEADER_TYPES = {
+    PacketType.INITIAL,
+    PacketType.ZERORTT,
+    PacketType.HANDSHAKE,
+    PacketType.RETRY,
+    PacketType.VERSIONNEGOTIATION,
+}
+_QUIC_HEADER_FIELDS = [
+    "quic.header_form",
+    "quic.version",
+    "quic.long.packet_type",
+    "quic.long.packet_type_v2",
+]
+_QUIC_PACKET_FIELDS = {
+    "quic.scid": _LONG_HEADER_TYPES,
+    "quic.dcid": set(PacketType),
+    "quic.packet_number": {
+        PacketType.INITIAL,
+        PacketType.ZERORTT,
+        PacketType.HANDSHAKE,
+        PacketType.ONERTT,
+    },
+    "quic.key_phase": {PacketType.ONERTT},
+    "quic.token_length": {PacketType.INITIAL},
+    "quic.token": {PacketType.INITIAL},
+    "quic.retry_token": {PacketType.RETRY},
+    "quic.payload": {
+        PacketType.INITIAL,
+        PacketType.ZERORTT,
+        PacketType.HANDSHAKE,
+        PacketType.ONERTT,
+    },
+    "quic.remaining_payload": _LONG_HEADER_TYPES,
+    "quic.protected_payload": {PacketType.ONERTT},
+}
+
+
+class _FieldLayer:
+    """A protocol layer of a _FieldPacket, read like a pyshark layer.
+
+    A QUIC layer has values of its own. If it was coalesced with other QUIC
+    packets, QUIC and TLS fields that aren't among them are missing.
+    """
+
+    __slots__ = ("layer_name", "_packet", "_values", "_coalesced")
+
+    def __init__(
+        self,
+        layer_name: str,
+        packet: "_FieldPacket",
+        values: Optional[Dict] = None,
+        coalesced: bool = False,
+    ):
+        self.layer_name = layer_name
+        self._packet = packet
+        self._values = values
+        self._coalesced = coalesced
+
+    def __getattr__(self, name: str) -> str:
+        field = PYSHARK_FIELD_NAMES.get(name)
+        if field is None:
+            field = name
+            if field not in self._packet.columns:
+                field = self.layer_name + "." + name
+        value = None
+        if self._values is not None:
+            value = self._values.get(field)
+        if value is None and not (
+            self._coalesced and field.split(".", 1)[0] in _LAYER_PROTOCOLS
+        ):
+            value = self._packet.get_field(field)
+        if not value:
+            raise AttributeError(name)
+        return value
+
+    def __repr__(self) -> str:
+        return "<%s Layer>" % self.layer_name.upper()
+
+
+class _FieldPacket:
+    """One row of tshark field output, read like a pyshark packet."""
+
+    __slots__ = ("columns", "_row", "layers")
+
+    def __init__(self, columns: Dict[str, int], row: Tuple[str, ...]):
+        self.columns = columns
+        self._row = row
+        self.layers = [
+            _FieldLayer(name, self)
+            for name, field in [
+                ("ip", "ip.src"),
+                ("ipv6", "ipv6.src"),
+                ("udp", "udp.srcport"),
+            ]
+            if self.get_field(field)
+        ]
+        self.layers += self._split_quic()
+
+    def get_values(self, field: str) -> List[str]:
+        """Get all occurrences of a field."""
+        i = self.columns.get(field)
+        if i is None or not self._row[i]:
+            return []
+        if _LAYER_SEPARATOR not in self._row[i]:
+            return self._row[i].split(",")
+        return [
+            v
+            for values in self._row[i].split(_LAYER_SEPARATOR)
+            if values
+            for v in values.split(",")
+        ]
+
+    def get_field(self, field: str) -> str:
+        """Get the first occurrence of a field, like pyshark does."""
+        values = self.get_values(field)
+        return values[0] if values else ""
+
+    def _get_layer_values(self, field: str) -> Optional[List[str]]:
+        """Get the values of a field of every QUIC packet, if they are known."""
+        i = self.columns.get(field)
+        if i is None or _LAYER_SEPARATOR not in self._row[i]:
+            return None
+        return self._row[i].split(_LAYER_SEPARATOR)
+
+    def _split_quic(self) -> List[_FieldLayer]:
+        forms = self._get_layer_values("quic.header_form")
+        if forms is not None:
+            values = [{} for _ in forms]
+            for field in self.columns:
+                layer_values = self._get_layer_values(field) or []
+                for v, layer_value in zip(values, layer_values):
+                    if layer_value:
+                        v[field] = layer_value.split(",", 1)[0]
+            for v in values:
+                form = v.get("quic.header_form")
+                v["quic.header_form"] = "1" if form in ["1", "True"] else "0"
+            return [_FieldLayer("quic", self, v, coalesced=True) for v in values]
+
+        forms = [
+            "1" if f in ["1", "True"] else "0"
+            for f in self.get_values("quic.header_form")
+        ]
+        values = [{"quic.header_form": f} for f in forms]
+
+        def assign(field: str, indices: List[int]):
+            occurrences = self.get_values(field)
+            if len(occurrences) != len(indices):
+                return  # can't tell which packets have the field
+            for i, value in zip(indices, occurrences):
+                values[i][field] = value
+
+        long_header = [i for i, f in enumerate(forms) if f == "1"]
+        assign("quic.version", long_header)
+        assign(
+            "quic.long.packet_type_v2",
+            [i for i in long_header if values[i].get("quic.version") == QUIC_V2],
+        )
+        assign(
+            "quic.long.packet_type",
+            [
+                i
+                for i in long_header
+                if values[i].get("quic.version") not in ["0x00000000", QUIC_V2]
+            ],
+        )
+        coalesced = len(values) > 1
+        layers = [_FieldLayer("quic", self, v, coalesced) for v in values]
+        types = []
+        for layer in layers:
+            try:
+                types.append(get_layer_type(layer))
+            except AttributeError:
+                types.append(PacketType.INVALID)
+        for field, packet_types in _QUIC_PACKET_FIELDS.items():
+            assign(field, [i for i, t in enumerate(types) if t in packet_types])
+        return layers
+
+    @property
+    def sniff_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(
+            float(self.get_field("frame.time_epoch"))
+        )
+
+    def __getitem__(self, name: str) -> _FieldLayer:
+        for layer in self.layers:
+            if layer.layer_name == name:
+                return layer
+        raise KeyError(name)
+
+    def __getattr__(self, name: str) -> _FieldLayer:
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _tshark_cmd(filename: str, keylog_file: Optional[str]) -> List[str]:
+    cmd = ["tshark", "-n", "-r", filename]
+    cmd += ["--disable-protocol", "http3", "-d", "udp.port==443,quic"]
+    if keylog_file is not None:
+        cmd += ["-o", "tls.keylog_file:" + keylog_file]
+    return cmd
+
+
+def read_fields(
+    filename: str,
+    fields: List[str],
+    display_filter: str,
+    keylog_file: Optional[str] = None,
+) -> Iterator[Tuple[str, ...]]:
+    """Run tshark once and stream one tuple of field values per packet."""
+    cmd = _tshark_cmd(filename, keylog_file) + ["-Y", display_filter]
+    cmd += ["-T", "fields", "-E", "separator=/t", "-E", "occurrence=a"]
+    cmd += ["-E", "aggregator=,"]
+    for field in fields:
+        cmd += ["-e", field]
+    logging.debug("Command: %s", " ".join(cmd))
+    with tempfile.TemporaryFile() as stderr:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        try:
+            for line in p.stdout:
+                yield tuple(line.rstrip("\n").split("\t"))
+        finally:
+            p.stdout.close()
+            p.wait()
+            # tshark exits with an error if the pcap has been cut short in the
+            # middle of a packet. All packets before that one are still usable.
+            if p.returncode != 0:
+                stderr.seek(0)
+                logging.debug(
+                    "tshark exited with %d: %s",
+                    p.returncode,
+                    stderr.read().decode("utf-8", "replace"),
+                )
+
+
+class _JsonObject(list):
+    """The (key, value) pairs of a JSON object. tshark's JSON repeats keys."""
+
+
+def _collect_json(obj: _JsonObject, values: Dict[str, List[str]]):
+    """Collect the values of all fields in a subtree of tshark's JSON output."""
+    for key, value in obj:
+        for v in value if type(value) is list else [value]:
+            if isinstance(v, _JsonObject):
+                _collect_json(v, values)
+            elif isinstance(v, str):
+                values.setdefault(key, []).append(v)
+
+
+def _json_quic_layers(layers: _JsonObject) -> List[Dict[str, List[str]]]:
+    packets = []
+    for name, tree in layers:
+        if name not in _LAYER_PROTOCOLS:
+            continue
+        for t in tree if type(tree) is list else [tree]:
+            if name == "quic":
+                packets.append({})
+            if packets:
+                # TLS messages belong to the QUIC packet before them
+                _collect_json(t, packets[-1])
+    return packets
+
+
+def read_quic_layers(
+    filename: str, frames: List[int], keylog_file: Optional[str] = None
+) -> Dict[int, List[Dict[str, List[str]]]]:
+    """Dissect the given frames with tshark, and get the fields of every QUIC
+    packet in them, by frame number.
+
+    tshark stops reading after the last of the frames.
+    """
+    cmd = _tshark_cmd(filename, keylog_file) + ["-c", str(max(frames))]
+    cmd += ["-Y", "frame.number in {%s}" % " ".join(str(f) for f in frames)]
+    cmd += ["-T", "json"]
+    logging.debug("Command: %s", " ".join(cmd))
+    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        packets = json.loads(p.stdout, object_pairs_hook=_JsonObject)
+    except ValueError:
+        logging.debug("tshark exited with %d: %s", p.returncode, p.stderr)
+        return {}
+    result = {}
+    for packet in packets:
+        layers = dict(dict(packet)["_source"])["layers"]
+        frame = {}
+        _collect_json(dict(layers)["frame"], frame)
+        result[int(frame["frame.number"][0])] = _json_quic_layers(layers)
+    return result
+
+
+def _split_coalesced(
+    fields: List[str],
+    rows: Iterable[Tuple[str, ...]],
+    read_layers: Callable[[List[int]], Dict[int, List[Dict[str, List[str]]]]],
+) -> Iterator[Tuple[str, ...]]:
+    """Give the QUIC and TLS fields of coalesced QUIC packets packet by packet.
+
+    The rows of datagrams with more than one QUIC packet don't tell which
+    packet the values of a field belong to. read_layers dissects those
+    datagrams again (by frame number), and their QUIC and TLS columns get
+    the values of every packet, separated by _LAYER_SEPARATOR.
+    The rows are passed on as they come. From a coalesced datagram on, up to
+    _COALESCED_BATCH rows are held back, and the coalesced datagrams among
+    them are dissected again together.
+    """
+    forms = fields.index("quic.header_form")
+    numbers = fields.index("frame.number")
+    columns = [
+        i for i, f in enumerate(fields) if f.split(".", 1)[0] in _LAYER_PROTOCOLS
+    ]
+
+    def split(pending: List[Tuple[str, ...]], frames: List[int]):
+        layers = read_layers(frames)
+        for row in pending:
+            packets = layers.get(int(row[numbers])) if "," in row[forms] else None
+            if packets is None or len(packets) != len(row[forms].split(",")):
+                yield row
+                continue
+            row = list(row)
+            for i in columns:
+                row[i] = _LAYER_SEPARATOR.join(
+                    ",".join(p.get(fields[i], [])) for p in packets
+                )
+            yield tuple(row)
+
+    pending = []
+    frames = []
+    for row in rows:
+        if "," in row[forms]:
+            frames.append(int(row[numbers]))
+        if len(frames) == 0:
+            yield row
+            continue
+        pending.append(row)
+        if len(pending) == _COALESCED_BATCH:
+            yield from split(pending, frames)
+            pending, frames = [], []
+    if len(frames) > 0:
+        yield from split(pending, frames)
+
+
+# pcap magic number -> byte order and timestamp resolution
+_PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+_PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+_PCAPNG_INTERFACE_DESCRIPTION = 1
+_PCAPNG_ENHANCED_PACKET = 6
+
+
+def _read_pcapng_frames(buf: memoryview) -> Iterator[Tuple[float, int, memoryview]]:
+    endian = "<"
+    interfaces = []
+    offset = 0
+    while offset + 12 <= len(buf):
+        (block_type,) = struct.unpack_from(endian + "I", buf, offset)
+        if block_type == _PCAPNG_SECTION_HEADER:
+            (byte_order_magic,) = struct.unpack_from("<I", buf, offset + 8)
+            endian = "<" if byte_order_magic == 0x1A2B3C4D else ">"
+            interfaces = []
+        (block_len,) = struct.unpack_from(endian + "I", buf, offset + 4)
+        if block_len < 12 or offset + block_len > len(buf):
+            break  # cut short
+        body = offset + 8
+        if block_type == _PCAPNG_INTERFACE_DESCRIPTION:
+            (linktype,) = struct.unpack_from(endian + "H", buf, body)
+            resolution = 1e-6
+            opt = body + 8
+            while opt + 4 <= offset + block_len - 4:
+                code, length = struct.unpack_from(endian + "HH", buf, opt)
+                if code == 0:
+                    break
+                if code == 9 and length == 1:  # if_tsresol
+                    v = buf[opt + 4]
+                    resolution = 2.0 ** -(v & 0x7F) if v & 0x80 else 10.0**-v
+                opt += 4 + (length + 3) // 4 * 4
+            interfaces.append((linktype, resolution))
+        elif block_type == _PCAPNG_ENHANCED_PACKET:
+            iface, ts_high, ts_low, cap_len = struct.unpack_from(
+                endian + "IIII", buf, body
+            )
+            linktype, resolution = interfaces[iface]
+            ts = ((ts_high << 32) | ts_low) * resolution
+            start = body + 20
+            yield ts, linktype, buf[start:][:cap_len]
+        offset += block_len
+
+
+def _read_frames(buf: memoryview) -> Iterator[Tuple[float, int, memoryview]]:
+    """Iterate over the (timestamp, link type, frame) of a pcap or pcapng file."""
+    magic = bytes(buf[:4])
+    if magic in _PCAP_MAGIC:
+        endian, resolution = _PCAP_MAGIC[magic]
+        (linktype,) = struct.unpack_from(endian + "I", buf, 20)
+        offset = 24
+        while offset + 16 <= len(buf):
+            sec, frac, cap_len, _ = struct.unpack_from(endian + "IIII", buf, offset)
+            offset += 16
+            if offset + cap_len > len(buf):
+                break  # cut short
+            yield sec + frac * resolution, linktype & 0xFFFF, buf[offset:][:cap_len]
+            offset += cap_len
+    elif struct.unpack_from("<I", buf)[0] == _PCAPNG_SECTION_HEADER:
+        yield from _read_pcapng_frames(buf)
+    else:
+        raise Exception("unknown capture file format: " + magic.hex())
+
+
+def _get_ip_packet(linktype: int, frame: memoryview) -> Optional[memoryview]:
+    """Strip the link layer header."""
+    if linktype == 1:  # Ethernet
+        offset = 12
+        (ethertype,) = struct.unpack_from("!H", frame, offset)
+        while ethertype in [0x8100, 0x88A8]:  # VLAN tags
+            offset += 4
+            (ethertype,) = struct.unpack_from("!H", frame, offset)
+        offset += 2
+        return frame[offset:] if ethertype in [0x0800, 0x86DD] else None
+    if linktype in [101, 228, 229]:  # raw IP
+        return frame
+    if linktype == 0:  # BSD loopback
+        return frame[4:]
+    if linktype == 113:  # Linux cooked capture
+        return frame[16:]
+    if linktype == 276:  # Linux cooked capture v2
+        return frame[20:]
+    return None
+
+
+def _varint(buf: memoryview, offset: int) -> Tuple[int, int]:
+    length = 1 << (buf[offset] >> 6)
+    if offset + length > len(buf):
+        raise IndexError("truncated varint")
+    value = buf[offset] & 0x3F
+    for i in range(1, length):
+        value = (value << 8) | buf[offset + i]
+    return value, offset + length
+
+
+def _read_cid(buf: memoryview, offset: int) -> Tuple[bytes, int]:
+    length = buf[offset]
+    offset += 1
+    if offset + length > len(buf):
+        raise IndexError("truncated connection ID")
+    return bytes(buf[offset:][:length]), offset + length
+
+
+def _parse_quic(data: memoryview, cids: set) -> List[Dict[str, str]]:
+    """Parse the invariant headers of all QUIC packets coalesced in a datagram.
+
+    Header protection doesn't cover any of these fields. The DCID of short
+    header packets has no length on the wire, so it is only known if it is one
+    of the connection IDs seen in long header packets before.
+    """
+    packets = []
+    offset = 0
+    try:
+        while offset < len(data):
+            first = data[offset]
+            if packets and not first & 0x40:
+                break  # padding after coalesced packets
+            if not first & 0x80:
+                fields = {"quic.header_form": "0"}
+                header = data[offset:]
+                for cid in sorted(cids, key=len, reverse=True):
+                    if header[1:][: len(cid)] == cid:
+                        fields["quic.dcid"] = cid.hex()
+                        break
+                packets.append(fields)
+                break
+            (version,) = struct.unpack_from("!I", data, offset + 1)
+            offset += 5
+            dcid, offset = _read_cid(data, offset)
+            scid, offset = _read_cid(data, offset)
+            cids.update(c for c in [dcid, scid] if c)
+            fields = {
+                "quic.header_form": "1",
+                "quic.version": "0x%08x" % version,
+                "quic.dcid": dcid.hex(),
+                "quic.scid": scid.hex(),
+            }
+            packets.append(fields)
+            if version == 0:
+                break  # Version Negotiation
+            long_packet_type = (first & 0x30) >> 4
+            if "0x%08x" % version == QUIC_V2:
+                fields["quic.long.packet_type_v2"] = str(long_packet_type)
+                packet_type = WIRESHARK_PACKET_TYPES_V2
+            elif version == 1:
+                fields["quic.long.packet_type"] = str(long_packet_type)
+                packet_type = WIRESHARK_PACKET_TYPES
+            else:
+                break  # unknown version, can't find the end of the packet
+            if str(long_packet_type) == packet_type[PacketType.RETRY]:
+                # the Retry token is followed by a 16 byte integrity tag
+                fields["quic.retry_token"] = bytes(data[offset:-16]).hex()
+                break
+            if str(long_packet_type) == packet_type[PacketType.INITIAL]:
+                token_length, offset = _varint(data, offset)
+                fields["quic.token_length"] = str(token_length)
+                if token_length > 0:
+                    token = data[offset:][:token_length]
+                    fields["quic.token"] = bytes(token).hex()
+                offset += token_length
+            length, offset = _varint(data, offset)
+            fields["quic.length"] = str(length)
+            offset += length
+    except (IndexError, struct.error):
+        pass  # truncated or corrupted packet
+    return packets
+
+
+def read_pcap(filename: str, fields: List[str]) -> Iterator[Tuple[str, ...]]:
+    """Read the QUIC packets of a pcap or pcapng file without tshark.
+
+    Produces the same rows as read_fields with a "quic && !icmp" filter, as
+    long as all fields are PCAP_FIELDS. UDP datagrams from or to port 443 are
+    treated as QUIC.
+    """
+    if os.path.getsize(filename) == 0:
+        return
+    cids = set()
+    with open(filename, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            buf = memoryview(m)
+            frames = _read_frames(buf)
+            try:
+                for number, (ts, linktype, frame) in enumerate(frames, 1):
+                    row = _read_frame(ts, linktype, frame, cids)
+                    if row is not None:
+                        row["frame.number"] = [str(number)]
+                        yield tuple(",".join(row.get(f, [])) for f in fields)
+            finally:
+                # all views into the mapping need to be gone before closing it
+                frames.close()
+                frame = None
+                buf.release()
+
+
+def _read_frame(
+    ts: float, linktype: int, frame: memoryview, cids: set
+) -> Optional[Dict[str, List[str]]]:
+    try:
+        ip = _get_ip_packet(linktype, frame)
+        if ip is None or len(ip) == 0:
+            return None
+        row = {"frame.time_epoch": ["%.9f" % ts]}
+        if ip[0] >> 4 == 4:
+            header_len = (ip[0] & 0x0F) * 4
+            flags_offset, protocol = struct.unpack_from("!HxB", ip, 6)
+            if protocol != 17 or flags_offset & 0x3FFF:
+                return None  # not UDP, or a fragment
+            row["ip.src"] = [socket.inet_ntop(socket.AF_INET, ip[12:16])]
+            row["ip.dst"] = [socket.inet_ntop(socket.AF_INET, ip[16:20])]
+            row["ip.dsfield.ecn"] = [str(ip[1] & 0x03)]
+        elif ip[0] >> 4 == 6:
+            header_len = 40
+            if ip[6] != 17:
+                return None  # not UDP, or extension headers
+            row["ipv6.src"] = [socket.inet_ntop(socket.AF_INET6, ip[8:24])]
+            row["ipv6.dst"] = [socket.inet_ntop(socket.AF_INET6, ip[24:40])]
+            row["ipv6.tclass.ecn"] = [str((ip[1] >> 4) & 0x03)]
+        else:
+            return None
+        src_port, dst_port, udp_length = struct.unpack_from("!HHH", ip, header_len)
+        if 443 not in [src_port, dst_port]:
+            return None
+        row["udp.srcport"] = [str(src_port)]
+        row["udp.dstport"] = [str(dst_port)]
+        row["udp.length"] = [str(udp_length)]
+        udp = ip[header_len:][:udp_length]
+        packets = _parse_quic(udp[8:], cids)
+    except (IndexError, struct.error, ValueError):
+        return None  # truncated frame
+    if len(packets) == 0:
+        return None
+    for p in packets:
+        for field, value in p.items():
+            row.setdefault(field, []).append(value)
+    return row
+
+
+def _file_digest(filename: Optional[str]) -> str:
+    if filename is None or not os.path.isfile(filename):
+        return ""
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def tshark_version() -> str:
+    try:
+        r = subprocess.run(["tshark", "--version"], capture_output=True, text=True)
+    except OSError:
+        return ""
+    return r.stdout.split("\n", 1)[0]
+
+
+def _load_npz(filename: str) -> Dict[str, np.ndarray]:
+    """Memory-map the arrays of an uncompressed .npz file."""
+    arrays = {}
+    with open(filename, "rb") as f, zipfile.ZipFile(f) as z:
+        for info in z.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("compressed member: " + info.filename)
+            # the array data follows the local file header and the npy header
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", f.read(4))
+            f.seek(name_len + extra_len, os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            name = info.filename[: -len(".npy")]
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype)  # can't map 0 bytes
+                continue
+            arrays[name] = np.memmap(
+                filename,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+class _TraceCache:
+    """Columnar on-disk cache of the field rows of one trace.
+
+    The cache lives next to the pcap, in an uncompressed .npz. Every field is
+    stored as the UTF-8 bytes of all its values plus the offsets into them,
+    so loading it only memory-maps the file. The cache is valid as long as
+    the pcap, the keylog file and the reader (tshark version) are unchanged.
+    A request for fields that aren't cached re-dissects the trace once for
+    the cached and the requested fields together, so that checks reading the
+    same trace don't keep evicting each other.
+    """
+
+    def __init__(self, filename: str, keylog_file: Optional[str]):
+        self._filename = filename + ".npz"
+        self._digests = {
+            "pcap": _file_digest(filename),
+            "keylog": _file_digest(keylog_file),
+        }
+        self._meta = None
+        self._arrays = {}
+        if not os.path.isfile(self._filename):
+            return
+        try:
+            self._arrays = _load_npz(self._filename)
+            self._meta = json.loads(self._arrays.pop("meta").tobytes())
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logging.debug("Ignoring trace cache %s: %s", self._filename, e)
+            self._arrays = {}
+            self._meta = None
+
+    def fields(self) -> List[str]:
+        """Get the cached fields, if they belong to this pcap and keylog file."""
+        if self._meta is None:
+            return []
+        if any(self._meta.get(k) != v for k, v in self._digests.items()):
+            return []
+        return self._meta["fields"]
+
+    def get_rows(self, fields: List[str], reader: str) -> Optional[Iterator[Tuple]]:
+        """Get the rows of the given fields, or None if they aren't cached."""
+        cached = self.fields()
+        if len(cached) == 0 or self._meta.get("reader") != reader:
+            return None
+        if any(f not in cached for f in fields):
+            return None
+        logging.debug("Reading %s from the trace cache.", ", ".join(fields))
+        columns = [
+            (self._arrays["%d.data" % i], self._arrays["%d.offsets" % i].tolist())
+            for i in [cached.index(f) for f in fields]
+        ]
+        return self._iter_rows(columns)
+
+    @staticmethod
+    def _iter_rows(columns: List[Tuple[np.ndarray, List[int]]]) -> Iterator[Tuple]:
+        # decode the values row by row, the mapped data is paged in as needed
+        for i in range(len(columns[0][1]) - 1):
+            row = []
+            for data, offsets in columns:
+                start, end = offsets[i], offsets[i + 1]
+                row.append(data[start:end].tobytes().decode())
+            yield tuple(row)
+
+    def put_rows(
+        self, fields: List[str], reader: str, rows: Iterable[Tuple]
+    ) -> Iterator[Tuple]:
+        """Pass the rows on, and cache them once they have all been read.
+
+        The values are spooled to temporary files, column by column, so the
+        rows are never all in memory at once.
+        """
+        directory = os.path.dirname(self._filename) or "."
+        with contextlib.ExitStack() as stack:
+            try:
+                spools = [
+                    (
+                        stack.enter_context(tempfile.TemporaryFile(dir=directory)),
+                        stack.enter_context(tempfile.TemporaryFile(dir=directory)),
+                    )
+                    for _ in fields
+                ]
+            except OSError as e:
+                logging.debug("Couldn't write trace cache %s: %s", self._filename, e)
+                yield from rows
+                return
+            ends = [0] * len(fields)
+            for _, offsets in spools:
+                offsets.write(struct.pack("<q", 0))
+            for row in rows:
+                for i, value in enumerate(row):
+                    data, offsets = spools[i]
+                    ends[i] += data.write(value.encode())
+                    offsets.write(struct.pack("<q", ends[i]))
+                yield row
+            self._write(fields, reader, spools)
+
+    def _write(self, fields: List[str], reader: str, spools: List[Tuple]):
+        meta = dict(self._digests, reader=reader, fields=fields)
+        arrays = {"meta": np.frombuffer(json.dumps(meta).encode(), np.uint8)}
+        for i, (data, offsets) in enumerate(spools):
+            data.flush()
+            offsets.flush()
+            if data.tell() == 0:
+                arrays["%d.data" % i] = np.empty(0, np.uint8)  # can't map 0 bytes
+            else:
+                arrays["%d.data" % i] = np.memmap(data, np.uint8, mode="r")
+            arrays["%d.offsets" % i] = np.memmap(offsets, "<i8", mode="r")
+        # write to a temporary file first, so that readers never see half a cache
+        tmp = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(self._filename) or ".", delete=False
+            ) as f:
+                tmp = f.name
+                np.savez(f, **arrays)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self._filename)
+        except OSError as e:
+            logging.debug("Couldn't write trace cache %s: %s", self._filename, e)
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+
+
+class Frame(Flag):
+    """Frames found in a Packet. Only frames whose fields were dissected show up."""
+
+    NONE = 0
+    CRYPTO = 1
+    ACK_ECN = 2
+    PATH_CHALLENGE = 4
+    PATH_RESPONSE = 8
+
+
+# field that is present whenever a packet contains the frame
+_FRAME_FIELDS = {
+    "quic.crypto.offset": Frame.CRYPTO,
+    "quic.ack.ect0_count": Frame.ACK_ECN,
+    "quic.path_challenge.data": Frame.PATH_CHALLENGE,
+    "quic.path_response.data": Frame.PATH_RESPONSE,
+}
+
+# fields that end up in a typed Packet attribute, not in Packet.fields
+_PACKET_FIELDS = TSHARK_FIELDS + [
+    "quic.packet_number",
+    "quic.key_phase",
+    "quic.payload",
+    "quic.remaining_payload",
+    "quic.protected_payload",
+]
+
+
+class Packet:
+    """A QUIC packet, with the fields the checks read.
+
+    Coalesced QUIC packets are separate Packets, with the same datagram
+    number and the same IP and UDP fields. Fields that weren't dissected (or
+    that the packet doesn't have) are None. fields holds the values of all
+    other fields declared in TestCase.trace_fields(), see get().
+    """
+
+    __slots__ = (
+        "datagram",
+        "time",
+        "direction",
+        "packet_type",
+        "version",
+        "scid",
+        "dcid",
+        "packet_number",
+        "key_phase",
+        "src",
+        "dst",
+        "src_port",
+        "dst_port",
+        "udp_length",
+        "ecn",
+        "payload_length",
+        "frames",
+        "fields",
+    )
+
+    def __init__(
+        self,
+        datagram: int,
+        time: float,
+        direction: Direction,
+        packet_type: PacketType,
+        version: Optional[int] = None,
+        scid: Optional[str] = None,
+        dcid: Optional[str] = None,
+        packet_number: Optional[int] = None,
+        key_phase: Optional[int] = None,
+        src: str = "",
+        dst: str = "",
+        src_port: int = 0,
+        dst_port: int = 0,
+        udp_length: int = 0,
+        ecn: Optional[int] = None,
+        payload_length: Optional[int] = None,
+        frames: Frame = Frame.NONE,
+        fields: Optional[Dict[str, str]] = None,
+    ):
+        self.datagram = datagram
+        self.time = time
+        self.direction = direction
+        self.packet_type = packet_type
+        self.version = version
+        self.scid = scid
+        self.dcid = dcid
+        self.packet_number = packet_number
+        self.key_phase = key_phase
+        self.src = src
+        self.dst = dst
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.udp_length = udp_length
+        self.ecn = ecn
+        self.payload_length = payload_length
+        self.frames = frames
+        self.fields = fields
+
+    @property
+    def sniff_time(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.time)
+
+    @property
+    def ipv6(self) -> bool:
+        return ":" in self.src
+
+    def get(self, field: str) -> str:
+        """Get the (first) value of a declared field, or "" if it's missing."""
+        if self.fields is None:
+            return ""
+        return self.fields.get(field, "")
+
+    def __repr__(self) -> str:
+        return "<Packet %d: %s %s %s:%d -> %s:%d %s>" % (
+            self.datagram,
+            self.packet_type.name,
+            self.direction.name,
+            self.src,
+            self.src_port,
+            self.dst,
+            self.dst_port,
+            self.fields or {},
+        )
+
+
+def _read_value(layer, field: str) -> str:
+    """Read a field of a pyshark or _FieldPacket layer, by its full name."""
+    try:
+        return str(getattr(layer, field))
+    except AttributeError:
+        return ""
+
+
+def _read_int(layer, field: str, base: int = 10) -> Optional[int]:
+    value = _read_value(layer, field)
+    return int(value, base) if value else None
+
+
+def _num_bytes(payload: str) -> int:
+    # pyshark separates bytes with colons, tshark's field output doesn't
+    return len(payload.replace(":", "")) // 2
+
+
+def _to_packets(
+    p, datagram: int, fields: List[str], endpoints: Endpoints = DEFAULT_ENDPOINTS
+) -> List[Packet]:
+    """Convert a packet of any backend to one Packet per QUIC packet."""
+    ip_version = "ipv6" if hasattr(p, "ipv6") else "ip"
+    ip = p[ip_version] if hasattr(p, ip_version) else None
+    ecn_field = "ipv6.tclass.ecn" if ip_version == "ipv6" else "ip.dsfield.ecn"
+    udp = p["udp"]
+    common = {
+        "datagram": datagram,
+        "time": p.sniff_time.timestamp(),
+        "direction": get_direction(p, endpoints),
+        "src": _read_value(ip, ip_version + ".src"),
+        "dst": _read_value(ip, ip_version + ".dst"),
+        "src_port": _read_int(udp, "udp.srcport") or 0,
+        "dst_port": _read_int(udp, "udp.dstport") or 0,
+        "udp_length": _read_int(udp, "udp.length") or 0,
+        "ecn": _read_int(ip, ecn_field),
+    }
+    extra = [f for f in fields if f not in _PACKET_FIELDS]
+    packets = []
+    for layer in p.layers:
+        if layer.layer_name != "quic":
+            continue
+        try:
+            packet_type = get_layer_type(layer)
+        except AttributeError:
+            packet_type = PacketType.INVALID
+        values = {}
+        frames = Frame.NONE
+        for f in extra:
+            layer_name = f.split(".", 1)[0]
+            if layer_name in _LAYER_PROTOCOLS:
+                value = _read_value(layer, f)
+            elif hasattr(p, layer_name):
+                value = _read_value(p[layer_name], f)
+            else:
+                continue
+            if value:
+                values[f] = value
+                frames |= _FRAME_FIELDS.get(f, Frame.NONE)
+        if packet_type == PacketType.ONERTT:
+            payload = _read_value(layer, "quic.protected_payload")
+        else:  # "payload" is only there when keys are available
+            payload = _read_value(layer, "quic.payload") or _read_value(
+                layer, "quic.remaining_payload"
+            )
+        key_phase = None
+        if hasattr(layer, "key_phase"):
+            # pyshark fields have a raw value, the fields backend hands out strings.
+            # Depending on the version, wireshark returns "1" or "True" for a set
+            # key phase bit.
+            kp = getattr(layer.key_phase, "raw_value", layer.key_phase)
+            key_phase = 1 if kp in ["1", "True"] else 0
+        packets.append(
+            Packet(
+                packet_type=packet_type,
+                version=_read_int(layer, "quic.version", 16),
+                scid=_read_value(layer, "quic.scid").replace(":", "") or None,
+                dcid=_read_value(layer, "quic.dcid").replace(":", "") or None,
+                packet_number=_read_int(layer, "quic.packet_number"),
+                key_phase=key_phase,
+                payload_length=_num_bytes(payload) if payload else None,
+                frames=frames,
+                fields=values or None,
+                **common,
+            )
+        )
+    return packets
+
+
+class _TraceIndex:
+    """Index over a single dissection of a trace.
+
+    The dissected packets are converted to Packets. The first QUIC packet of
+    every datagram is grouped by direction, all QUIC packets by direction and
+    packet type (which also separates short from long header packets), and
+    long header packets by their SCID. Direction.ALL holds every datagram, in
+    capture order.
+    """
+
+    def __init__(self, packets: List, fields: List[str], endpoints: Endpoints):
+        self.packets = {d: [] for d in Direction}
+        self.by_type = {}
+        self.scids = {}
+        for datagram, p in enumerate(packets):
+            records = _to_packets(p, datagram, fields, endpoints)
+            if len(records) == 0:
+                continue
+            directions = (Direction.ALL, records[0].direction)
+            for d in directions:
+                self.packets[d].append(records[0])
+            for r in records:
+                for d in directions:
+                    key = (d, r.packet_type)
+                    self.by_type.setdefault(key, []).append(r)
+                    if r.scid is not None:
+                        self.scids.setdefault(key, {}).setdefault(r.scid, []).append(r)
+
+    def get_packets(
+        self, packet_type: PacketType, direction: Direction
+    ) -> List[Packet]:
+        return self.by_type.get((direction, packet_type), [])
+
+
 class TraceAnalyzer:
     _filename = ""
 
-    def __init__(self, filename: str, keylog_file: Optional[str] = None):
+    def __init__(
+        self,
+        filename: str,
+        keylog_file: Optional[str] = None,
+        backend: str = "pyshark",
+        fields: Optional[List[str]] = None,
+        cache: bool = False,
+        embedded_secrets: bool = False,
+        endpoints: Endpoints = DEFAULT_ENDPOINTS,
+    ):
+        """
+        The pyshark backend dissects every packet into a full pyshark object.
+        The fields backend runs tshark once, only extracts TSHARK_FIELDS plus
+        the given fields, and hands out lightweight packets that are read the
+        same way. Datagrams with coalesced QUIC packets are dissected once
+        more, packet by packet (see _split_coalesced). If none of the fields
+        need decryption, it reads the trace itself and doesn't start tshark at
+        all.
+        The sharkd backend works like the fields backend, but asks a pooled
+        sharkd session instead of starting tshark for every trace.
+        With cache set, the fields and sharkd backends keep the extracted
+        fields in a cache file next to the trace (see _TraceCache).
+        embedded_secrets says that the trace is a pcapng file that carries its
+        TLS secrets, so it is decrypted without a key log file.
+        endpoints are the addresses of the client and the server, which tell
+        the directions apart.
+        """
+        if backend not in TRACE_BACKENDS:
+            raise Exception("unknown trace backend: " + backend)
         self._filename = filename
         self._keylog_file = keylog_file
+        self._decrypted = keylog_file is not None or embedded_secrets
+        self._backend = backend
+        self._cache = cache
+        self._rows = None
+        self._fields = TSHARK_FIELDS + [
+            f for f in fields or [] if f not in TSHARK_FIELDS
+        ]
+        self._index = None
+        self._endpoints = endpoints
 
     def _get_direction_filter(self, d: Direction) -> str:
         f = "(quic && !icmp) && "
+        e = self._endpoints
         if d == Direction.FROM_CLIENT:
-            return (
-                f + "(ip.src==" + IP4_CLIENT + " || ipv6.src==" + IP6_CLIENT + ") && "
+            return f + "(ip.src==%s || ipv6.src==%s) && " % (
+                e.client_ip4,
+                e.client_ip6,
             )
         elif d == Direction.FROM_SERVER:
-            return (
-                f + "(ip.src==" + IP4_SERVER + " || ipv6.src==" + IP6_SERVER + ") && "
+            return f + "(ip.src==%s || ipv6.src==%s) && " % (
+                e.server_ip4,
+                e.server_ip6,
             )
         else:
             return f
 
-    def _get_packets(self, f: str) -> List:
+    def _iter_capture(self, f: str) -> Iterator:
         override_prefs = {}
         if self._keylog_file is not None:
             override_prefs["tls.keylog_file"] = self._keylog_file
@@ -107,18 +1277,20 @@ class TraceAnalyzer:
             override_prefs=override_prefs,
             disable_protocol="http3",  # see https://github.com/quic-interop/quic-interop-runner/pull/179
             decode_as={"udp.port==443": "quic"},
+            keep_packets=False,
         )
-        packets = []
         # If the pcap has been cut short in the middle of the packet, pyshark will crash.
         # See https://github.com/KimiNewt/pyshark/issues/390.
         try:
-            for p in cap:
-                packets.append(p)
-            cap.close()
+            yield from cap
         except Exception as e:
             logging.debug(e)
+        finally:
+            cap.close()
 
-        if self._keylog_file is not None:
+    def _get_packets(self, f: str) -> List:
+        packets = list(self._iter_capture(f))
+        if self._decrypted:
             for p in packets:
                 if hasattr(p["quic"], "decryption_failed"):
                     logging.info("At least one QUIC packet could not be decrypted")
@@ -126,79 +1298,290 @@ class TraceAnalyzer:
                     break
         return packets
 
-    def get_raw_packets(self, direction: Direction = Direction.ALL) -> List:
-        packets = []
-        for packet in self._get_packets(self._get_direction_filter(direction) + "quic"):
-            packets.append(packet)
+    def _read_rows(self, fields: List[str], f: str) -> Tuple[str, Iterator[Tuple]]:
+        """Get the name of the reader used for the fields, and its rows."""
+        if all(field in PCAP_FIELDS for field in fields):
+            # nothing that needs decryption, no need to start tshark
+            return "read_pcap", read_pcap(self._filename, fields)
+        if self._backend == "sharkd":
+            rows = read_sharkd(self._filename, fields, f, self._keylog_file)
+            read_layers = read_sharkd_layers
+            reader = SHARKD_POOL.version()
+        else:
+            rows = read_fields(self._filename, fields, f, self._keylog_file)
+            read_layers = read_quic_layers
+            reader = tshark_version()
+        read_layers = functools.partial(
+            read_layers, self._filename, keylog_file=self._keylog_file
+        )
+        return reader, _split_coalesced(fields, rows, read_layers)
+
+    def _get_cached_rows(self, f: str) -> Iterable[Tuple]:
+        cache = _TraceCache(self._filename, self._keylog_file)
+        cached = cache.fields()
+        fields = cached + [field for field in self._fields if field not in cached]
+        reader, rows = self._read_rows(fields, f)
+        if fields == cached:
+            cached_rows = cache.get_rows(self._fields, reader)
+            if cached_rows is not None:
+                rows.close()
+                return cached_rows
+        logging.debug("Trace cache miss for %s.", self._filename)
+        columns = [fields.index(field) for field in self._fields]
+        return (
+            tuple(row[i] for i in columns)
+            for row in cache.put_rows(fields, reader, rows)
+        )
+
+    def _get_rows(self) -> List[Tuple]:
+        f = self._get_direction_filter(Direction.ALL) + "quic"
+        if self._cache:
+            return list(self._get_cached_rows(f))
+        _, rows = self._read_rows(self._fields, f)
+        return list(rows)
+
+    def _get_field_packets(self) -> List[_FieldPacket]:
+        columns = {field: i for i, field in enumerate(self._fields)}
+        rows = self._rows
+        if rows is None:
+            rows = self._get_rows()
+        self._rows = None
+        packets = [_FieldPacket(columns, row) for row in rows]
+        if self._decrypted:
+            for p in packets:
+                if p.get_field("quic.decryption_failed"):
+                    logging.info("At least one QUIC packet could not be decrypted")
+                    break
         return packets
 
-    def get_1rtt(self, direction: Direction = Direction.ALL) -> List:
+    def _get_index(self) -> _TraceIndex:
+        """Dissect the trace on first use. All getters answer from the index."""
+        if self._index is None:
+            if self._backend != "pyshark":
+                packets = self._get_field_packets()
+            else:
+                packets = self._get_packets(
+                    self._get_direction_filter(Direction.ALL) + "quic"
+                )
+            self._index = _TraceIndex(packets, self._fields, self._endpoints)
+        return self._index
+
+    def _stream_packets(self, direction: Direction) -> Iterator:
+        """Dissect the trace again, without keeping the packets."""
+        f = self._get_direction_filter(direction) + "quic"
+        if self._backend != "pyshark":
+            columns = {field: i for i, field in enumerate(self._fields)}
+            if self._rows is not None:
+                rows = self._rows
+            elif self._cache:
+                # the cache holds both directions
+                rows = self._get_cached_rows(
+                    self._get_direction_filter(Direction.ALL) + "quic"
+                )
+            else:
+                _, rows = self._read_rows(self._fields, f)
+            packets = (_FieldPacket(columns, row) for row in rows)
+        else:
+            packets = self._iter_capture(f)
+        decryption_failed = not self._decrypted
+        for p in packets:
+            if (
+                direction != Direction.ALL
+                and get_direction(p, self._endpoints) != direction
+            ):
+                continue
+            if not decryption_failed and hasattr(p["quic"], "decryption_failed"):
+                logging.info("At least one QUIC packet could not be decrypted")
+                decryption_failed = True
+            yield p
+
+    def _stream_records(self, direction: Direction) -> Iterator[List[Packet]]:
+        for datagram, p in enumerate(self._stream_packets(direction)):
+            records = _to_packets(p, datagram, self._fields, self._endpoints)
+            if len(records) > 0:
+                yield records
+
+    def iter_raw_packets(
+        self, direction: Direction = Direction.ALL
+    ) -> Iterator[Packet]:
+        """Stream the first QUIC packet of every datagram, one or both directions.
+
+        The iter_* getters answer from the index if the trace has already been
+        indexed. Otherwise they dissect the trace again, and only hold one
+        datagram at a time (around coalesced packets a batch of them, see
+        _split_coalesced).
+        """
+        if self._index is not None:
+            return iter(self._index.packets[direction])
+        return (records[0] for records in self._stream_records(direction))
+
+    def iter_packets(
+        self, packet_type: PacketType, direction: Direction = Direction.ALL
+    ) -> Iterator[Packet]:
+        """Stream the QUIC packets of one packet type."""
+        if self._index is not None:
+            return iter(self._index.get_packets(packet_type, direction))
+        return (
+            r
+            for records in self._stream_records(direction)
+            for r in records
+            if r.packet_type == packet_type
+        )
+
+    def iter_1rtt(self, direction: Direction = Direction.ALL) -> Iterator[Packet]:
+        return self.iter_packets(PacketType.ONERTT, direction)
+
+    def iter_vnp(self, direction: Direction = Direction.ALL) -> Iterator[Packet]:
+        return self.iter_packets(PacketType.VERSIONNEGOTIATION, direction)
+
+    def iter_initial(self, direction: Direction = Direction.ALL) -> Iterator[Packet]:
+        return self.iter_packets(PacketType.INITIAL, direction)
+
+    def iter_retry(self, direction: Direction = Direction.ALL) -> Iterator[Packet]:
+        return self.iter_packets(PacketType.RETRY, direction)
+
+    def iter_handshake(self, direction: Direction = Direction.ALL) -> Iterator[Packet]:
+        return self.iter_packets(PacketType.HANDSHAKE, direction)
+
+    def iter_0rtt(self) -> Iterator[Packet]:
+        return self.iter_packets(PacketType.ZERORTT, Direction.FROM_CLIENT)
+
+    def iter_by_scid(
+        self,
+        scid: str,
+        packet_type: PacketType,
+        direction: Direction = Direction.ALL,
+    ) -> Iterator[Packet]:
+        return (p for p in self.iter_packets(packet_type, direction) if p.scid == scid)
+
+    def count(
+        self, packet_type: PacketType, direction: Direction = Direction.ALL
+    ) -> int:
+        """Count the QUIC packets of one packet type."""
+        return sum(1 for _ in self.iter_packets(packet_type, direction))
+
+    def get_time_range(
+        self, packet_type: PacketType, direction: Direction = Direction.ALL
+    ) -> Tuple[datetime.datetime, datetime.datetime]:
+        """Get the first and last sniff time of one packet type, or 0, 0."""
+        first = last = None
+        for p in self.iter_packets(packet_type, direction):
+            if first is None:
+                first = p
+            last = p
+        if first is None:
+            return 0, 0
+        return first.sniff_time, last.sniff_time
+
+    def get_scid_set(
+        self, packet_type: PacketType, direction: Direction = Direction.ALL
+    ) -> Set[str]:
+        """Get the distinct SCIDs of one packet type."""
+        return {
+            p.scid
+            for p in self.iter_packets(packet_type, direction)
+            if p.scid is not None
+        }
+
+    def get_1rtt_datagrams(
+        self, direction: Direction = Direction.ALL
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the sniff times (in s) and UDP payload sizes of all datagrams that
+        carry a 1-RTT packet, one or both directions."""
+        # a 1-RTT packet is always the last one in its datagram
+        times, sizes = [], []
+        for p in self.iter_1rtt(direction):
+            times.append(p.time)
+            sizes.append(p.udp_length - 8)
+        return np.array(times, np.float64), np.array(sizes, np.int64)
+
+    def get_raw_packets(self, direction: Direction = Direction.ALL) -> List[Packet]:
+        """Get the first QUIC packet of every datagram, one or both directions."""
+        return list(self._get_index().packets[direction])
+
+    def get_1rtt(self, direction: Direction = Direction.ALL) -> List[Packet]:
         """Get all QUIC packets, one or both directions."""
         packets, _, _ = self.get_1rtt_sniff_times(direction)
         return packets
 
     def get_1rtt_sniff_times(
         self, direction: Direction = Direction.ALL
-    ) -> Tuple[List, datetime.datetime, datetime.datetime]:
+    ) -> Tuple[List[Packet], datetime.datetime, datetime.datetime]:
         """Get all QUIC packets, one or both directions, and first and last sniff times."""
-        packets = []
-        first, last = 0, 0
-        for packet in self._get_packets(
-            self._get_direction_filter(direction) + "quic.header_form==0"
-        ):
-            for layer in packet.layers:
-                if (
-                    layer.layer_name == "quic"
-                    and not hasattr(layer, "long_packet_type")
-                    and not hasattr(layer, "long_packet_type_v2")
-                ):
-                    if first == 0:
-                        first = packet.sniff_time
-                    last = packet.sniff_time
-                    packets.append(layer)
-        return packets, first, last
-
-    def get_vnp(self, direction: Direction = Direction.ALL) -> List:
-        return self._get_packets(
-            self._get_direction_filter(direction) + "quic.version==0"
-        )
+        packets = self._get_packets_of_type(PacketType.ONERTT, direction)
+        if len(packets) == 0:
+            return packets, 0, 0
+        return packets, packets[0].sniff_time, packets[-1].sniff_time
+
+    def get_vnp(self, direction: Direction = Direction.ALL) -> List[Packet]:
+        return self._get_packets_of_type(PacketType.VERSIONNEGOTIATION, direction)
 
-    def _get_long_header_packets(
+    def _get_packets_of_type(
         self, packet_type: PacketType, direction: Direction
-    ) -> List:
-        packets = []
-        for packet in self._get_packets(
-            self._get_direction_filter(direction)
-            + "(quic.long.packet_type || quic.long.packet_type_v2)"
-        ):
-            for layer in packet.layers:
-                if layer.layer_name == "quic" and (
-                    (
-                        hasattr(layer, "long_packet_type")
-                        and layer.long_packet_type
-                        == WIRESHARK_PACKET_TYPES[packet_type]
-                    )
-                    or (
-                        hasattr(layer, "long_packet_type_v2")
-                        and layer.long_packet_type_v2
-                        == WIRESHARK_PACKET_TYPES_V2[packet_type]
-                    )
-                ):
-                    packets.append(layer)
-        return packets
+    ) -> List[Packet]:
+        return list(self._get_index().get_packets(packet_type, direction))
+
+    def get_scids(
+        self, packet_type: PacketType, direction: Direction = Direction.ALL
+    ) -> List[str]:
+        """Get the distinct SCIDs of one packet type, in order of appearance."""
+        return list(self._get_index().scids.get((direction, packet_type), {}))
 
-    def get_initial(self, direction: Direction = Direction.ALL) -> List:
+    def get_by_scid(
+        self,
+        scid: str,
+        packet_type: PacketType,
+        direction: Direction = Direction.ALL,
+    ) -> List[Packet]:
+        """Get all packets of one packet type that carry the given SCID."""
+        scids = self._get_index().scids.get((direction, packet_type), {})
+        return list(scids.get(scid, []))
+
+    def get_initial(self, direction: Direction = Direction.ALL) -> List[Packet]:
         """Get all Initial packets."""
-        return self._get_long_header_packets(PacketType.INITIAL, direction)
+        return self._get_packets_of_type(PacketType.INITIAL, direction)
 
-    def get_retry(self, direction: Direction = Direction.ALL) -> List:
+    def get_retry(self, direction: Direction = Direction.ALL) -> List[Packet]:
         """Get all Retry packets."""
-        return self._get_long_header_packets(PacketType.RETRY, direction)
+        return self._get_packets_of_type(PacketType.RETRY, direction)
 
-    def get_handshake(self, direction: Direction = Direction.ALL) -> List:
+    def get_handshake(self, direction: Direction = Direction.ALL) -> List[Packet]:
         """Get all Handshake packets."""
-        return self._get_long_header_packets(PacketType.HANDSHAKE, direction)
+        return self._get_packets_of_type(PacketType.HANDSHAKE, direction)
 
-    def get_0rtt(self) -> List:
+    def get_0rtt(self) -> List[Packet]:
         """Get all 0-RTT packets."""
-        return self._get_long_header_packets(PacketType.ZERORTT, Direction.FROM_CLIENT)
+        return self._get_packets_of_type(PacketType.ZERORTT, Direction.FROM_CLIENT)
+
+
+def _read_trace_rows(analyzer: TraceAnalyzer) -> List[Tuple]:
+    return analyzer._get_rows()
+
+
+def prefetch(analyzers: List[TraceAnalyzer]):
+    """Dissect several traces at once, in worker processes.
+
+    Only traces read with the fields or sharkd backend are prefetched: their
+    rows are cheap to send back from the workers, pyshark packets are not.
+    sharkd does the dissecting in its own processes, so those traces are read
+    from threads, which share the sharkd pool. If a worker fails, its trace
+    is dissected on first use, as usual.
+    """
+    pending = [
+        a
+        for a in analyzers
+        if a._backend != "pyshark" and a._index is None and a._rows is None
+    ]
+    if len(pending) < 2:
+        return
+    if all(a._backend == "sharkd" for a in pending):
+        executor = concurrent.futures.ThreadPoolExecutor
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor
+    with executor(max_workers=len(pending)) as pool:
+        futures = [pool.submit(_read_trace_rows, a) for a in pending]
+        for analyzer, future in zip(pending, futures):
+            try:
+                analyzer._rows = future.result()
+            except Exception as e:
+                logging.debug("Prefetching %s failed: %s", analyzer._filename, e)